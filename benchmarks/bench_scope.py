@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Per-node cost as the number of variables in scope grows.
+Usage:
+  python3 benchmarks/bench_scope.py --sizes 0 10 100 1000 10000
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import genson as rt  # noqa: E402
+
+
+def make_schema(size, iterations):
+    """A Layer with `size` props around a Delegate whose body enters nested Layers."""
+    body = {
+        'type': 'layer',
+        'props': {'inner': 'x'},
+        'items': {
+            'type': 'seq',
+            'items': [
+                {'type': 'ref', 'to': 'inner'},
+                {'type': 'expr', 'value': {'op': 'get', 'path': 'i'}},
+                {'type': 'set', 'path': 'inner', 'value': 'y'},
+            ]
+        }
+    }
+    return {
+        'type': 'layer',
+        'props': {f'var{n}': n for n in range(size)},
+        'items': {'type': 'delegate', 'weight': iterations, 'value': body}
+    }
+
+
+def count_nodes(iterations):
+    """Nodes evaluated per sample: outer Layer, Delegate, then 5 nodes per iteration."""
+    return 2 + 5 * iterations
+
+
+def measure(run, seconds):
+    run()
+    runs = 0
+    start = time.perf_counter()
+    while True:
+        run()
+        runs += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds:
+            return elapsed / runs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[0, 10, 100, 1000, 10000])
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--seconds', type=float, default=1.0)
+    args = parser.parse_args()
+
+    print(f'{"scope size":>10}  {"evaluate_node ns/node":>22}  {"compiled ns/node":>17}')
+    for size in args.sizes:
+        schema = make_schema(size, args.iterations)
+        nodes = count_nodes(args.iterations)
+        compiled = rt.compile(schema)
+        interpreted = measure(lambda: rt.evaluate_node(schema, rt.create_root_context(1)), args.seconds)
+        precompiled = measure(lambda: compiled.evaluate({'seed': 1}), args.seconds)
+        print(f'{size:>10}  {interpreted / nodes * 1e9:>22.0f}  {precompiled / nodes * 1e9:>17.0f}')
+
+
+if __name__ == '__main__':
+    main()
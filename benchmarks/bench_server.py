@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Request latency and throughput of the generation server (server.py).
+Usage:
+  python3 benchmarks/bench_server.py --spawn
+  python3 benchmarks/bench_server.py --socket /tmp/genson.sock --clients 32 --requests 500
+  python3 benchmarks/bench_server.py --spawn --count 5000 --schema example.json --output results.json
+
+Every client keeps one connection and sends generate requests one after
+another; latency is measured from writing a request to reading its response.
+With --spawn a server is started on a temporary Unix socket and stopped at
+the end.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from bench_suite import percentile  # noqa: E402
+
+
+async def connect(args):
+    if args.socket:
+        return await asyncio.open_unix_connection(args.socket, limit=1 << 26)
+    return await asyncio.open_connection(args.host, args.port, limit=1 << 26)
+
+
+async def call(reader, writer, request):
+    writer.write((json.dumps(request) + '\n').encode('utf-8'))
+    await writer.drain()
+    response = json.loads(await reader.readline())
+    if 'error' in response:
+        raise RuntimeError(f'server error: {response["error"]}')
+    return response
+
+
+async def client(args, index, latencies):
+    reader, writer = await connect(args)
+    try:
+        for n in range(args.requests):
+            request = {'id': n, 'op': 'generate', 'schema': 'bench', 'n': args.count,
+                       'seed': index * args.requests + n}
+            start = time.perf_counter()
+            await call(reader, writer, request)
+            latencies.append(time.perf_counter() - start)
+    finally:
+        writer.close()
+
+
+async def run(args):
+    reader, writer = await connect(args)
+    try:
+        await call(reader, writer, {'op': 'load', 'name': 'bench', 'path': os.path.abspath(args.schema)})
+        # Warm the workers up
+        await call(reader, writer, {'op': 'generate', 'schema': 'bench', 'n': args.count, 'seed': 0})
+    finally:
+        writer.close()
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*[client(args, index, latencies) for index in range(args.clients)])
+    return latencies, time.perf_counter() - start
+
+
+async def wait_for_socket(path, process, timeout=30.0):
+    deadline = time.perf_counter() + timeout
+    while not os.path.exists(path):
+        if process.poll() is not None:
+            raise RuntimeError(f'server exited with status {process.returncode}')
+        if time.perf_counter() > deadline:
+            raise RuntimeError('server did not start')
+        await asyncio.sleep(0.05)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--socket', metavar='PATH', help='Unix socket of a running server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7878)
+    parser.add_argument('--spawn', action='store_true', help='start a server for the run')
+    parser.add_argument('--jobs', type=int, default=0, help='worker processes of a spawned server')
+    parser.add_argument('--schema', default=os.path.join(ROOT, 'example.json'))
+    parser.add_argument('--clients', type=int, default=8, help='concurrent connections')
+    parser.add_argument('--requests', type=int, default=200, help='requests per client')
+    parser.add_argument('--count', type=int, default=1, help='samples per request')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    args = parser.parse_args()
+
+    process = None
+    if args.spawn:
+        args.socket = os.path.join(tempfile.mkdtemp(), 'genson.sock')
+        process = subprocess.Popen([sys.executable, os.path.join(ROOT, 'server.py'),
+                                    '--socket', args.socket, '--jobs', str(args.jobs)])
+    try:
+        if process is not None:
+            asyncio.run(wait_for_socket(args.socket, process))
+        latencies, elapsed = asyncio.run(run(args))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+            os.rmdir(os.path.dirname(args.socket))
+
+    latencies.sort()
+    results = {
+        'clients': args.clients,
+        'requests': len(latencies),
+        'samples_per_request': args.count,
+        'requests_per_sec': len(latencies) / elapsed,
+        'samples_per_sec': len(latencies) * args.count / elapsed,
+        'p50_ms': percentile(latencies, 0.50) * 1e3,
+        'p90_ms': percentile(latencies, 0.90) * 1e3,
+        'p99_ms': percentile(latencies, 0.99) * 1e3,
+    }
+    print(f'{results["requests"]} requests of {args.count} samples from {args.clients} clients in {elapsed:.3f} s')
+    print(f'{results["requests_per_sec"]:.1f} requests/s, {results["samples_per_sec"]:.1f} samples/s')
+    print(f'p50 {results["p50_ms"]:.3f} ms, p90 {results["p90_ms"]:.3f} ms, p99 {results["p99_ms"]:.3f} ms')
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Throughput, latency and memory of genson.evaluate on the stress schemas.
+Usage:
+  python3 benchmarks/bench_suite.py --output results.json
+  python3 benchmarks/bench_suite.py --output results.json --baseline baseline.json
+  python3 benchmarks/bench_suite.py --cases wide_option match_pipeline --seconds 0.5
+
+With --baseline, every case is compared to the saved results and the run
+exits with status 1 if any metric regressed by more than --tolerance.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import genson as rt  # noqa: E402
+from stress_schemas import CASES  # noqa: E402
+
+# Metric name -> True if larger is better
+METRICS = {
+    'samples_per_sec': True,
+    'p50_ms': False,
+    'p90_ms': False,
+    'p99_ms': False,
+    'peak_kib': False,
+}
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an ascending list."""
+    index = min(int(fraction * len(sorted_values)), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def measure(run, seconds, min_samples):
+    """Time run(seed) for at least `seconds` and `min_samples` samples."""
+    run(0)
+    latencies = []
+    start = time.perf_counter()
+    while len(latencies) < min_samples or time.perf_counter() - start < seconds:
+        sample_start = time.perf_counter()
+        run(len(latencies))
+        latencies.append(time.perf_counter() - sample_start)
+    total = time.perf_counter() - start
+    latencies.sort()
+
+    # tracemalloc slows allocations down, so memory is measured separately
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        run(0)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'samples': len(latencies),
+        'samples_per_sec': len(latencies) / total,
+        'p50_ms': percentile(latencies, 0.50) * 1e3,
+        'p90_ms': percentile(latencies, 0.90) * 1e3,
+        'p99_ms': percentile(latencies, 0.99) * 1e3,
+        'peak_kib': peak / 1024,
+    }
+
+
+def run_case(name, seconds, min_samples):
+    """Measure one-shot genson.evaluate and a precompiled schema on a case."""
+    schema = CASES[name]()
+    compiled = rt.compile(schema)
+    return {
+        'evaluate': measure(lambda seed: rt.evaluate(schema, {'seed': seed}), seconds, min_samples),
+        'compiled': measure(lambda seed: compiled.evaluate({'seed': seed}), seconds, min_samples),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Return a line for every metric that is worse than the baseline by more than tolerance."""
+    regressions = []
+    for name, modes in results['cases'].items():
+        for mode, metrics in modes.items():
+            saved = baseline.get('cases', {}).get(name, {}).get(mode)
+            if not saved:
+                continue
+            for metric, higher_is_better in METRICS.items():
+                old, new = saved.get(metric), metrics[metric]
+                if not old:
+                    continue
+                change = (new - old) / old
+                if (-change if higher_is_better else change) > tolerance:
+                    regressions.append(f'{name} [{mode}] {metric}: {old:.4g} -> {new:.4g} ({change:+.1%})')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cases', nargs='+', choices=sorted(CASES), default=list(CASES))
+    parser.add_argument('--seconds', type=float, default=1.0, help='minimum timing per case and mode')
+    parser.add_argument('--min-samples', type=int, default=20)
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='JSON results of a previous run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed relative regression per metric (default: 0.25)')
+    args = parser.parse_args()
+
+    results = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cases': {},
+    }
+    print(f'{"case":<22} {"mode":<9} {"samples/s":>11} {"p50 ms":>9} {"p90 ms":>9} {"p99 ms":>9} {"peak KiB":>10}')
+    for name in args.cases:
+        results['cases'][name] = run_case(name, args.seconds, args.min_samples)
+        for mode, m in results['cases'][name].items():
+            print(f'{name:<22} {mode:<9} {m["samples_per_sec"]:>11.1f} {m["p50_ms"]:>9.3f} '
+                  f'{m["p90_ms"]:>9.3f} {m["p99_ms"]:>9.3f} {m["peak_kib"]:>10.1f}')
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            sys.stderr.write(f'PERFORMANCE REGRESSION: {len(regressions)} metric(s) '
+                             f'worse than {args.baseline} by more than {args.tolerance:.0%}\n')
+            for line in regressions:
+                sys.stderr.write(f'  {line}\n')
+            sys.exit(1)
+        print(f'No regressions against {args.baseline}')
+
+
+if __name__ == '__main__':
+    main()
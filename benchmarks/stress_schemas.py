@@ -0,0 +1,116 @@
+"""
+Parameterized stress schemas for the benchmark suite.
+Each generator returns a plain GenSON schema (JSON-compatible dicts and lists).
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import genson as rt  # noqa: E402
+
+
+def deep_nesting(depth=rt.MAX_RECURSION_DEPTH - 4):
+    """Sequences nested until `depth` levels are active at the innermost node.
+
+    Every level holds an Option, which optimize() cannot flatten away.
+    """
+    node = {'type': 'option', 'items': ['x', 'y']}
+    for level in range(max(depth - 1, 0) // 2):
+        node = {'type': 'seq', 'items': [
+            {'type': 'option', 'items': ['a', 'b']},
+            {'type': 'option', 'items': [node]},
+        ]}
+    return node
+
+
+def wide_option(width=10000):
+    """One Option over `width` text items."""
+    return {'type': 'option', 'items': [f'item{n}' for n in range(width)]}
+
+
+def wide_roulette(width=10000):
+    """One Roulette over `width` items with distinct weights."""
+    return {
+        'type': 'roulette',
+        'items': [{'weight': n % 97 + 1, 'value': f'item{n}'} for n in range(width)]
+    }
+
+
+def delegate_loop(iterations=2000):
+    """A Delegate whose weight is an expression over a prop, emitting its index."""
+    return {
+        'type': 'layer',
+        'props': {'base': iterations // 2},
+        'items': {
+            'type': 'delegate',
+            'weight': {'op': '*', 'left': {'op': 'get', 'path': 'base'}, 'right': 2},
+            'separator': ',',
+            'value': {'type': 'seq', 'items': [
+                {'type': 'expr', 'value': {'op': '%', 'left': {'op': 'get', 'path': 'i'}, 'right': 7}},
+                {'type': 'option', 'items': ['a', 'b', 'c']},
+            ]}
+        }
+    }
+
+
+def many_props_and_decls(props=2000, decls=200):
+    """A Layer with many props and Domain/Match declarations, using a few of them."""
+    declarations = []
+    for n in range(decls // 2):
+        declarations.append({
+            'type': 'domain', 'name': f'dom{n}',
+            'branch': [{'range': [[0, n]], 'string': 'low'}, {'range': [[n + 1, 10 ** 6]], 'string': 'high'}]
+        })
+        declarations.append({
+            'type': 'match', 'name': f'm{n}',
+            'branch': [{'req': [{'domain': f'dom{n}'}], 'to': 'L'}, {'to': 'H'}]
+        })
+    return {
+        'type': 'layer',
+        'props': {f'var{n}': n for n in range(props)},
+        'decls': declarations,
+        'items': {'type': 'delegate', 'weight': 50, 'value': {'type': 'seq', 'items': [
+            {'type': 'ref', 'to': f'var{props // 2}'},
+            {'type': 'expr', 'value': {
+                'op': '|', 'left': {'op': 'get', 'path': 'i'}, 'right': [f'm{decls // 4}']}},
+        ]}}
+    }
+
+
+def match_pipeline(iterations=200, ranges=100):
+    """A Delegate piping random numbers through two Matches backed by wide Domains."""
+    return {
+        'type': 'layer',
+        'decls': [
+            {'type': 'domain', 'name': 'bucket',
+             'branch': [{'range': [[n * 10, n * 10 + 9]], 'string': f'b{n}'} for n in range(ranges)]},
+            {'type': 'match', 'name': 'classify', 'branch': [
+                {'req': [{'domain': 'bucket', 'expr': {'op': '>', 'left': {'op': 'get', 'path': '_arg'},
+                                                       'right': threshold}}],
+                 'to': {'type': 'expr', 'value': {'op': '|', 'left': threshold, 'right': ['label']}}}
+                for threshold in range(ranges * 10, -1, -ranges)
+            ]},
+            {'type': 'match', 'name': 'label', 'pure': True, 'branch': [
+                {'req': [{'expr': {'op': '>=', 'left': {'op': 'get', 'path': '_arg'}, 'right': ranges * 5}}],
+                 'to': {'type': 'option', 'items': ['HIGH', 'High']}},
+                {'to': {'type': 'option', 'items': ['LOW', 'Low']}},
+            ]},
+        ],
+        'items': {
+            'type': 'delegate', 'weight': iterations, 'separator': ' ',
+            'value': {'type': 'expr', 'value': {
+                'op': '|', 'left': {'type': 'call', 'path': 'rand_int', 'args': [0, ranges * 10 - 1]},
+                'right': ['classify']}}
+        }
+    }
+
+
+CASES = {
+    'deep_nesting': deep_nesting,
+    'wide_option': wide_option,
+    'wide_roulette': wide_roulette,
+    'delegate_loop': delegate_loop,
+    'many_props_and_decls': many_props_and_decls,
+    'match_pipeline': match_pipeline,
+}
@@ -3,28 +3,185 @@
 Minimal CLI to run the GenSON runtime library against a JSON schema.
 Usage:
   python3 cli.py --input example.json
+  python3 cli.py --input example.json --count 1000000 --seed 1 --jobs 8
+  python3 cli.py --input example.json --count 1000000 --format jsonl --output out.jsonl.gz
+  python3 cli.py --input example.json --count 1000 --separator '\\0' --output out.txt
+  python3 cli.py --input big.json --cache-dir ~/.cache/genson
+  python3 cli.py --input modules.json --entry '$3' --count 1000
+  python3 cli.py --input example.json --count 1000 --profile --profile-stacks out.folded
+  python3 cli.py --input example.json --analyze
+  python3 cli.py --input example.json --count 1000000 --batch --output out.txt
+  python3 cli.py serve --socket /tmp/genson.sock --load example=example.json
+
+Batches write through one large buffer and report their throughput on stderr.
+'serve' starts the generation server of server.py with the remaining arguments.
 """
 
 import argparse
+import bz2
+import gzip
 import json
+import lzma
 import os
+import sys
+import time
 import genson as rt
 
+# Output file extension -> compression
+COMPRESSION_SUFFIXES = {'.gz': 'gzip', '.bz2': 'bz2', '.xz': 'xz'}
+
+OPENERS = {
+    'gzip': lambda path: gzip.open(path, 'wb', compresslevel=6),
+    'bz2': lambda path: bz2.open(path, 'wb'),
+    'xz': lambda path: lzma.open(path, 'wb'),
+}
+
+# Encoded bytes collected before each write
+WRITE_BUFFER_SIZE = 1 << 20
+
+
+def open_output(path, compression):
+    """Open a binary output stream, '-' or None being stdout."""
+    if path is None or path == '-':
+        if compression not in ('auto', 'none'):
+            raise ValueError('compression needs --output FILE')
+        return sys.stdout.buffer, False
+    if compression == 'auto':
+        compression = COMPRESSION_SUFFIXES.get(os.path.splitext(path)[1], 'none')
+    if compression == 'none':
+        return open(path, 'wb'), True
+    return OPENERS[compression](path), True
+
+
+def write_samples(samples, stream, output_format, separator):
+    """Write every sample followed by separator; return (samples, bytes) written."""
+    if output_format == 'jsonl':
+        encode_sample = json.dumps
+        separator = '\n'
+    else:
+        encode_sample = str
+    pending = []
+    pending_size = 0
+    count = 0
+    written = 0
+    for sample in samples:
+        data = (encode_sample(sample) + separator).encode('utf-8')
+        pending.append(data)
+        pending_size += len(data)
+        count += 1
+        if pending_size >= WRITE_BUFFER_SIZE:
+            stream.write(b''.join(pending))
+            written += pending_size
+            pending = []
+            pending_size = 0
+    if pending:
+        stream.write(b''.join(pending))
+        written += pending_size
+    return count, written
+
+
+def parse_separator(text):
+    """Decode backslash escapes such as '\\n', '\\t' or '\\0' in a separator argument."""
+    return text.encode('latin-1', 'backslashreplace').decode('unicode_escape')
+
 
 def main():
+    if sys.argv[1:2] == ['serve']:
+        import server
+        server.main(sys.argv[2:])
+        return
     parser = argparse.ArgumentParser()
     parser.add_argument('-i', '--input', default='example.json')
+    parser.add_argument('-n', '--count', type=int, default=1,
+                        help='number of samples')
+    parser.add_argument('-s', '--seed', type=int, default=None,
+                        help='random seed (sample i of a batch uses a seed derived from it)')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='worker processes for batches (0: one per CPU)')
+    parser.add_argument('-o', '--output', metavar='FILE', default=None,
+                        help='write the samples to FILE instead of stdout')
+    parser.add_argument('-f', '--format', choices=['text', 'jsonl'], default='text',
+                        help='text: raw samples followed by the separator; '
+                             'jsonl: one JSON string per line')
+    parser.add_argument('--separator', default='\\n',
+                        help='text written after every sample, with backslash escapes (default: \\n)')
+    parser.add_argument('--compress', choices=['auto', 'none', 'gzip', 'bz2', 'xz'], default='auto',
+                        help='compression of --output (auto: from the .gz/.bz2/.xz extension)')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='do not write the throughput summary of batches to stderr')
+    parser.add_argument('--cache-dir', metavar='DIR', default=None,
+                        help='reuse the prepared schema from this directory across runs, see genson.load()')
+    parser.add_argument('--entry', metavar='NAME', default=None,
+                        help="evaluate one Module entry ('$N' or a refs name), parsing only that entry "
+                             "(default: the Module's default)")
+    parser.add_argument('--lazy', action='store_true',
+                        help='parse only the Module entries that are evaluated, see genson.load_module()')
+    parser.add_argument('--analyze', action='store_true',
+                        help='print the exact output distribution instead of sampling, see genson.analyze()')
+    parser.add_argument('--batch', action='store_true',
+                        help='evaluate many samples per node with NumPy, see genson.evaluate_batch() '
+                             '(same distribution, other texts for a seed)')
+    parser.add_argument('--profile', action='store_true',
+                        help='write a per-node profile to stderr (runs in this process)')
+    parser.add_argument('--profile-stacks', metavar='PATH',
+                        help='write the profile as collapsed stacks for flamegraph tools')
     args = parser.parse_args()
+    separator = parse_separator(args.separator)
+    if args.format == 'jsonl' and separator != '\n':
+        parser.error('--separator cannot be combined with --format jsonl')
     input_path = args.input
     if not os.path.isabs(input_path):
         input_path = os.path.join(os.getcwd(), input_path)
-    with open(input_path, 'r', encoding='utf-8') as f:
-        schema = json.load(f)
-    output = rt.evaluate(schema)
-    print(str(output))
+    if args.lazy or args.entry is not None:
+        if args.cache_dir:
+            parser.error('--cache-dir cannot be combined with --lazy or --entry')
+        with rt.load_module(input_path) as module:
+            try:
+                schema = module.compile(args.entry)
+            except ValueError as e:
+                parser.error(str(e))
+    else:
+        schema = rt.load(input_path, cache_dir=args.cache_dir)
+    if args.analyze:
+        sys.stdout.write(rt.analyze(schema).report())
+        return
+    try:
+        stream, close_stream = open_output(args.output, args.compress)
+    except ValueError as e:
+        parser.error(str(e))
 
+    start = time.perf_counter()
+    try:
+        if args.profile or args.profile_stacks:
+            with rt.Profiler() as profiler:
+                count, written = write_samples(rt.evaluate_many(schema, args.count, seed=args.seed),
+                                               stream, args.format, separator)
+            if args.profile:
+                sys.stderr.write(profiler.report())
+            if args.profile_stacks:
+                with open(args.profile_stacks, 'w', encoding='utf-8') as f:
+                    f.write(profiler.collapsed())
+        elif args.count == 1:
+            count, written = write_samples([rt.evaluate(schema, {'seed': args.seed})],
+                                           stream, args.format, separator)
+        elif args.batch:
+            samples = rt.evaluate_batch(schema, args.count, seed=args.seed)
+            count, written = write_samples(samples, stream, args.format, separator)
+        else:
+            samples = rt.generate_parallel(schema, args.count, seed=args.seed, jobs=args.jobs or None)
+            count, written = write_samples(samples, stream, args.format, separator)
+    finally:
+        if close_stream:
+            stream.close()
+        else:
+            stream.flush()
+    elapsed = time.perf_counter() - start
 
-if __name__ == '__main__':
-    main()
+    if args.count > 1 and not args.quiet:
+        elapsed = max(elapsed, 1e-9)
+        sys.stderr.write(f'{count} samples, {written / 1e6:.2f} MB in {elapsed:.3f} s: '
+                         f'{count / elapsed:.1f} samples/s, {written / 1e6 / elapsed:.2f} MB/s\n')
 
 
+if __name__ == '__main__':
+    main()
@@ -6,10 +6,28 @@ A runtime implementation for evaluating GenSON (GenLang Schema) AST nodes.
 GenSON is a JSON-based intermediate representation for GenLang.
 """
 
+import copy
+import hashlib
+import json
+import pickle
 import random
 import re
 import math
-from typing import Any, Dict, List, Optional, Union, Callable
+import mmap
+import os
+import sys
+import tempfile
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, deque
+from functools import lru_cache
+from itertools import accumulate, islice, repeat
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from fractions import Fraction
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union, Callable
 
 # ============================================================================
 # Constants
@@ -33,7 +51,8 @@ NODE_TYPES = {
     'SET': 'set',
     'EFFECT': 'effect',
     'DOMAIN': 'domain',
-    'MATCH': 'match'
+    'MATCH': 'match',
+    'IMPORT': 'import'
 }
 
 OPERATORS = {
@@ -63,6 +82,8 @@ PATH_PREFIX = {
     'PARENT_DOT': 'parent.'
 }
 
+IDENTIFIER_PATTERN = re.compile(r'[A-Za-z0-9_$]*')
+
 MAX_ITERATIONS = 10000  # Safety limit for loops
 MAX_RECURSION_DEPTH = 100  # Safety limit for recursion
 
@@ -83,7 +104,15 @@ def to_number(x: Any) -> float:
             return float(x)
         except ValueError:
             return float('nan')
-        return float('nan')
+    return float('nan')
+
+def copy_value(value: Any) -> Any:
+    """Copy the dicts and lists of a value, so writes into it cannot reach the schema."""
+    if type(value) is dict:
+        return {key: copy_value(item) for key, item in value.items()}
+    if type(value) is list:
+        return [copy_value(item) for item in value]
+    return value
 
 def is_numeric_index(s: str) -> bool:
     """Check if a string represents a numeric index."""
@@ -101,48 +130,192 @@ def is_nan(x: float) -> bool:
     """Check if a number is NaN."""
     return math.isnan(x)
 
+def run_stack(task: Iterator[Any]) -> Any:
+    """
+    Run a task with an explicit stack instead of Python recursion. A task is a
+    generator that yields the tasks of its children, receives their results
+    and returns its own. An exception in any task ends the whole run.
+    """
+    stack = [task]
+    result = None
+    while stack:
+        try:
+            child = stack[-1].send(result)
+        except StopIteration as done:
+            stack.pop()
+            result = done.value
+        else:
+            stack.append(child)
+            result = None
+    return result
+
+def any_object(tree: Any, test: Callable[[Dict[str, Any]], bool], skip: Optional[str] = None) -> bool:
+    """Check if an object in a JSON tree passes test(); values under the key skip are not searched."""
+    stack = [tree]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, list):
+            stack.extend(value)
+        elif is_object(value):
+            if test(value):
+                return True
+            stack.extend(item for key, item in value.items() if key != skip)
+    return False
+
 # ============================================================================
 # Context Management
 # ============================================================================
 
+class Scope:
+    """
+    A frame of variables chained to its enclosing frame.
+    Lookups fall back to the enclosing frames, writes always go to this frame,
+    so entering a new scope is O(1) whatever the number of visible variables.
+    """
+    __slots__ = ('values', 'outer')
+
+    def __init__(self, values: Optional[Dict[Any, Any]] = None, outer: Optional['Scope'] = None):
+        self.values = {} if values is None else values
+        self.outer = outer
+
+    def new_child(self) -> 'Scope':
+        """Create an empty frame shadowing this one."""
+        return Scope({}, self)
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        frame = self
+        while frame is not None:
+            values = frame.values
+            if key in values:
+                return values[key]
+            frame = frame.outer
+        return default
+
+    def __contains__(self, key: Any) -> bool:
+        frame = self
+        while frame is not None:
+            if key in frame.values:
+                return True
+            frame = frame.outer
+        return False
+
+    def __getitem__(self, key: Any) -> Any:
+        frame = self
+        while frame is not None:
+            values = frame.values
+            if key in values:
+                return values[key]
+            frame = frame.outer
+        raise KeyError(key)
+
+    def __setitem__(self, key: Any, value: Any) -> None:
+        self.values[key] = value
+
+    def update(self, values: Dict[Any, Any]) -> None:
+        self.values.update(values)
+
+    def to_dict(self) -> Dict[Any, Any]:
+        """Flatten the visible variables into a plain dict."""
+        frames = []
+        frame = self
+        while frame is not None:
+            frames.append(frame.values)
+            frame = frame.outer
+        result = {}
+        for values in reversed(frames):
+            result.update(values)
+        return result
+
+    def __repr__(self) -> str:
+        return repr(self.to_dict())
+
+def as_scope(values: Any) -> Scope:
+    """Wrap a plain dict (copied) into a Scope. A Scope is shared as is."""
+    if isinstance(values, Scope):
+        return values
+    return Scope({} if values is None else dict(values))
+
 class Ctx:
     """Evaluation context containing scope, declarations, and RNG."""
+    __slots__ = ('scope', 'parent', 'decls', 'rng', 'recursion_depth')
     
-    def __init__(self, scope: Optional[Dict] = None, parent: Optional['Ctx'] = None, 
-                 decls: Optional[Dict] = None, rng: Optional[Callable] = None,
+    def __init__(self, scope: Optional[Union[Dict, Scope]] = None, parent: Optional['Ctx'] = None, 
+                 decls: Optional[Union[Dict, Scope]] = None, rng: Optional[Callable] = None,
                  recursion_depth: int = 0):
-        self.scope = {} if scope is None else scope.copy()
+        self.scope = as_scope(scope)
         self.parent = parent
-        self.decls = {} if decls is None else decls.copy()
+        self.decls = as_scope(decls)
         self.rng = rng if rng is not None else random.random
         self.recursion_depth = recursion_depth
 
 def create_child_context(parent: Ctx) -> Ctx:
     """Create a child context with inherited scope and declarations."""
-    child = Ctx(
-        scope={},
+    return Ctx(
+        scope=parent.scope.new_child(),
         parent=parent,
         decls=parent.decls,
         rng=parent.rng,
         recursion_depth=parent.recursion_depth
     )
-    child.scope.update(parent.scope)
-    return child
-
-def create_root_context(seed: Optional[int] = None) -> Ctx:
-    """Create the root context for evaluation."""
-    # TODO: Implement seeded RNG when seed is provided
-    rng = random.random
-    if seed is not None:
-        random.seed(seed)
+
+def fork_context(ctx: Ctx) -> Ctx:
+    """Create a context whose scope writes stay private to the caller."""
+    return Ctx(
+        scope=ctx.scope.new_child(),
+        parent=ctx.parent,
+        decls=ctx.decls,
+        rng=ctx.rng,
+        recursion_depth=ctx.recursion_depth
+    )
+
+def create_body_context(owner: Ctx) -> Ctx:
+    """
+    Create the context of a Layer body or Delegate iteration. owner is a
+    fork_context() whose frame receives the body's 'parent.' writes; the body's
+    frame chains past it, so (like the snapshot the body used to take on
+    entry) it only sees those writes through 'parent.' paths.
+    """
+    return Ctx(
+        scope=owner.scope.outer.new_child(),
+        parent=owner,
+        decls=owner.decls,
+        rng=owner.rng,
+        recursion_depth=owner.recursion_depth
+    )
+
+def create_root_context(seed: Optional[int] = None,
+                        rng: Optional[Union[random.Random, Callable[[], float]]] = None) -> Ctx:
+    """
+    Create the root context for evaluation.
+    Each root context owns its generator, so evaluations never share
+    (or reseed) the global random module state.
+
+    Args:
+        seed: Optional random seed
+        rng: Optional random.Random instance (seeded with seed when given)
+             or a callable returning floats in [0, 1)
+    """
+    if rng is None:
+        rng = random.Random(seed)
+    elif seed is not None and isinstance(rng, random.Random):
+        rng.seed(seed)
     return Ctx(
         scope={},
         parent=None,
         decls={},
-        rng=rng,
+        rng=rng.random if isinstance(rng, random.Random) else rng,
         recursion_depth=0
     )
 
+MASK_64 = (1 << 64) - 1
+
+def derive_seed(seed: int, index: int) -> int:
+    """Derive the seed of sample `index` from a base seed (SplitMix64 mixing)."""
+    z = (seed + (index + 1) * 0x9E3779B97F4A7C15) & MASK_64
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MASK_64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK_64
+    return z ^ (z >> 31)
+
 # ============================================================================
 # Path Resolution
 # ============================================================================
@@ -172,15 +345,87 @@ def tokenize_path(path_str: str) -> List[str]:
             continue
         
         # Extract identifier (alphanumeric, underscore, dollar sign)
-        j = i
-        while j < len(path_str) and re.match(r'[A-Za-z0-9_$]', path_str[j]):
-            j += 1
+        j = IDENTIFIER_PATTERN.match(path_str, i).end()
         if j > i:
             tokens.append(path_str[i:j])
-        i = j
+            i = j
+        else:
+            i += 1  # Skip characters that cannot appear in a path
     
     return tokens
 
+def path_key(token: str) -> Union[int, str]:
+    """Convert a path token to the key used for lookups (numeric tokens are indices)."""
+    return int(token) if is_numeric_index(token) else token
+
+class PathAccessor:
+    """
+    A path parsed once: keys are pre-converted and 'parent.' hops pre-counted,
+    so get() and set() only do dict and list lookups.
+    """
+    __slots__ = ('path', 'hops', 'keys', 'set_parent', 'set_keys')
+
+    def __init__(self, path_str: str):
+        self.path = path_str
+        # get_path() follows every leading 'parent.' (and a final bare 'parent')
+        hops = 0
+        rest = path_str
+        while rest == PATH_PREFIX['PARENT'] or rest.startswith(PATH_PREFIX['PARENT_DOT']):
+            hops += 1
+            rest = rest[len(PATH_PREFIX['PARENT_DOT']):]
+        self.hops = hops
+        self.keys = tuple(path_key(token) for token in tokenize_path(rest))
+        # set_path() only strips a single 'parent.' prefix
+        self.set_parent = path_str.startswith(PATH_PREFIX['PARENT_DOT'])
+        rest = path_str[len(PATH_PREFIX['PARENT_DOT']):] if self.set_parent else path_str
+        self.set_keys = tuple(path_key(token) for token in tokenize_path(rest))
+
+    def get(self, ctx: Ctx) -> Any:
+        """Get the value at this path, see get_path()."""
+        for _ in range(self.hops):
+            ctx = ctx.parent
+            if not ctx:
+                return None
+        current = ctx.scope
+        for key in self.keys:
+            if current is None:
+                return None
+            if isinstance(current, (dict, Scope)):
+                current = current.get(key)
+            elif isinstance(current, list):
+                try:
+                    current = current[key] if 0 <= key < len(current) else None
+                except (IndexError, TypeError):
+                    return None
+            else:
+                return None
+        return current
+
+    def set(self, ctx: Ctx, value: Any) -> None:
+        """Set the value at this path, see set_path()."""
+        if self.set_parent:
+            if not ctx.parent:
+                raise RuntimeError(f'No parent scope available for path: {self.path}')
+            current = ctx.parent.scope
+        else:
+            current = ctx.scope
+        keys = self.set_keys
+        if not keys:
+            return
+        # Navigate to parent of target, creating objects as needed
+        for key in keys[:-1]:
+            if key not in current or not isinstance(current[key], dict):
+                current[key] = {}
+            current = current[key]
+        # Stored containers are private copies: later nested writes must not
+        # change the schema's literals (or another evaluation's state)
+        current[keys[-1]] = copy_value(value)
+
+@lru_cache(maxsize=4096)
+def path_accessor(path_str: str) -> PathAccessor:
+    """Get the accessor of a path, parsing each distinct path only once."""
+    return PathAccessor(path_str)
+
 def resolve_scope_for_set(ctx: Ctx, path_str: str) -> Dict[str, Any]:
     """Resolve the target scope for a set operation."""
     if path_str.startswith(PATH_PREFIX['PARENT_DOT']):
@@ -201,56 +446,11 @@ def get_path(ctx: Ctx, path_str: str) -> Any:
     Get a value from context by path.
     Supports 'parent' and 'parent.xxx' paths for accessing parent scope.
     """
-    # Handle parent scope access
-    if path_str == PATH_PREFIX['PARENT'] or path_str.startswith(PATH_PREFIX['PARENT_DOT']):
-        if not ctx.parent:
-            return None
-        if path_str == PATH_PREFIX['PARENT']:
-            return ctx.parent.scope
-        return get_path(ctx.parent, path_str[len(PATH_PREFIX['PARENT_DOT']):])
-    
-    # Resolve path in current scope
-    tokens = tokenize_path(path_str)
-    current = ctx.scope
-    
-    for token in tokens:
-        if current is None:
-            return None
-        key = int(token) if is_numeric_index(token) else token
-        if isinstance(current, dict):
-            current = current.get(key)
-        elif isinstance(current, list):
-            try:
-                current = current[key] if 0 <= key < len(current) else None
-            except (IndexError, TypeError):
-                return None
-        else:
-            return None
-    
-    return current
+    return path_accessor(path_str).get(ctx)
 
 def set_path(ctx: Ctx, path_str: str, value: Any) -> None:
     """Set a value in context by path. Creates intermediate objects as needed."""
-    resolved = resolve_scope_for_set(ctx, path_str)
-    target = resolved['target']
-    tokens = resolved['tokens']
-    
-    if not tokens:
-        return
-    
-    current = target
-    
-    # Navigate to parent of target, creating objects as needed
-    for token in tokens[:-1]:
-        key = int(token) if is_numeric_index(token) else token
-        if key not in current or not isinstance(current[key], dict):
-            current[key] = {}
-        current = current[key]
-    
-    # Set the final value
-    last_token = tokens[-1]
-    last_key = int(last_token) if is_numeric_index(last_token) else last_token
-    current[last_key] = value
+    path_accessor(path_str).set(ctx, value)
 
 # ============================================================================
 # Random Selection
@@ -263,20 +463,52 @@ def random_choice(ctx: Ctx, arr: List[Any]) -> Any:
     index = int(ctx.rng() * len(arr))
     return arr[index]
 
+def weight_value(weight: Any) -> float:
+    """Convert an evaluated weight to a float; NaN and negative weights count as 1."""
+    weight = float(weight)
+    if is_nan(weight) or weight < 0:
+        return 1
+    return weight
+
+def constant_weight(weight_expr: Any) -> Optional[float]:
+    """Return the weight of a literal weight expression, or None if it must be evaluated."""
+    if isinstance(weight_expr, (str, int, float, bool)):
+        try:
+            return weight_value(weight_expr)
+        except ValueError:
+            return None
+    return None
+
+def loop_count(weight: Any) -> int:
+    """Number of iterations a Delegate weight value allows (none for NaN or weights below 1)."""
+    number = to_number(weight)
+    if is_nan(number) or number < 1:
+        return 0
+    return MAX_ITERATIONS if number >= MAX_ITERATIONS else int(number)
+
+def constant_loop_count(weight_expr: Any) -> Optional[int]:
+    """Return loop_count() of a literal Delegate weight, or None if it must be evaluated."""
+    if isinstance(weight_expr, (str, int, float, bool)):
+        return loop_count(weight_expr)
+    return None
+
+def pick_weighted(cumulative: List[float], r: float) -> int:
+    """Index of the first item whose cumulative weight reaches r."""
+    index = bisect_left(cumulative, r)
+    return index if index < len(cumulative) else len(cumulative) - 1
+
+def pick_uniform(ctx: Ctx, count: int) -> int:
+    """Index weighted_choice() picks when all `count` weights are 1."""
+    return max(math.ceil(ctx.rng() * count) - 1, 0)
+
 def weighted_choice(ctx: Ctx, items: List[Dict[str, Any]]) -> Dict[str, Any]:
     """Select an item from an array based on weights."""
     if not items or len(items) == 0:
         return None
     
-    # Calculate weights for each item
-    weights = []
-    for item in items:
-        # Support both 'weight' and 'wt' (short form)
-        weight_expr = item.get('weight', item.get('wt', 1))
-        weight = float(evaluate_expr(weight_expr, ctx))
-        if is_nan(weight) or weight < 0:
-            weight = 1
-        weights.append(weight)
+    # Calculate weights for each item (support both 'weight' and 'wt')
+    weights = [weight_value(evaluate_expr(item.get('weight', item.get('wt', 1)), ctx))
+               for item in items]
     
     # Calculate total weight
     total_weight = sum(weights)
@@ -285,27 +517,110 @@ def weighted_choice(ctx: Ctx, items: List[Dict[str, Any]]) -> Dict[str, Any]:
     
     # Select based on weighted random
     r = ctx.rng() * total_weight
-    for i, weight in enumerate(weights):
-        r -= weight
-        if r <= 0:
-            return items[i]
-    
-    # Fallback to last item
-    return items[-1]
+    return items[pick_weighted(list(accumulate(weights)), r)]
 
 # ============================================================================
 # Domain Evaluation
 # ============================================================================
 
-def evaluate_domain(domain: Dict[str, Any], value: Any, ctx: Ctx) -> Optional[str]:
-    """Check if a number belongs to a Domain."""
-    if not domain or 'branch' not in domain:
-        return None
-    
-    num_value = to_number(value)
-    if is_nan(num_value):
-        return None
+class DomainIndex:
+    """
+    Sorted interval index of a Domain's ranges.
     
+    The distinct range bounds split the number line into pieces: piece 2i is
+    the bound itself and piece 2i + 1 the open interval up to the next bound.
+    Each piece is owned by the first branch whose range covers it, so lookups
+    keep the first-match-wins order of the branches. Exact points are kept in
+    a hash table.
+    """
+    __slots__ = ('strings', 'points', 'bounds', 'owners')
+
+    def __init__(self, strings: List[Any], points: Dict[float, int],
+                 intervals: List[Any]):
+        self.strings = strings
+        self.points = points
+        self.bounds = sorted({bound for _, low, high in intervals for bound in (low, high)})
+        self.owners = [None] * (2 * len(self.bounds))
+        
+        # Paint pieces in branch order; skip[p] leads to the next unpainted piece
+        skip = list(range(len(self.owners) + 1))
+        def next_free(p):
+            root = p
+            while skip[root] != root:
+                root = skip[root]
+            while skip[p] != root:
+                skip[p], p = root, skip[p]
+            return root
+        
+        for order, low, high in intervals:
+            piece = next_free(2 * bisect_left(self.bounds, low))
+            last = 2 * bisect_left(self.bounds, high)
+            while piece <= last:
+                self.owners[piece] = order
+                skip[piece] = piece + 1
+                piece = next_free(piece + 1)
+
+    @classmethod
+    def build(cls, domain: Dict[str, Any]) -> Optional['DomainIndex']:
+        """Index a Domain, or return None if its ranges need the linear scan."""
+        branches = domain.get('branch', [])
+        if not isinstance(branches, list):
+            return None
+        
+        strings = []
+        points = {}
+        intervals = []
+        for order, branch in enumerate(branches):
+            if not is_object(branch):
+                return None
+            strings.append(branch.get('string'))
+            range_val = branch.get('range')
+            if isinstance(range_val, (int, float)):
+                points.setdefault(range_val, order)
+            elif isinstance(range_val, list):
+                for r in range_val:
+                    if isinstance(r, (int, float)):
+                        points.setdefault(r, order)
+                    elif isinstance(r, list) and len(r) == 2:
+                        low, high = r
+                        if not isinstance(low, (int, float)) or not isinstance(high, (int, float)):
+                            return None  # Compared lazily by the scan
+                        if low <= high:
+                            intervals.append((order, low, high))
+        return cls(strings, points, intervals)
+
+    def lookup(self, num_value: float) -> Optional[str]:
+        """String of the first branch containing num_value (not NaN)."""
+        best = self.points.get(num_value)
+        bounds = self.bounds
+        pos = bisect_left(bounds, num_value)
+        if pos < len(bounds) and (pos or bounds[0] == num_value):
+            owner = self.owners[2 * pos if bounds[pos] == num_value else 2 * pos - 1]
+            if owner is not None and (best is None or owner < best):
+                best = owner
+        return None if best is None else self.strings[best]
+
+DECL_CACHE_SIZE = 4096
+domain_indexes: Dict[int, Any] = {}
+
+def cached_for_decl(cache: Dict[int, Any], decl: Dict[str, Any], build: Callable,
+                    size: int = DECL_CACHE_SIZE) -> Any:
+    """Get the object built from a declaration, building it on first use."""
+    entry = cache.get(id(decl))
+    if entry is None or entry[0] is not decl:
+        if len(cache) >= size:
+            cache.clear()
+        # The declaration is kept alive so its id cannot be reused
+        entry = (decl, build(decl))
+        cache[id(decl)] = entry
+    return entry[1]
+
+def domain_index(domain: Dict[str, Any]) -> Optional[DomainIndex]:
+    """Get the cached DomainIndex of a Domain declaration."""
+    return cached_for_decl(domain_indexes, domain, DomainIndex.build)
+
+def scan_domain(domain: Dict[str, Any], num_value: float) -> Optional[str]:
+    """Check the Domain's ranges one by one (for bounds the index cannot sort)."""
     for branch in domain.get('branch', []):
         range_val = branch.get('range')
         if range_val is None:
@@ -328,6 +643,20 @@ def evaluate_domain(domain: Dict[str, Any], value: Any, ctx: Ctx) -> Optional[st
     
     return None
 
+def evaluate_domain(domain: Dict[str, Any], value: Any, ctx: Ctx) -> Optional[str]:
+    """Check if a number belongs to a Domain."""
+    if not domain or 'branch' not in domain:
+        return None
+    
+    num_value = to_number(value)
+    if is_nan(num_value):
+        return None
+    
+    index = domain_index(domain)
+    if index is None:
+        return scan_domain(domain, num_value)
+    return index.lookup(num_value)
+
 def get_domain(ctx: Ctx, name: str) -> Optional[Dict[str, Any]]:
     """Get Domain from context by name."""
     current = ctx
@@ -369,11 +698,130 @@ def evaluate_match_req(req: Dict[str, Any], arg_value: Any, ctx: Ctx) -> bool:
     
     return True  # No requirements means always match
 
+NO_BRANCH = object()
+MATCH_MEMO_SIZE = 1024
+
+class MatchTable:
+    """
+    Decision table of a Match declaration.
+    
+    Requirement expressions are compiled once, Domain names are resolved once
+    per declaration scope and the 'to' nodes are compiled for the compiled
+    engine. Matches declared with "pure": true remember the branch chosen for
+    each (hashable) argument tuple; the chosen 'to' node is still evaluated.
+    """
+    __slots__ = ('reqs', 'targets', 'compiled_targets', 'domain_names', 'bound_domains',
+                 'resolved', 'memo')
+
+    def __init__(self, reqs: List[Any], targets: List[Any], pure: bool,
+                 bound_domains: Optional[Dict[str, Any]] = None):
+        self.reqs = reqs
+        self.targets = targets
+        self.compiled_targets = [compile_node(target) for target in targets]
+        self.domain_names = {name for branch in reqs for name, _, _ in branch if name is not None}
+        # Domains bound by resolve() replace the lookup through the context
+        self.bound_domains = bound_domains
+        self.resolved = (None, {})
+        self.memo = {} if pure else None
+
+    @classmethod
+    def build(cls, match: Dict[str, Any]) -> Optional['MatchTable']:
+        """Build the table, or return None if the Match needs evaluate_match_req()."""
+        reqs = []
+        targets = []
+        branches = match.get('branch', [])
+        if not isinstance(branches, list):
+            return None
+        for branch in branches:
+            if not is_object(branch):
+                return None
+            branch_reqs = branch.get('req', [])
+            if not isinstance(branch_reqs, list):
+                continue
+            compiled = []
+            for req in branch_reqs:
+                if not is_object(req) or not isinstance(req.get('domain', ''), str):
+                    return None
+                expr = req.get('expr')
+                is_eq = isinstance(expr, list) and len(expr) >= 2 and expr[0] == 'eq'
+                compiled.append((
+                    req.get('domain'),
+                    compile_expr(expr) if 'expr' in req else None,
+                    expr[1] if is_eq else NO_BRANCH
+                ))
+            reqs.append(compiled)
+            targets.append(branch.get('to'))
+        return cls(reqs, targets, match.get('pure') is True, match.get('$domains'))
+
+    def domains(self, ctx: Ctx) -> Dict[str, Any]:
+        """Domains visible from ctx by name, resolved once per declaration scope."""
+        if self.bound_domains is not None:
+            return self.bound_domains
+        scope, resolved = self.resolved
+        if scope is not ctx.decls:
+            resolved = {name: get_domain(ctx, name) for name in self.domain_names}
+            self.resolved = (ctx.decls, resolved)
+        return resolved
+
+    def select(self, args: List[Any], ctx: Ctx) -> Optional[int]:
+        """Index of the first branch whose requirements hold, or None."""
+        memo = self.memo
+        if memo is not None:
+            try:
+                key = tuple(args)
+                chosen = memo.get(key, NO_BRANCH)
+            except TypeError:
+                memo = None  # Unhashable arguments are not remembered
+            else:
+                if chosen is not NO_BRANCH:
+                    return chosen
+        
+        domains = self.domains(ctx) if self.domain_names else None
+        chosen = None
+        for index, reqs in enumerate(self.reqs):
+            for i, (domain_name, expr_fn, eq_value) in enumerate(reqs):
+                arg_value = args[i] if i < len(args) else None
+                if domain_name is not None:
+                    domain = domains.get(domain_name)
+                    if domain and evaluate_domain(domain, arg_value, ctx) is None:
+                        break
+                if expr_fn is not None:
+                    expr_ctx = create_child_context(ctx)
+                    expr_ctx.scope['_arg'] = arg_value
+                    result = expr_fn(expr_ctx)
+                    if eq_value is not NO_BRANCH:
+                        if result != eq_value:
+                            break
+                    elif not result:
+                        break
+            else:
+                chosen = index
+                break
+        
+        if memo is not None:
+            if len(memo) >= MATCH_MEMO_SIZE:
+                memo.clear()
+            memo[key] = chosen
+        return chosen
+
+match_tables: Dict[int, Any] = {}
+ref_targets: Dict[int, Any] = {}
+layer_decl_tables: Dict[int, Any] = {}
+
+def match_table(match: Dict[str, Any]) -> Optional[MatchTable]:
+    """Get the cached MatchTable of a Match declaration."""
+    return cached_for_decl(match_tables, match, MatchTable.build)
+
 def evaluate_match_node(match: Dict[str, Any], args: List[Any], ctx: Ctx) -> Optional[Any]:
     """Evaluate a Match node."""
     if not match or 'branch' not in match:
         return None
     
+    table = match_table(match)
+    if table is not None:
+        chosen = table.select(args, ctx)
+        return None if chosen is None else table.targets[chosen]
+    
     # Evaluate each branch in order
     for branch in match.get('branch', []):
         reqs = branch.get('req', [])
@@ -431,98 +879,111 @@ def evaluate_expr_array(expr_array: List[Any], ctx: Ctx) -> Any:
     # Fallback: evaluate all and join
     return ''.join(str(evaluate_expr(x, ctx)) for x in expr_array)
 
+def operator_add(left: Any, right: Any) -> Any:
+    left_num = to_number(left)
+    right_num = to_number(right)
+    if left_num == left_num and right_num == right_num:  # Neither is NaN
+        return left_num + right_num
+    return f'{left or ""}{right or ""}'
+
+def operator_sub(left: Any, right: Any) -> float:
+    left_num = to_number(left)
+    right_num = to_number(right)
+    if left_num == left_num and right_num == right_num:
+        return left_num - right_num
+    return float('nan')
+
+def operator_mul(left: Any, right: Any) -> float:
+    left_num = to_number(left)
+    right_num = to_number(right)
+    if left_num == left_num and right_num == right_num:
+        return left_num * right_num
+    return float('nan')
+
+def operator_div(left: Any, right: Any) -> float:
+    left_num = to_number(left)
+    right_num = to_number(right)
+    if left_num == left_num and right_num == right_num and right_num != 0:
+        return left_num / right_num
+    return float('nan')
+
+def operator_mod(left: Any, right: Any) -> float:
+    left_num = to_number(left)
+    right_num = to_number(right)
+    if left_num == left_num and right_num == right_num and right_num != 0:
+        return left_num % right_num
+    return float('nan')
+
+def operator_gt(left: Any, right: Any) -> bool:
+    left_num = to_number(left)
+    right_num = to_number(right)
+    if left_num == left_num and right_num == right_num:
+        return left_num > right_num
+    return str(left) > str(right)
+
+def operator_lt(left: Any, right: Any) -> bool:
+    left_num = to_number(left)
+    right_num = to_number(right)
+    if left_num == left_num and right_num == right_num:
+        return left_num < right_num
+    return str(left) < str(right)
+
+def operator_gte(left: Any, right: Any) -> bool:
+    left_num = to_number(left)
+    right_num = to_number(right)
+    if left_num == left_num and right_num == right_num:
+        return left_num >= right_num
+    return str(left) >= str(right)
+
+def operator_lte(left: Any, right: Any) -> bool:
+    left_num = to_number(left)
+    right_num = to_number(right)
+    if left_num == left_num and right_num == right_num:
+        return left_num <= right_num
+    return str(left) <= str(right)
+
+# Operators computed from their already evaluated operands
+VALUE_OPERATORS: Dict[str, Callable[[Any, Any], Any]] = {
+    OPERATORS['ADD']: operator_add,
+    OPERATORS['SUB']: operator_sub,
+    OPERATORS['MUL']: operator_mul,
+    OPERATORS['DIV']: operator_div,
+    OPERATORS['MOD']: operator_mod,
+    OPERATORS['GT']: operator_gt,
+    OPERATORS['LT']: operator_lt,
+    OPERATORS['GTE']: operator_gte,
+    OPERATORS['LTE']: operator_lte,
+    OPERATORS['EQ']: lambda left, right: left == right,
+    OPERATORS['NEQ']: lambda left, right: left != right,
+    OPERATORS['NOT']: lambda left, right: not bool(left),
+}
+
 def evaluate_operator(expr: Dict[str, Any], ctx: Ctx) -> Any:
     """Evaluate an operator expression."""
     op = expr.get('op')
-    left = evaluate_expr(expr.get('left'), ctx) if 'left' in expr else None
-    right = evaluate_expr(expr.get('right'), ctx) if 'right' in expr else None
-    
-    if op == OPERATORS['GET']:
-        path = expr.get('path', expr.get('value'))
-        return get_path(ctx, str(path))
     
-    elif op == OPERATORS['ADD']:
-        left_num = to_number(left)
-        right_num = to_number(right)
-        if not is_nan(left_num) and not is_nan(right_num):
-            return left_num + right_num
-        return f'{left or ""}{right or ""}'
-    
-    elif op == OPERATORS['SUB']:
-        left_num = to_number(left)
-        right_num = to_number(right)
-        if not is_nan(left_num) and not is_nan(right_num):
-            return left_num - right_num
-        return float('nan')
-    
-    elif op == OPERATORS['MUL']:
-        left_num = to_number(left)
-        right_num = to_number(right)
-        if not is_nan(left_num) and not is_nan(right_num):
-            return left_num * right_num
-        return float('nan')
-    
-    elif op == OPERATORS['DIV']:
-        left_num = to_number(left)
-        right_num = to_number(right)
-        if not is_nan(left_num) and not is_nan(right_num) and right_num != 0:
-            return left_num / right_num
-        return float('nan')
-    
-    elif op == OPERATORS['MOD']:
-        left_num = to_number(left)
-        right_num = to_number(right)
-        if not is_nan(left_num) and not is_nan(right_num) and right_num != 0:
-            return left_num % right_num
-        return float('nan')
-    
-    elif op == OPERATORS['GT']:
-        left_num = to_number(left)
-        right_num = to_number(right)
-        if not is_nan(left_num) and not is_nan(right_num):
-            return left_num > right_num
-        return str(left) > str(right)
-    
-    elif op == OPERATORS['LT']:
-        left_num = to_number(left)
-        right_num = to_number(right)
-        if not is_nan(left_num) and not is_nan(right_num):
-            return left_num < right_num
-        return str(left) < str(right)
-    
-    elif op == OPERATORS['GTE']:
-        left_num = to_number(left)
-        right_num = to_number(right)
-        if not is_nan(left_num) and not is_nan(right_num):
-            return left_num >= right_num
-        return str(left) >= str(right)
-    
-    elif op == OPERATORS['LTE']:
-        left_num = to_number(left)
-        right_num = to_number(right)
-        if not is_nan(left_num) and not is_nan(right_num):
-            return left_num <= right_num
-        return str(left) <= str(right)
-    
-    elif op == OPERATORS['EQ'] or op == '==':
-        return left == right
-    
-    elif op == OPERATORS['NEQ'] or op == '!=':
-        return left != right
-    
-    elif op == OPERATORS['AND']:
-        return bool(left) and bool(right)
+    # Logical operators only evaluate the operands they need
+    if op == OPERATORS['AND']:
+        return bool(evaluate_expr(expr.get('left'), ctx)) and bool(evaluate_expr(expr.get('right'), ctx))
     
     elif op == OPERATORS['OR']:
-        return bool(left) or bool(right)
-    
-    elif op == OPERATORS['NOT']:
-        return not bool(left)
+        return bool(evaluate_expr(expr.get('left'), ctx)) or bool(evaluate_expr(expr.get('right'), ctx))
     
     elif op == OPERATORS['TERNARY']:
         condition = evaluate_expr(expr.get('cond'), ctx)
         return evaluate_expr(expr.get('then' if condition else 'else'), ctx)
     
+    left = evaluate_expr(expr.get('left'), ctx) if 'left' in expr else None
+    right = evaluate_expr(expr.get('right'), ctx) if 'right' in expr else None
+    
+    operator = VALUE_OPERATORS.get(op)
+    if operator is not None:
+        return operator(left, right)
+    
+    elif op == OPERATORS['GET']:
+        path = expr.get('path', expr.get('value'))
+        return get_path(ctx, str(path))
+    
     elif op == OPERATORS['MATCH_OP']:
         # left | right1, right2, ...
         # right is array: [matcherName, arg1, arg2, ...]
@@ -628,10 +1089,11 @@ def evaluate_node(node: Any, ctx: Ctx) -> str:
     if ctx.recursion_depth >= MAX_RECURSION_DEPTH:
         raise RuntimeError(f'Maximum recursion depth ({MAX_RECURSION_DEPTH}) exceeded')
     
+    # Scopes are shared; node kinds that write to them fork their own frame
     new_ctx = Ctx(
-        scope=ctx.scope.copy(),
+        scope=ctx.scope,
         parent=ctx.parent,
-        decls=ctx.decls.copy(),
+        decls=ctx.decls,
         rng=ctx.rng,
         recursion_depth=ctx.recursion_depth + 1
     )
@@ -683,6 +1145,8 @@ def evaluate_node(node: Any, ctx: Ctx) -> str:
         return evaluate_set(node, new_ctx)
     elif node_type == NODE_TYPES['EFFECT']:
         return evaluate_effect(node, new_ctx)
+    elif node_type == NODE_TYPES['IMPORT']:
+        return evaluate_import(node, new_ctx)
     else:
         return ''
 
@@ -724,34 +1188,76 @@ def evaluate_repetition(node: Dict[str, Any], ctx: Ctx) -> str:
     sep = evaluate_node(separator, ctx) if separator is not None else ''
     return sep.join(parts)
 
+def writes_context(node: Any) -> bool:
+    """Check if a tree holds Set or Effect nodes outside Layer hooks (e.g. in Match targets)."""
+    return any_object(node, lambda value: normalize_node_type(value.get('type', '')) in (
+        NODE_TYPES['SET'], NODE_TYPES['EFFECT']), 'before')
+
+def reaches_other_nodes(node: Any) -> bool:
+    """Check if a tree holds Ref or Call nodes, whose targets may write variables the tree does not show."""
+    return any_object(node, lambda value: normalize_node_type(value.get('type', '')) in (
+        NODE_TYPES['REF'], NODE_TYPES['CALL']))
+
+def reads_loop_state(expr: Any, index_name: str) -> bool:
+    """Check if an expression may change between iterations: it calls functions or Matches, or names the index."""
+    if isinstance(expr, str):
+        return index_name in tokenize_path(expr)
+    if isinstance(expr, list):
+        return any(reads_loop_state(x, index_name) for x in expr)
+    if is_object(expr):
+        if normalize_node_type(expr.get('type', '')) == NODE_TYPES['CALL'] or expr.get('op') in MATCH_OPERATORS:
+            return True
+        return any(reads_loop_state(x, index_name) for x in expr.values())
+    return False
+
+def delegate_weight_invariant(node: Dict[str, Any]) -> bool:
+    """
+    Check if a Delegate's weight has the same value on every iteration: it does
+    not read the index, and the body cannot write variables it might read,
+    neither itself nor through the nodes it refers to.
+    """
+    weight = node.get('weight')
+    if constant_loop_count(weight) is not None:
+        return True
+    value = node.get('value')
+    return not (reads_loop_state(weight, node.get('index', 'i')) or writes_context(value)
+                or reaches_other_nodes(value) or expr_evaluates_nodes(value))
+
+delegate_invariants: Dict[int, Any] = {}
+
 def evaluate_delegate(node: Dict[str, Any], ctx: Ctx) -> str:
     """
     Evaluate a Delegate node (expression-controlled repetition).
-    Weight expression is re-evaluated on each iteration with access to loop variables.
+    Weight expression is re-evaluated on each iteration with access to loop
+    variables, unless delegate_weight_invariant() shows it cannot change.
     """
+    # The delegate owns its scope: 'parent.' writes stay inside the loop
+    ctx = fork_context(ctx)
     weight_expr = node.get('weight')
     value = node.get('value')
     index_name = node.get('index', 'i')
     separator = node.get('separator')
+    invariant = cached_for_decl(delegate_invariants, node, delegate_weight_invariant)
+    
+    # One iteration frame is emptied and gets the index variable on each
+    # iteration, plus the 'parent.' writes of the iterations before it
+    iter_ctx = create_body_context(ctx)
+    frame = iter_ctx.scope.values
+    written = ctx.scope.values
     
     parts = []
+    target_times = 0
     iteration = 1
-    
-    # Weight expression is re-evaluated on each iteration
     while iteration <= MAX_ITERATIONS:
-        # Create child context for this iteration with injected index variable
-        iter_ctx = create_child_context(ctx)
-        iter_ctx.scope[index_name] = iteration
+        frame.clear()
+        frame.update(written)
+        frame[index_name] = iteration
         
         # Re-evaluate weight expression with current iteration context
-        weight_value = evaluate_expr(weight_expr, iter_ctx)
-        target_times = int(to_number(weight_value))
+        if iteration == 1 or not invariant:
+            target_times = loop_count(evaluate_expr(weight_expr, iter_ctx))
         
-        # If weight evaluates to invalid number, stop the loop
-        if is_nan(weight_value) or target_times <= 0:
-            break
-        
-        # If current iteration exceeds target, stop
+        # If current iteration exceeds target (or the weight is invalid), stop
         if iteration > target_times:
             break
         
@@ -764,27 +1270,23 @@ def evaluate_delegate(node: Dict[str, Any], ctx: Ctx) -> str:
 
 def evaluate_layer(node: Dict[str, Any], ctx: Ctx) -> str:
     """Evaluate a Layer node (context with props and decls)."""
-    child_ctx = create_child_context(ctx)
+    # The layer owns its scope: 'parent.' writes stay inside the layer
+    child_ctx = create_body_context(fork_context(ctx))
     
     # Load props as initial scope values
     props = node.get('prop') or node.get('props', {})
     if is_object(props):
         for key, value in props.items():
             # Unwrap .value if present, otherwise use directly
+            # Each entry gets its own copy, so nested writes stay in this evaluation
             if is_object(value) and 'value' in value:
-                child_ctx.scope[key] = value['value']
+                child_ctx.scope[key] = copy_value(value['value'])
             else:
-                child_ctx.scope[key] = value
+                child_ctx.scope[key] = copy_value(value)
     
-    # Load declarations (Match, Domain, etc.)
-    decls = node.get('decl') or node.get('decls', {})
-    if isinstance(decls, list):
-        for decl in decls:
-            if decl and decl.get('name'):
-                child_ctx.decls[decl['name']] = decl
-    elif is_object(decls):
-        # Support object form of decls
-        child_ctx.decls.update(decls)
+    # Load declarations (Match, Domain, etc.), collected once per Layer
+    if node.get('decl') or node.get('decls'):
+        child_ctx.decls = Scope(cached_for_decl(layer_decl_tables, node, layer_decls), child_ctx.decls)
     
     # Execute 'before' hooks for side effects
     before_hooks = node.get('before', [])
@@ -800,10 +1302,10 @@ def evaluate_layer(node: Dict[str, Any], ctx: Ctx) -> str:
     # Layer's evaluate behavior is similar to Roulette
     items = node.get('items', [])
     if isinstance(items, list):
-        # If items is an array, treat as Roulette
-        items_with_weight = [{'weight': 1, 'value': item} for item in items]
-        chosen = weighted_choice(child_ctx, items_with_weight)
-        return evaluate_node(chosen.get('value', chosen), child_ctx) if chosen else ''
+        # If items is an array, treat as Roulette with every weight being 1
+        if not items:
+            return ''
+        return evaluate_node(items[pick_uniform(child_ctx, len(items))], child_ctx)
     elif is_object(items):
         # If items is an object, evaluate it as a node
         return evaluate_node(items, child_ctx)
@@ -828,6 +1330,13 @@ def evaluate_module(node: Dict[str, Any], ctx: Ctx) -> str:
     # Otherwise, evaluate all items and join with newlines
     return '\n'.join(evaluate_node(item, ctx) for item in items)
 
+def evaluate_import(node: Dict[str, Any], ctx: Ctx) -> str:
+    """Evaluate an Import node: the imported schema, in its own scope."""
+    path = import_path(node)
+    if path is None:
+        return ''
+    return module_registry.get(path).root.render(Ctx(rng=ctx.rng), ctx.recursion_depth)
+
 def evaluate_vec(node: Dict[str, Any], ctx: Ctx) -> List[Any]:
     """Evaluate a Vec node."""
     # Vec returns the array itself, not converted to string
@@ -859,12 +1368,14 @@ def evaluate_expr_node(node: Dict[str, Any], ctx: Ctx) -> str:
 
 def evaluate_set(node: Dict[str, Any], ctx: Ctx) -> str:
     """Evaluate a Set node (assign value to path)."""
+    ctx = fork_context(ctx)
     value = evaluate_expr(node.get('value'), ctx)
     set_path(ctx, node.get('path'), value)
     return ''  # Set operations don't produce output
 
 def evaluate_effect(node: Dict[str, Any], ctx: Ctx) -> str:
     """Evaluate an Effect node (side effects only, no output)."""
+    ctx = fork_context(ctx)
     items = node.get('items', [])
     for item in items:
         if is_object(item):
@@ -876,28 +1387,3593 @@ def evaluate_effect(node: Dict[str, Any], ctx: Ctx) -> str:
     return ''  # Effects don't produce output
 
 # ============================================================================
-# Public API
+# Expression Compilation
 # ============================================================================
+#
+# compile_expr() turns an expression into a closure taking the context and
+# returning what evaluate_expr() would. Operator handlers are resolved when
+# the expression is compiled, so evaluating it does no dispatch.
 
-def evaluate(schema: Any, options: Optional[Dict[str, Any]] = None) -> str:
+ExprFn = Callable[[Ctx], Any]
+
+def constant_expr(value: Any) -> ExprFn:
+    """An expression that always evaluates to value."""
+    return lambda ctx: value
+
+def compile_call(call_node: Dict[str, Any]) -> ExprFn:
+    """Compile a function call, see evaluate_call()."""
+    path = call_node.get('path')
+    if not path:
+        return constant_expr('')
+    arg_fns = [compile_expr(arg) for arg in call_node.get('args', [])]
+    
+    if path == 'rand_int' or path == 'randint':
+        def rand_int(ctx: Ctx) -> Any:
+            args = [fn(ctx) for fn in arg_fns]
+            if len(args) >= 2:
+                min_val = int(args[0])
+                max_val = int(args[1])
+                return int(ctx.rng() * (max_val - min_val + 1)) + min_val
+            return ''
+        return rand_int
+    
+    def unknown_call(ctx: Ctx) -> Any:
+        for fn in arg_fns:
+            fn(ctx)
+        return ''
+    return unknown_call
+
+def match_target(match: Dict[str, Any], args: List[Any], ctx: Ctx) -> Optional['CompiledNode']:
+    """The compiled node of the Match branch chosen for args, or None for no output."""
+    table = match_table(match) if 'branch' in match else None
+    if table is None:
+        result = evaluate_match_node(match, args, ctx)
+        return InterpretedNode(result) if result is not None else None
+    chosen = table.select(args, ctx)
+    if chosen is None or table.targets[chosen] is None:
+        return None
+    return table.compiled_targets[chosen]
+
+def render_target(target: Optional['CompiledNode'], ctx: Ctx) -> str:
+    """Render the node chosen by a Match operator at the context's depth."""
+    return target.render(ctx, ctx.recursion_depth) if target is not None else ''
+
+def compile_match_operator(op: str, left: ExprFn, right: ExprFn, expr: Dict[str, Any]) -> ExprFn:
     """
-    Evaluate a GenSON schema and return the generated text.
+    Compile the '|', 'match' and 'match_mut' operators, see evaluate_operator().
+    The returned closure has a choose() attribute that evaluates everything but
+    the chosen node and returns it, for the iterative engine.
+    """
+    # Set by resolve() for literal matcher names
+    binding = expr.get('$decl')
+    if op == OPERATORS['MATCH_OP']:
+        def choose(ctx: Ctx) -> Optional[CompiledNode]:
+            left_value = left(ctx)
+            right_value = right(ctx)
+            right_array = right_value if isinstance(right_value, list) else [right_value]
+            if not right_array:
+                return None
+            if binding is not None:
+                match = binding.decl
+            else:
+                match = get_match(ctx, str(evaluate_expr(right_array[0], ctx)))
+                if not match:
+                    return None
+            args = [left_value] + [evaluate_expr(arg, ctx) for arg in right_array[1:]]
+            return match_target(match, args, ctx)
+    else:
+        # 'match' evaluates its right operand a second time for the matcher name
+        arg_fns = [compile_expr(arg) for arg in expr.get('args', [])]
+        name_fn = compile_expr(expr.get('right'))
+        def choose_call(ctx: Ctx) -> Optional[CompiledNode]:
+            instance = left(ctx)
+            right(ctx)
+            if binding is not None:
+                match = binding.decl
+            else:
+                match = get_match(ctx, str(name_fn(ctx)))
+                if not match:
+                    return None
+            args = [instance] + [fn(ctx) for fn in arg_fns]
+            return match_target(match, args, ctx)
+        if op == OPERATORS['MATCH']:
+            choose = choose_call
+        else:
+            # 'match_mut' is evaluated as 'match' after evaluating both operands once more
+            def choose(ctx: Ctx) -> Optional[CompiledNode]:
+                left(ctx)
+                right(ctx)
+                return choose_call(ctx)
     
-    Args:
-        schema: GenSON schema (AST)
-        options: Evaluation options
-            - seed: Optional random seed
+    def match_operator(ctx: Ctx) -> Any:
+        return render_target(choose(ctx), ctx)
+    match_operator.choose = choose
+    return match_operator
+
+def compile_operator(op: Any, left: Optional[ExprFn], right: Optional[ExprFn],
+                     expr: Dict[str, Any]) -> ExprFn:
+    """Compile an operator given its compiled operands, see evaluate_operator()."""
+    missing = constant_expr(None)
     
-    Returns:
-        Generated text
+    # Logical operators only evaluate the operands they need
+    if op == OPERATORS['AND']:
+        left, right = left or constant_expr(''), right or constant_expr('')
+        return lambda ctx: bool(left(ctx)) and bool(right(ctx))
+    if op == OPERATORS['OR']:
+        left, right = left or constant_expr(''), right or constant_expr('')
+        return lambda ctx: bool(left(ctx)) or bool(right(ctx))
+    if op == OPERATORS['TERNARY']:
+        cond = compile_expr(expr.get('cond'))
+        then_fn = compile_expr(expr.get('then'))
+        else_fn = compile_expr(expr.get('else'))
+        return lambda ctx: then_fn(ctx) if cond(ctx) else else_fn(ctx)
+    
+    left = left or missing
+    right = right or missing
+    
+    operator = VALUE_OPERATORS.get(op)
+    if operator is not None:
+        return lambda ctx: operator(left(ctx), right(ctx))
+    
+    if op in MATCH_OPERATORS:
+        return compile_match_operator(op, left, right, expr)
+    
+    # Remaining operators ignore their operands, which are still evaluated
+    if op == OPERATORS['GET']:
+        getter = path_accessor(str(expr.get('path', expr.get('value')))).get
+    else:
+        getter = constant_expr('')
+    if left is missing and right is missing:
+        return getter
+    def operator_with_operands(ctx: Ctx) -> Any:
+        left(ctx)
+        right(ctx)
+        return getter(ctx)
+    return operator_with_operands
+
+def compile_expr_array(expr_array: List[Any]) -> ExprFn:
+    """Compile an expression in array format, see evaluate_expr_array()."""
+    if not isinstance(expr_array, list) or len(expr_array) == 0:
+        return constant_expr('')
+    
+    if expr_array[0] in ('ref', 'var') and len(expr_array) >= 2:
+        return path_accessor(str(expr_array[1])).get
+    
+    if len(expr_array) == 3:
+        # Both operands are evaluated, then evaluated again by the operator
+        left_fn = compile_expr(expr_array[0])
+        op = expr_array[1]
+        right_fn = compile_expr(expr_array[2])
+        operator = VALUE_OPERATORS.get(op)
+        if operator is not None:
+            def array_operator(ctx: Ctx) -> Any:
+                left = left_fn(ctx)
+                right = right_fn(ctx)
+                return operator(evaluate_expr(left, ctx), evaluate_expr(right, ctx))
+            return array_operator
+        return lambda ctx: evaluate_operator({'op': op, 'left': left_fn(ctx), 'right': right_fn(ctx)}, ctx)
+    
+    fns = [compile_expr(x) for x in expr_array]
+    return lambda ctx: ''.join([str(fn(ctx)) for fn in fns])
+
+def compile_expr(expr: Any) -> ExprFn:
+    """Compile an expression into a closure returning evaluate_expr(expr, ctx)."""
+    if expr is None:
+        return constant_expr('')
+    
+    if isinstance(expr, (str, int, float, bool)):
+        return constant_expr(expr)
+    
+    if isinstance(expr, list):
+        fns = [compile_expr(x) for x in expr]
+        return lambda ctx: ''.join([str(fn(ctx)) for fn in fns])
+    
+    if is_object(expr):
+        node_type = normalize_node_type(expr.get('type', ''))
+        
+        if node_type == NODE_TYPES['EXPR'] or node_type == NODE_TYPES['EXPRESSION']:
+            return compile_expr(expr.get('value') or expr.get('expr'))
+        
+        if node_type == NODE_TYPES['REF']:
+            return path_accessor(str(expr.get('to') or expr.get('path') or expr.get('value') or '')).get
+        
+        if node_type == NODE_TYPES['CALL']:
+            return compile_call(expr)
+        
+        if 'op' in expr:
+            fn = compile_operator(
+                expr.get('op'),
+                compile_expr(expr.get('left')) if 'left' in expr else None,
+                compile_expr(expr.get('right')) if 'right' in expr else None,
+                expr
+            )
+            profiler = compiling_profiler.get()
+            return fn if profiler is None else profiler.count_operator(expr.get('op'), fn)
+        
+        if 'expr' in expr and isinstance(expr['expr'], list):
+            return compile_expr_array(expr['expr'])
+        
+        return constant_expr(expr)
+    
+    return constant_expr(None)
+
+# ============================================================================
+# Optimization
+# ============================================================================
+#
+# optimize() rewrites a schema into an equivalent one: expressions without
+# context access or randomness are replaced by their value, Text nodes and
+# literals become strings, and nested Sequences of literals are flattened
+# into single strings. Nodes that draw random numbers are never removed, so
+# seeded output is unchanged.
+
+# Longest text a literal Repetition is folded into; longer ones are built
+# when evaluated, so unused branches cost nothing at compile time
+FOLD_REPETITION_LIMIT = 4096
+
+def count_values(value: Any) -> int:
+    """Count the JSON values (objects, arrays and primitives) in a tree."""
+    count = 0
+    stack = [value]
+    while stack:
+        value = stack.pop()
+        count += 1
+        if isinstance(value, dict):
+            stack.extend(value.values())
+        elif isinstance(value, list):
+            stack.extend(value)
+    return count
+
+def fold_expr(expr: Any, stats: Dict[str, int]) -> Any:
+    """
+    Fold the constant parts of an expression.
+    Returns (True, value) if the whole expression is constant, otherwise
+    (False, expr) with an equivalent, partially folded expression.
+    """
+    if expr is None:
+        return True, ''
+    
+    if isinstance(expr, (str, int, float, bool)):
+        return True, expr
+    
+    if isinstance(expr, list):
+        folded = [fold_expr(x, stats) for x in expr]
+        if all(constant for constant, _ in folded):
+            return True, ''.join(str(value) for _, value in folded)
+        return False, [value for _, value in folded]
+    
+    if not is_object(expr):
+        return False, expr
+    
+    node_type = normalize_node_type(expr.get('type', ''))
+    
+    if node_type == NODE_TYPES['EXPR'] or node_type == NODE_TYPES['EXPRESSION']:
+        # The wrapper evaluates to its content
+        return fold_expr(expr.get('value') or expr.get('expr'), stats)
+    
+    if node_type == NODE_TYPES['CALL']:
+        args = expr.get('args', [])
+        if isinstance(args, list):
+            return False, {**expr, 'args': [fold_expr(arg, stats)[1] for arg in args]}
+        return False, expr
+    
+    if node_type == NODE_TYPES['REF']:
+        return False, expr
+    
+    if 'op' in expr:
+        op = expr.get('op')
+        
+        if op == OPERATORS['AND'] or op == OPERATORS['OR']:
+            left_constant, left = fold_expr(expr.get('left'), stats)
+            right_constant, right = fold_expr(expr.get('right'), stats)
+            if left_constant:
+                if bool(left) != (op == OPERATORS['AND']):
+                    stats['expressions'] += 1
+                    return True, bool(left)
+                if right_constant:
+                    stats['expressions'] += 1
+                    return True, bool(right)
+            return False, {**expr, 'left': left, 'right': right}
+        
+        if op == OPERATORS['TERNARY']:
+            cond_constant, cond = fold_expr(expr.get('cond'), stats)
+            if cond_constant:
+                stats['expressions'] += 1
+                return fold_expr(expr.get('then' if cond else 'else'), stats)
+            return False, {
+                **expr,
+                'cond': cond,
+                'then': fold_expr(expr.get('then'), stats)[1],
+                'else': fold_expr(expr.get('else'), stats)[1]
+            }
+        
+        operator = VALUE_OPERATORS.get(op)
+        if operator is not None:
+            left_constant, left = fold_expr(expr['left'], stats) if 'left' in expr else (True, None)
+            right_constant, right = fold_expr(expr['right'], stats) if 'right' in expr else (True, None)
+            if left_constant and right_constant:
+                stats['expressions'] += 1
+                return True, operator(left, right)
+            folded = dict(expr)
+            if 'left' in expr:
+                folded['left'] = left
+            if 'right' in expr:
+                folded['right'] = right
+            return False, folded
+        
+        return False, expr
+    
+    if 'expr' in expr and isinstance(expr['expr'], list):
+        expr_array = expr['expr']
+        if len(expr_array) == 0:
+            return True, ''
+        if expr_array[0] in ('ref', 'var') and len(expr_array) >= 2:
+            return False, expr
+        if len(expr_array) == 3:
+            left_constant, left = fold_expr(expr_array[0], stats)
+            right_constant, right = fold_expr(expr_array[2], stats)
+            operator = VALUE_OPERATORS.get(expr_array[1])
+            if operator is not None and left_constant and right_constant:
+                stats['expressions'] += 1
+                return True, operator(left, right)
+            if left in ('ref', 'var'):
+                return False, expr  # Folding would turn it into a reference
+            return False, {**expr, 'expr': [left, expr_array[1], right]}
+        folded = [fold_expr(x, stats) for x in expr_array]
+        if all(constant for constant, _ in folded):
+            stats['expressions'] += 1
+            return True, ''.join(str(value) for _, value in folded)
+        return False, expr
+    
+    return False, expr
+
+def fold_value(expr: Any, stats: Dict[str, int]) -> Any:
+    """Fold an expression in a position where only its value matters."""
+    return fold_expr(expr, stats)[1]
+
+def as_node_object(node: Any) -> Any:
+    """Keep a folded node an object where strings would change its meaning."""
+    return node if is_object(node) else {'type': NODE_TYPES['TEXT'], 'text': '' if node is None else node}
+
+def fold_list(items: List[Any], stats: Dict[str, int]) -> Any:
+    """Fold every node of a list of alternatives (Option, Vec, Layer and Module items)."""
+    folded = []
+    for item in items:
+        if isinstance(item, (str, int, float, bool)):
+            folded.append(str(item))
+        else:
+            folded.append((yield fold_node(item, stats)))
+    return folded
+
+def fold_items(items: List[Any], stats: Dict[str, int]) -> Any:
+    """Fold the items of a Sequence: splice nested Sequences and merge adjacent strings."""
+    parts = []
+    for item in items:
+        item = str(item) if isinstance(item, (str, int, float, bool)) else (yield fold_node(item, stats))
+        if is_object(item) and item.get('type') == NODE_TYPES['SEQUENCE'] and isinstance(item.get('items'), list):
+            spliced = item['items']
+        elif isinstance(item, list):
+            spliced = item
+        else:
+            spliced = [item]
+        for part in spliced:
+            if part is None:
+                part = ''
+            if isinstance(part, str) and parts and isinstance(parts[-1], str):
+                parts[-1] += part
+            else:
+                parts.append(part)
+    if all(isinstance(part, str) for part in parts):
+        return ''.join(parts)
+    return parts
+
+def fold_steps(items: Any, stats: Dict[str, int]) -> Any:
+    """Fold the set/effect entries of an Effect node or Layer 'before' hooks."""
+    if not isinstance(items, list):
+        return items
+    folded = []
+    for item in items:
+        if is_object(item) and item.get('type') == NODE_TYPES['SET']:
+            item = {**item, 'value': fold_value(item.get('value'), stats)}
+        elif is_object(item) and item.get('type') == NODE_TYPES['EFFECT']:
+            item = yield fold_node(item, stats)
+        folded.append(item)
+    return folded
+
+def fold_node(node: Any, stats: Dict[str, int]) -> Any:
+    """
+    Fold a node; the result evaluates to the same text as the node. Like
+    fold_list(), fold_items() and fold_steps(), this is a run_stack() task.
+    """
+    if isinstance(node, (str, int, float, bool)):
+        return str(node)
+    
+    if isinstance(node, list):
+        return (yield from fold_items(node, stats))
+    
+    if not is_object(node):
+        return node
+    
+    node_type = normalize_node_type(node.get('type', ''))
+    items = node.get('items')
+    
+    if node_type == NODE_TYPES['TEXT']:
+        return str(node.get('text', ''))
+    
+    if node_type == NODE_TYPES['SEQUENCE']:
+        if not isinstance(node.get('items', []), list):
+            return node
+        folded = yield from fold_items(node.get('items', []), stats)
+        return folded if isinstance(folded, str) else {**node, 'items': folded}
+    
+    if node_type == NODE_TYPES['OPTION'] or node_type == NODE_TYPES['VEC']:
+        if isinstance(items, list):
+            return {**node, 'items': (yield from fold_list(items, stats))}
+        return node
+    
+    if node_type == NODE_TYPES['ROULETTE']:
+        if not isinstance(items, list):
+            return node
+        folded = []
+        for item in items:
+            if is_object(item):
+                item = dict(item)
+                key = 'weight' if 'weight' in item else 'wt' if 'wt' in item else None
+                if key is not None:
+                    item[key] = fold_value(item[key], stats)
+                if 'value' in item:
+                    item['value'] = yield fold_node(item['value'], stats)
+            folded.append(item)
+        return {**node, 'items': folded}
+    
+    if node_type == NODE_TYPES['REPETITION']:
+        value = yield fold_node(node.get('value'), stats)
+        separator = yield fold_node(node.get('separator'), stats)
+        if (value is None or isinstance(value, str)) and (separator is None or isinstance(separator, str)):
+            try:
+                times = int(node.get('times', 0))
+            except (TypeError, ValueError):
+                times = None
+            if times is not None and times * (len(value or '') + len(separator or '')) <= FOLD_REPETITION_LIMIT:
+                return (separator or '').join([value or ''] * times)
+        folded = {**node, 'value': value}
+        if 'separator' in node:
+            folded['separator'] = separator
+        return folded
+    
+    if node_type == NODE_TYPES['DELEGATE']:
+        folded = {**node, 'weight': fold_value(node.get('weight'), stats),
+                  'value': (yield fold_node(node.get('value'), stats))}
+        if 'separator' in node:
+            folded['separator'] = yield fold_node(node['separator'], stats)
+        return folded
+    
+    if node_type == NODE_TYPES['LAYER']:
+        folded = {**node, 'before': (yield from fold_steps(node.get('before', []), stats))}
+        if isinstance(items, list):
+            folded['items'] = yield from fold_list(items, stats)
+        elif is_object(items):
+            folded['items'] = as_node_object((yield fold_node(items, stats)))
+        return folded
+    
+    if node_type == NODE_TYPES['MODULE']:
+        folded = dict(node)
+        if isinstance(items, list):
+            folded['items'] = yield from fold_list(items, stats)
+        if is_object(node.get('default')):
+            folded['default'] = as_node_object((yield fold_node(node['default'], stats)))
+        return folded
+    
+    if node_type == NODE_TYPES['REF']:
+        if 'else' in node:
+            return {**node, 'else': (yield fold_node(node['else'], stats))}
+        return node
+    
+    if node_type == NODE_TYPES['EXPR'] or node_type == NODE_TYPES['EXPRESSION']:
+        constant, value = fold_expr(node.get('value') or node.get('expr'), stats)
+        if constant:
+            return str(value)
+        return {**node, 'value': value} if value else node
+    
+    if node_type == NODE_TYPES['CALL']:
+        return fold_expr(node, stats)[1]
+    
+    if node_type == NODE_TYPES['SET']:
+        return {**node, 'value': fold_value(node.get('value'), stats)}
+    
+    if node_type == NODE_TYPES['EFFECT']:
+        return {**node, 'items': (yield from fold_steps(node.get('items', []), stats))}
+    
+    return node
+
+def optimize(schema: Any) -> Any:
+    """
+    Fold the static parts of a GenSON schema.
+    
+    Args:
+        schema: GenSON schema (AST); it is not modified
+    
+    Returns:
+        (optimized schema, stats) where stats counts the JSON values before
+        and after ('nodes', 'nodes_after', 'removed') and the folded
+        expressions ('expressions')
+    """
+    stats = {'nodes': count_values(schema), 'expressions': 0}
+    try:
+        optimized = run_stack(fold_node(schema, stats))
+    except (AttributeError, KeyError, TypeError, ValueError):
+        # Malformed schemas are left to report their errors when evaluated
+        optimized = schema
+    stats['nodes_after'] = count_values(optimized)
+    stats['removed'] = stats['nodes'] - stats['nodes_after']
+    return optimized, stats
+
+# ============================================================================
+# Name Resolution
+# ============================================================================
+#
+# resolve() binds names to declarations once, following the nesting of
+# Layers: Match operators with a literal matcher name get the Match
+# declaration they call ('$decl'), and Match declarations get the Domains
+# their requirements name ('$domains'). Names that can never resolve are
+# reported together as a ResolutionError.
+
+class ResolutionError(ValueError):
+    """Raised by resolve() for names that no declaration provides."""
+
+    def __init__(self, errors: List[Any]):
+        self.errors = errors
+        super().__init__('Unresolved names:\n' + '\n'.join(
+            f'  {pointer or "/"}: {message}' for pointer, message in errors))
+
+class DeclBinding:
+    """The Match declaration bound to an operator by resolve()."""
+    __slots__ = ('decl',)
+
+    def __init__(self, decl: Optional[Dict[str, Any]] = None):
+        self.decl = decl
+
+def declared_decls(node: Dict[str, Any]) -> Dict[str, Any]:
+    """Declarations written in a Layer by name (list or object form)."""
+    decls = {}
+    raw_decls = node.get('decl') or node.get('decls', {})
+    if isinstance(raw_decls, list):
+        for decl in raw_decls:
+            if decl and decl.get('name'):
+                decls[decl['name']] = decl
+    elif is_object(raw_decls):
+        decls.update(raw_decls)
+    return decls
+
+def is_import(decl: Any) -> bool:
+    """Check if a declaration or node imports a schema file."""
+    return is_object(decl) and decl.get('type') == NODE_TYPES['IMPORT'] and isinstance(decl.get('path'), str)
+
+def import_path(node: Dict[str, Any]) -> Optional[str]:
+    """
+    Absolute path of an Import declaration or node, or None without a path.
+    Relative paths are taken from the directory of the file being loaded
+    (see load()), or from the working directory.
+    """
+    path = node.get('$path')
+    if path is not None:
+        return path
+    if not is_import(node):
+        return None
+    loading = importing_paths.get()
+    return os.path.abspath(os.path.join(os.path.dirname(loading[-1]) if loading else '', node['path']))
+
+def layer_decls(node: Dict[str, Any]) -> Dict[str, Any]:
+    """Declarations of a Layer by name, shadowing the ones its Import declarations provide."""
+    decls = declared_decls(node)
+    imports = [decl for decl in decls.values() if is_import(decl)]
+    if not imports:
+        return decls
+    merged = {}
+    for decl in imports:
+        merged.update(module_registry.exports(import_path(decl)))
+    merged.update(decls)
+    return merged
+
+def pointer_join(pointer: Any, key: Any) -> Any:
+    """Append a key to a JSON pointer, kept as nested pairs until formatted."""
+    return (pointer, key)
+
+def format_pointer(pointer: Any) -> str:
+    """Format a pointer built by pointer_join() as a JSON pointer string."""
+    keys = []
+    while pointer:
+        pointer, key = pointer
+        keys.append('/' + str(key).replace('~', '~0').replace('/', '~1'))
+    return ''.join(reversed(keys))
+
+def collect_assigned_names(value: Any, names: set) -> None:
+    """Collect the root names anything can write to the scope: props, Set paths and Delegate indexes."""
+    stack = [value]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, list):
+            stack.extend(value)
+            continue
+        if not is_object(value):
+            continue
+        node_type = normalize_node_type(value.get('type', ''))
+        if node_type == NODE_TYPES['LAYER']:
+            props = value.get('prop') or value.get('props', {})
+            if is_object(props):
+                names.update(str(key) for key in props)
+        elif node_type == NODE_TYPES['SET'] and isinstance(value.get('path'), str):
+            keys = path_accessor(value['path']).set_keys
+            if keys:
+                names.add(str(keys[0]))
+        elif node_type == NODE_TYPES['DELEGATE']:
+            names.add(str(value.get('index', 'i')))
+        stack.extend(value.values())
+
+def lookup_decl(env: List[Any], name: str, decl_type: str) -> Any:
+    """Find the innermost declaration of a type by name; returns (decl, binding)."""
+    for decls, bindings in env:
+        decl = decls.get(name)
+        if is_object(decl) and decl.get('type') == decl_type:
+            return decl, bindings.get(name)
+    return None, None
+
+def matcher_name(expr: Dict[str, Any]) -> Any:
+    """The literal matcher name of a Match operator, or None if it is computed."""
+    op = expr.get('op')
+    if op == OPERATORS['MATCH_OP']:
+        right = expr.get('right')
+        name = right[0] if isinstance(right, list) and right else right
+    elif op == OPERATORS['MATCH'] or op == OPERATORS['MATCH_MUT']:
+        name = expr.get('right')
+    else:
+        return None
+    return name if isinstance(name, str) else None
+
+def resolve_match_decl(decl: Dict[str, Any], env: List[Any], pointer: Any,
+                       state: Dict[str, Any]) -> Dict[str, Any]:
+    """Resolve a Match declaration's contents and bind its Domain names (a run_stack() task)."""
+    resolved = yield resolve_value(decl, env, pointer, state)
+    domains = {}
+    branches = decl.get('branch', [])
+    for b, branch in enumerate(branches if isinstance(branches, list) else []):
+        reqs = branch.get('req', []) if is_object(branch) else None
+        for r, req in enumerate(reqs if isinstance(reqs, list) else []):
+            name = req.get('domain') if is_object(req) else None
+            if not isinstance(name, str) or name in domains:
+                continue
+            domain, _ = lookup_decl(env, name, NODE_TYPES['DOMAIN'])
+            if domain is None:
+                req_pointer = pointer_join(pointer_join(pointer_join(pointer, 'branch'), b), 'req')
+                state['errors'].append((format_pointer(pointer_join(pointer_join(req_pointer, r), 'domain')),
+                                        f'unknown Domain {name!r}'))
+            else:
+                domains[name] = domain
+    if resolved is decl:
+        resolved = dict(decl)
+    resolved['$domains'] = domains
+    return resolved
+
+def resolve_layer(node: Dict[str, Any], env: List[Any], pointer: Any,
+                  state: Dict[str, Any]) -> Dict[str, Any]:
+    """Resolve a Layer: its declarations are visible to everything inside it (a run_stack() task)."""
+    declared = declared_decls(node)
+    raw_key = 'decl' if node.get('decl') else 'decls'
+    raw_decls = node.get(raw_key)
+    if isinstance(raw_decls, list):
+        keys = {decl['name']: index for index, decl in enumerate(raw_decls) if decl and decl.get('name')}
+    else:
+        keys = {name: name for name in declared}
+    
+    # Imported declarations are already resolved in their own file
+    decls = {}
+    imports = {}
+    for name, decl in declared.items():
+        if is_import(decl):
+            path = import_path(decl)
+            try:
+                decls.update(module_registry.exports(path))
+                state['imports'].add(path)
+                state['imports'].update(module_registry.get(path).imports)
+            except (OSError, ValueError) as e:
+                state['errors'].append((format_pointer(pointer_join(pointer_join(pointer, raw_key), keys[name])),
+                                        f'cannot import {decl["path"]!r}: {e}'))
+            imports[name] = {**decl, '$path': path}
+    bindings = {name: DeclBinding(decl) for name, decl in decls.items()
+                if is_object(decl) and decl.get('type') == NODE_TYPES['MATCH'] and name not in declared}
+    decls.update(declared)
+    bindings.update((name, DeclBinding()) for name, decl in declared.items()
+                    if is_object(decl) and decl.get('type') == NODE_TYPES['MATCH'])
+    env = [(decls, bindings)] + env
+    
+    for name in declared:
+        if name in bindings:
+            decl_pointer = pointer_join(pointer_join(pointer, raw_key), keys[name])
+            bindings[name].decl = yield resolve_match_decl(declared[name], env, decl_pointer, state)
+    
+    def bound(name: Any, decl: Any) -> Any:
+        if declared.get(name) is not decl:
+            return decl
+        if name in imports:
+            return imports[name]
+        return bindings[name].decl if name in bindings else decl
+    
+    resolved = {}
+    for key, value in node.items():
+        if key == raw_key:
+            if isinstance(value, list):
+                value = [bound(decl['name'], decl) if is_object(decl) and decl.get('name') else decl
+                         for decl in value]
+            elif is_object(value):
+                value = {name: bound(name, decl) for name, decl in value.items()}
+        elif key not in ('prop', 'props'):
+            # Props are data; only the nodes that use them are resolved
+            value = yield resolve_value(value, env, pointer_join(pointer, key), state)
+        resolved[key] = value
+    return resolved
+
+def resolve_value(value: Any, env: List[Any], pointer: Any, state: Dict[str, Any]) -> Any:
+    """
+    Resolve the names in a node or expression; unchanged values are returned
+    as is. This is a run_stack() task.
+    """
+    if isinstance(value, list):
+        resolved = []
+        for i, item in enumerate(value):
+            if isinstance(item, (dict, list)):
+                item = yield resolve_value(item, env, pointer_join(pointer, i), state)
+            resolved.append(item)
+        return value if all(a is b for a, b in zip(resolved, value)) else resolved
+    if not is_object(value):
+        return value
+    
+    node_type = normalize_node_type(value.get('type', ''))
+    if node_type == NODE_TYPES['LAYER']:
+        return (yield from resolve_layer(value, env, pointer, state))
+    
+    errors = state['errors']
+    if node_type == NODE_TYPES['REF'] and 'else' not in value:
+        path = value.get('to') or value.get('path') or value.get('value')
+        keys = path_accessor(path).keys if isinstance(path, str) else ()
+        if keys and str(keys[0]) not in state['names']:
+            errors.append((format_pointer(pointer), f'unknown variable {path!r}'))
+    
+    import_target = None
+    if node_type == NODE_TYPES['IMPORT'] and is_import(value):
+        import_target = import_path(value)
+        try:
+            state['imports'].add(import_target)
+            state['imports'].update(module_registry.get(import_target).imports)
+        except (OSError, ValueError) as e:
+            errors.append((format_pointer(pointer_join(pointer, 'path')), f'cannot import {value["path"]!r}: {e}'))
+    
+    if node_type == NODE_TYPES['MODULE']:
+        default_item = value.get('default')
+        items = value.get('items', [])
+        if isinstance(default_item, str) and default_item.startswith('$') and default_item[1:].isdigit():
+            if isinstance(items, list) and int(default_item[1:]) >= len(items):
+                errors.append((format_pointer(pointer_join(pointer, 'default')), f'unknown Module entry {default_item!r}'))
+    
+    binding = None
+    name = matcher_name(value)
+    if name is not None:
+        _, binding = lookup_decl(env, name, NODE_TYPES['MATCH'])
+        if binding is None:
+            errors.append((format_pointer(pointer_join(pointer, 'right')), f'unknown Match {name!r}'))
+    
+    resolved = None
+    for key, item in value.items():
+        if isinstance(item, (dict, list)):
+            new_item = yield resolve_value(item, env, pointer_join(pointer, key), state)
+            if new_item is not item:
+                if resolved is None:
+                    resolved = dict(value)
+                resolved[key] = new_item
+    if binding is not None:
+        resolved = resolved or dict(value)
+        resolved['$decl'] = binding
+    if import_target is not None:
+        resolved = resolved or dict(value)
+        resolved['$path'] = import_target
+    return value if resolved is None else resolved
+
+def resolve(schema: Any, imports: Optional[set] = None) -> Any:
+    """
+    Bind the Match, Domain and Module entry names of a schema to their declarations.
+    Imported files are loaded through module_registry, and their paths are
+    fixed relative to the file being loaded.
+    
+    Args:
+        schema: GenSON schema (AST); it is not modified
+        imports: Optional set that receives the absolute paths of the files
+                 the schema imports, directly or through other imports
+    
+    Returns:
+        The schema with bindings attached for the compiler
+    
+    Raises:
+        ResolutionError: For Matches, Domains and Module entries that are not
+            declared, for Refs without 'else' to variables nothing assigns,
+            and for imports that cannot be loaded
+    """
+    state = {'errors': [], 'names': {'_arg'}, 'imports': set() if imports is None else imports}
+    collect_assigned_names(schema, state['names'])
+    resolved = run_stack(resolve_value(schema, [], (), state))
+    if state['errors']:
+        raise ResolutionError(state['errors'])
+    return resolved
+
+# ============================================================================
+# Schema Compilation
+# ============================================================================
+#
+# compile() walks the schema once and turns every node into a slotted
+# CompiledNode whose fields are already extracted from the JSON. Rendering a
+# compiled node does no type dispatch and no dict probing. The recursion depth
+# is passed down explicitly instead of being stored in a fresh Ctx per node;
+# only nodes that write to the scope (or expose it as 'parent.') get their own
+# context, which keeps the scoping rules of evaluate_node.
+
+MATCH_OPERATORS = (OPERATORS['MATCH_OP'], OPERATORS['MATCH'], OPERATORS['MATCH_MUT'])
+
+def raise_depth_error() -> None:
+    """Raise the error reported when MAX_RECURSION_DEPTH is exceeded."""
+    raise RuntimeError(f'Maximum recursion depth ({MAX_RECURSION_DEPTH}) exceeded')
+
+def expr_evaluates_nodes(expr: Any) -> bool:
+    """Check if evaluating an expression may evaluate nodes (via Match operators)."""
+    return any_object(expr, lambda value: value.get('op') in MATCH_OPERATORS)
+
+def at_depth(ctx: Ctx, depth: int) -> Ctx:
+    """Create a context sharing ctx's state with the given recursion depth."""
+    return Ctx(
+        scope=ctx.scope,
+        parent=ctx.parent,
+        decls=ctx.decls,
+        rng=ctx.rng,
+        recursion_depth=depth
+    )
+
+class CompiledNode:
+    """
+    Base class of compiled nodes. render() mirrors evaluate_node();
+    stream() yields the same text in fragments, holding at most one
+    generator per level of the tree.
+    """
+    __slots__ = ()
+    # Set on nodes whose walk() may call the walk() of a child directly
+    tail_calls = False
+
+    def render(self, ctx: Ctx, depth: int) -> str:
+        raise NotImplementedError
+
+    def stream(self, ctx: Ctx, depth: int) -> Iterator[str]:
+        yield self.render(ctx, depth)
+
+    def walk(self, ctx: Ctx, depth: int) -> Any:
+        """
+        Evaluate for walk_node(): return the text, or a generator that yields
+        the generators of child nodes, receives their text and returns its own.
+        Depths below zero extend the depth limit; nodes evaluated recursively
+        start from zero.
+        """
+        return self.render(ctx, max(depth, 0))
+
+def walk_child(node: CompiledNode, ctx: Ctx, depth: int) -> Any:
+    """
+    walk() the one child a node chose. Children whose walk() calls a child of
+    their own get a walk_node() stack entry first, so that a chain of choices
+    does not recurse.
+    """
+    return walk_deferred(node, ctx, depth) if node.tail_calls else node.walk(ctx, depth)
+
+def walk_deferred(node: CompiledNode, ctx: Ctx, depth: int) -> Iterator[Any]:
+    text = node.walk(ctx, depth)
+    if type(text) is not str:
+        text = yield text
+    return text
+
+class EmptyNode(CompiledNode):
+    """Node types without output (unknown types, declarations)."""
+    __slots__ = ()
+
+    def render(self, ctx: Ctx, depth: int) -> str:
+        if depth >= MAX_RECURSION_DEPTH:
+            raise_depth_error()
+        return ''
+
+class LiteralNode(CompiledNode):
+    """Primitive literals and Text nodes."""
+    __slots__ = ('text',)
+
+    def __init__(self, text: str):
+        self.text = text
+
+    def render(self, ctx: Ctx, depth: int) -> str:
+        if depth >= MAX_RECURSION_DEPTH:
+            raise_depth_error()
+        return self.text
+
+class SequenceNode(CompiledNode):
+    """Sequence nodes and bare arrays (concatenate items)."""
+    __slots__ = ('items',)
+
+    def __init__(self, items: List[CompiledNode]):
+        self.items = items
+
+    def render(self, ctx: Ctx, depth: int) -> str:
+        if depth >= MAX_RECURSION_DEPTH:
+            raise_depth_error()
+        depth += 1
+        return ''.join([item.render(ctx, depth) for item in self.items])
+
+    def stream(self, ctx: Ctx, depth: int) -> Iterator[str]:
+        if depth >= MAX_RECURSION_DEPTH:
+            raise_depth_error()
+        depth += 1
+        for item in self.items:
+            yield from item.stream(ctx, depth)
+
+    def walk(self, ctx: Ctx, depth: int) -> Any:
+        if depth >= MAX_RECURSION_DEPTH:
+            raise_depth_error()
+        depth += 1
+        parts = []
+        for item in self.items:
+            text = item.walk(ctx, depth)
+            if type(text) is not str:
+                text = yield text
+            parts.append(text)
+        return ''.join(parts)
+
+class OptionNode(CompiledNode):
+    """Option nodes (uniform random choice)."""
+    __slots__ = ('items', 'count')
+    tail_calls = True
+
+    def __init__(self, items: List[Optional[CompiledNode]]):
+        self.items = items
+        self.count = len(items)
+
+    def render(self, ctx: Ctx, depth: int) -> str:
+        if depth >= MAX_RECURSION_DEPTH:
+            raise_depth_error()
+        if not self.count:
+            return ''
+        chosen = self.items[int(ctx.rng() * self.count)]
+        return chosen.render(ctx, depth + 1) if chosen is not None else ''
+
+    def stream(self, ctx: Ctx, depth: int) -> Iterator[str]:
+        if depth >= MAX_RECURSION_DEPTH:
+            raise_depth_error()
+        if self.count:
+            chosen = self.items[int(ctx.rng() * self.count)]
+            if chosen is not None:
+                yield from chosen.stream(ctx, depth + 1)
+
+    def walk(self, ctx: Ctx, depth: int) -> Any:
+        if depth >= MAX_RECURSION_DEPTH:
+            raise_depth_error()
+        if not self.count:
+            return ''
+        chosen = self.items[int(ctx.rng() * self.count)]
+        return walk_child(chosen, ctx, depth + 1) if chosen is not None else ''
+
+class RouletteNode(CompiledNode):
+    """
+    Roulette nodes (weighted choice), see weighted_choice().
+    Constant weights are summed into a cumulative table once; only weights
+    that depend on the context are evaluated on each draw.
+    """
+    __slots__ = ('weights', 'values', 'cumulative', 'total', 'needs_depth')
+    tail_calls = True
+
+    def __init__(self, weights: List[Any], values: List[CompiledNode]):
+        self.values = values
+        constants = [constant_weight(weight_expr) for weight_expr in weights]
+        if None in constants:
+            self.weights = [(weight, compile_expr(weight_expr) if weight is None else None)
+                            for weight, weight_expr in zip(constants, weights)]
+            self.cumulative = None
+            self.total = None
+        else:
+            self.weights = None
+            self.cumulative = list(accumulate(constants))
+            self.total = sum(constants)
+        self.needs_depth = expr_evaluates_nodes(weights)
+
+    def choose(self, ctx: Ctx) -> Optional[CompiledNode]:
+        if not self.values:
+            return None
+        if self.weights is None:
+            cumulative = self.cumulative
+            total_weight = self.total
+        else:
+            weights = [weight_value(weight_fn(ctx)) if weight is None else weight
+                       for weight, weight_fn in self.weights]
+            cumulative = list(accumulate(weights))
+            total_weight = sum(weights)
+        if total_weight <= 0:
+            return self.values[0]
+        return self.values[pick_weighted(cumulative, ctx.rng() * total_weight)]
+
+    def render(self, ctx: Ctx, depth: int) -> str:
+        if depth >= MAX_RECURSION_DEPTH:
+            raise_depth_error()
+        chosen = self.choose(at_depth(ctx, depth + 1) if self.needs_depth else ctx)
+        return chosen.render(ctx, depth + 1) if chosen is not None else ''
+
+    def stream(self, ctx: Ctx, depth: int) -> Iterator[str]:
+        if depth >= MAX_RECURSION_DEPTH:
+            raise_depth_error()
+        chosen = self.choose(at_depth(ctx, depth + 1) if self.needs_depth else ctx)
+        if chosen is not None:
+            yield from chosen.stream(ctx, depth + 1)
+
+    def walk(self, ctx: Ctx, depth: int) -> Any:
+        if depth >= MAX_RECURSION_DEPTH:
+            raise_depth_error()
+        chosen = self.choose(at_depth(ctx, max(depth + 1, 0)) if self.needs_depth else ctx)
+        return walk_child(chosen, ctx, depth + 1) if chosen is not None else ''
+
+class RepetitionNode(CompiledNode):
+    """Repetition nodes (fixed times)."""
+    __slots__ = ('times', 'value', 'separator')
+
+    def __init__(self, times: int, value: CompiledNode, separator: Optional[CompiledNode]):
+        self.times = times
+        self.value = value
+        self.separator = separator
+
+    def render(self, ctx: Ctx, depth: int) -> str:
+        if depth >= MAX_RECURSION_DEPTH:
+            raise_depth_error()
+        depth += 1
+        value = self.value
+        parts = [value.render(ctx, depth) for _ in range(self.times)]
+        sep = self.separator.render(ctx, depth) if self.separator is not None else ''
+        return sep.join(parts)
+
+    def stream(self, ctx: Ctx, depth: int) -> Iterator[str]:
+        # The separator is evaluated after the items, so only a literal one streams
+        if not (self.separator is None or isinstance(self.separator, LiteralNode)):
+            yield self.render(ctx, depth)
+            return
+        if depth >= MAX_RECURSION_DEPTH:
+            raise_depth_error()
+        depth += 1
+        sep = self.separator.render(ctx, depth) if self.separator is not None else ''
+        for index in range(self.times):
+            if index and sep:
+                yield sep
+            yield from self.value.stream(ctx, depth)
+
+    def walk(self, ctx: Ctx, depth: int) -> Any:
+        if depth >= MAX_RECURSION_DEPTH:
+            raise_depth_error()
+        depth += 1
+        parts = []
+        for _ in range(self.times):
+            text = self.value.walk(ctx, depth)
+            if type(text) is not str:
+                text = yield text
+            parts.append(text)
+        sep = ''
+        if self.separator is not None:
+            sep = self.separator.walk(ctx, depth)
+            if type(sep) is not str:
+                sep = yield sep
+        return sep.join(parts)
+
+class DelegateNode(CompiledNode):
+    """Delegate nodes (expression-controlled repetition)."""
+    __slots__ = ('weight', 'invariant', 'value', 'index_name', 'separator', 'needs_depth')
+
+    def __init__(self, weight: Any, value: CompiledNode, index_name: str,
+                 separator: Optional[CompiledNode], invariant: bool = False):
+        self.weight = compile_expr(weight)
+        # The weight is evaluated once per loop, see delegate_weight_invariant()
+        self.invariant = invariant
+        self.value = value
+        self.index_name = index_name
+        self.separator = separator
+        self.needs_depth = expr_evaluates_nodes(weight)
+
+    def iterations(self, ctx: Ctx) -> Iterator[Ctx]:
+        """
+        Yield the context of each iteration; the weight is checked before each
+        one unless it is invariant. The same context is yielded every time,
+        its frame reset to the 'parent.' writes made so far (in ctx's frame)
+        and the index rebound.
+        """
+        index_name = self.index_name
+        iter_ctx = create_body_context(ctx)
+        frame = iter_ctx.scope.values
+        written = ctx.scope.values
+        frame[index_name] = 1
+        target_times = loop_count(self.weight(iter_ctx))
+        if self.invariant:
+            for iteration in range(1, target_times + 1):
+                frame.clear()
+                frame.update(written)
+                frame[index_name] = iteration
+                yield iter_ctx
+            return
+        iteration = 1
+        while iteration <= target_times:
+            yield iter_ctx
+            iteration += 1
+            if iteration > MAX_ITERATIONS:
+                break
+            frame.clear()
+            frame.update(written)
+            frame[index_name] = iteration
+            target_times = loop_count(self.weight(iter_ctx))
+
+    def render(self, ctx: Ctx, depth: int) -> str:
+        if depth >= MAX_RECURSION_DEPTH:
+            raise_depth_error()
+        depth += 1
+        # The delegate owns its scope: 'parent.' writes stay inside the loop
+        ctx = fork_context(ctx)
+        ctx.recursion_depth = depth
+        value = self.value
+        parts = [value.render(iter_ctx, depth) for iter_ctx in self.iterations(ctx)]
+        sep = self.separator.render(ctx, depth) if self.separator is not None else ''
+        return sep.join(parts)
+
+    def stream(self, ctx: Ctx, depth: int) -> Iterator[str]:
+        # The separator is evaluated after the loop, so only a literal one streams
+        if not (self.separator is None or isinstance(self.separator, LiteralNode)):
+            yield self.render(ctx, depth)
+            return
+        if depth >= MAX_RECURSION_DEPTH:
+            raise_depth_error()
+        depth += 1
+        ctx = fork_context(ctx)
+        ctx.recursion_depth = depth
+        sep = self.separator.text if self.separator is not None else ''
+        first = True
+        for iter_ctx in self.iterations(ctx):
+            if sep and not first:
+                yield sep
+            first = False
+            yield from self.value.stream(iter_ctx, depth)
+
+    def walk(self, ctx: Ctx, depth: int) -> Any:
+        if depth >= MAX_RECURSION_DEPTH:
+            raise_depth_error()
+        depth += 1
+        ctx = fork_context(ctx)
+        ctx.recursion_depth = max(depth, 0)
+        parts = []
+        for iter_ctx in self.iterations(ctx):
+            text = self.value.walk(iter_ctx, depth)
+            if type(text) is not str:
+                text = yield text
+            parts.append(text)
+        sep = ''
+        if self.separator is not None:
+            sep = self.separator.walk(ctx, depth)
+            if type(sep) is not str:
+                sep = yield sep
+        return sep.join(parts)
+
+class LayerNode(CompiledNode):
+    """Layer nodes (context with props and decls)."""
+    __slots__ = ('props', 'decls', 'hooks', 'items', 'values')
+    tail_calls = True
+
+    def __init__(self, props: List[Any], decls: Dict[str, Any], hooks: List[Any],
+                 items: Optional[CompiledNode], values: Optional[List[CompiledNode]]):
+        self.props = props
+        self.decls = decls
+        self.hooks = hooks
+        # Either a single node (object items) or a list of equally weighted values
+        self.items = items
+        self.values = values
+
+    def scope_context(self, ctx: Ctx, depth: int) -> Ctx:
+        """The layer's context with its props and decls, before the hooks run."""
+        owner = fork_context(ctx)
+        owner.recursion_depth = depth
+        child_ctx = create_body_context(owner)
+        scope = child_ctx.scope
+        # Each entry gets its own copy, so nested writes stay in this evaluation
+        for key, value in self.props:
+            scope[key] = copy_value(value)
+        if self.decls:
+            child_ctx.decls = Scope(self.decls, child_ctx.decls)
+        return child_ctx
+
+    def enter(self, ctx: Ctx, depth: int) -> Any:
+        """Set up the layer's context and pick its item; returns (child_ctx, item)."""
+        child_ctx = self.scope_context(ctx, depth)
+        for path, value, effect in self.hooks:
+            if effect is not None:
+                effect.render(child_ctx, depth)
+            else:
+                path.set(child_ctx, value(child_ctx))
+        if self.items is not None:
+            return child_ctx, self.items
+        values = self.values
+        if not values:
+            return child_ctx, None
+        return child_ctx, values[pick_uniform(child_ctx, len(values))]
+
+    def render(self, ctx: Ctx, depth: int) -> str:
+        if depth >= MAX_RECURSION_DEPTH:
+            raise_depth_error()
+        child_ctx, chosen = self.enter(ctx, depth + 1)
+        return chosen.render(child_ctx, depth + 1) if chosen is not None else ''
+
+    def stream(self, ctx: Ctx, depth: int) -> Iterator[str]:
+        if depth >= MAX_RECURSION_DEPTH:
+            raise_depth_error()
+        child_ctx, chosen = self.enter(ctx, depth + 1)
+        if chosen is not None:
+            yield from chosen.stream(child_ctx, depth + 1)
+
+    def walk(self, ctx: Ctx, depth: int) -> Any:
+        if depth >= MAX_RECURSION_DEPTH:
+            raise_depth_error()
+        child_ctx, chosen = self.enter(ctx, max(depth + 1, 0))
+        return walk_child(chosen, child_ctx, depth + 1) if chosen is not None else ''
+
+class VecNode(CompiledNode):
+    """Vec nodes (rendered as the string form of the evaluated list)."""
+    __slots__ = ('items',)
+
+    def __init__(self, items: List[CompiledNode]):
+        self.items = items
+
+    def render(self, ctx: Ctx, depth: int) -> str:
+        if depth >= MAX_RECURSION_DEPTH:
+            raise_depth_error()
+        depth += 1
+        return str([item.render(ctx, depth) for item in self.items])
+
+class RefNode(CompiledNode):
+    """Ref nodes. Targets found in the scope are raw nodes and are interpreted."""
+    __slots__ = ('path', 'fallback')
+    tail_calls = True
+
+    def __init__(self, path: PathAccessor, fallback: Optional[CompiledNode]):
+        self.path = path
+        self.fallback = fallback
+
+    def render(self, ctx: Ctx, depth: int) -> str:
+        if depth >= MAX_RECURSION_DEPTH:
+            raise_depth_error()
+        target = self.path.get(ctx)
+        if target is None:
+            if self.fallback is not None:
+                return self.fallback.render(ctx, depth + 1)
+            return ''
+        if is_object(target) and 'type' in target:
+            return evaluate_node(target, at_depth(ctx, depth + 1))
+        return str(target)
+
+    def stream(self, ctx: Ctx, depth: int) -> Iterator[str]:
+        if self.fallback is not None and self.path.get(ctx) is None:
+            if depth >= MAX_RECURSION_DEPTH:
+                raise_depth_error()
+            yield from self.fallback.stream(ctx, depth + 1)
+        else:
+            yield self.render(ctx, depth)
+
+    def walk(self, ctx: Ctx, depth: int) -> Any:
+        if depth >= MAX_RECURSION_DEPTH:
+            raise_depth_error()
+        target = self.path.get(ctx)
+        if target is None:
+            return walk_child(self.fallback, ctx, depth + 1) if self.fallback is not None else ''
+        if is_object(target) and 'type' in target:
+            # Targets are compiled once so that re-entered Layers do not recurse
+            return walk_child(cached_for_decl(ref_targets, target, compile_node), ctx, depth + 1)
+        return str(target)
+
+class ExprNode(CompiledNode):
+    """Expr and Call nodes (the string form of a compiled expression)."""
+    __slots__ = ('fn', 'needs_depth', 'choose')
+    tail_calls = True
+
+    def __init__(self, fn: ExprFn, needs_depth: bool):
+        self.fn = fn
+        self.needs_depth = needs_depth
+        # Set if the whole expression is a Match operator
+        self.choose = getattr(fn, 'choose', None)
+
+    def render(self, ctx: Ctx, depth: int) -> str:
+        if depth >= MAX_RECURSION_DEPTH:
+            raise_depth_error()
+        if self.needs_depth:
+            ctx = at_depth(ctx, depth + 1)
+        return str(self.fn(ctx))
+
+    def walk(self, ctx: Ctx, depth: int) -> Any:
+        if self.choose is None:
+            return self.render(ctx, max(depth, 0))
+        if depth >= MAX_RECURSION_DEPTH:
+            raise_depth_error()
+        ctx = at_depth(ctx, max(depth + 1, 0))
+        target = self.choose(ctx)
+        return walk_child(target, ctx, depth + 1) if target is not None else ''
+
+class InterpretedNode(CompiledNode):
+    """Nodes the compiler could not prepare; they are left to evaluate_node."""
+    __slots__ = ('node',)
+
+    def __init__(self, node: Any):
+        self.node = node
+
+    def render(self, ctx: Ctx, depth: int) -> str:
+        return evaluate_node(self.node, at_depth(ctx, depth))
+
+class EffectNode(CompiledNode):
+    """Set and Effect nodes. Assignments only live in the node's own scope."""
+    __slots__ = ('steps',)
+
+    def __init__(self, steps: List[Any]):
+        # Each step is (path accessor, compiled value, nested effect or None)
+        self.steps = steps
+
+    def render(self, ctx: Ctx, depth: int) -> str:
+        if depth >= MAX_RECURSION_DEPTH:
+            raise_depth_error()
+        depth += 1
+        ctx = fork_context(ctx)
+        ctx.recursion_depth = depth
+        for path, value, effect in self.steps:
+            if effect is not None:
+                effect.render(ctx, depth)
+            else:
+                path.set(ctx, value(ctx))
+        return ''
+
+def walk_node(node: CompiledNode, ctx: Ctx, max_depth: int = MAX_RECURSION_DEPTH) -> str:
+    """
+    Evaluate a compiled node with an explicit stack of walk() generators
+    instead of Python recursion. The output is the same as node.render().
+    
+    Args:
+        node: Compiled node
+        ctx: Evaluation context
+        max_depth: Nesting limit, which may be far above MAX_RECURSION_DEPTH.
+            Vec items, interpreted nodes and Match operators nested inside
+            larger expressions are still evaluated recursively, and keep the
+            MAX_RECURSION_DEPTH limit below the point where they start.
+    """
+    try:
+        text = node.walk(ctx, MAX_RECURSION_DEPTH - max_depth)
+        return text if type(text) is str else run_stack(text)
+    except RuntimeError as error:
+        if str(error) == f'Maximum recursion depth ({MAX_RECURSION_DEPTH}) exceeded':
+            raise RuntimeError(f'Maximum recursion depth ({max_depth}) exceeded') from None
+        raise
+
+def compile_steps(items: Any) -> List[Any]:
+    """Compile the set/effect entries of an Effect node or Layer 'before' hooks."""
+    steps = []
+    for item in items:
+        if is_object(item):
+            if item.get('type') == NODE_TYPES['SET']:
+                steps.append((path_accessor(item.get('path')), compile_expr(item.get('value')), None))
+            elif item.get('type') == NODE_TYPES['EFFECT']:
+                steps.append((None, None, (yield compile_task(item))))
+    return steps
+
+def compile_items(items: List[Any]) -> List[CompiledNode]:
+    """Compile a list of nodes; literals are compiled in place, without a task."""
+    compiled = []
+    for item in items:
+        if isinstance(item, (str, int, float, bool)):
+            compiled.append(LiteralNode(str(item)))
+        else:
+            compiled.append((yield compile_task(item)))
+    return compiled
+
+def compile_child(node: Any) -> Optional[CompiledNode]:
+    """Compile a chosen child; None stays None (no output, no depth check)."""
+    if node is None:
+        return None
+    if isinstance(node, (str, int, float, bool)):
+        return LiteralNode(str(node))
+    return (yield compile_task(node))
+
+def compile_option(node: Dict[str, Any]) -> CompiledNode:
+    items = []
+    for item in node.get('items', []):
+        items.append((yield from compile_child(item)))
+    return OptionNode(items)
+
+def compile_roulette(node: Dict[str, Any]) -> CompiledNode:
+    items = node.get('items', [])
+    weights = [item.get('weight', item.get('wt', 1)) for item in items]
+    values = yield from compile_items([item.get('value', item) for item in items])
+    return RouletteNode(weights, values)
+
+def compile_repetition(node: Dict[str, Any]) -> CompiledNode:
+    times = int(node.get('times', 0))
+    return RepetitionNode(
+        times,
+        (yield compile_task(node.get('value'))),
+        (yield from compile_child(node.get('separator')))
+    )
+
+def compile_delegate(node: Dict[str, Any]) -> CompiledNode:
+    return DelegateNode(
+        node.get('weight'),
+        (yield compile_task(node.get('value'))),
+        node.get('index', 'i'),
+        (yield from compile_child(node.get('separator'))),
+        delegate_weight_invariant(node)
+    )
+
+def compile_layer(node: Dict[str, Any]) -> CompiledNode:
+    props = []
+    raw_props = node.get('prop') or node.get('props', {})
+    if is_object(raw_props):
+        for key, value in raw_props.items():
+            props.append((key, value['value'] if is_object(value) and 'value' in value else value))
+
+    decls = layer_decls(node)
+    for decl in decls.values():
+        if is_object(decl) and 'branch' in decl:
+            if decl.get('type') == NODE_TYPES['DOMAIN']:
+                domain_index(decl)
+            elif decl.get('type') == NODE_TYPES['MATCH']:
+                match_table(decl)
+
+    steps = yield from compile_steps(node.get('before', []))
+    items = node.get('items', [])
+    if isinstance(items, list):
+        return LayerNode(props, decls, steps, None, (yield from compile_items(items)))
+    if is_object(items):
+        return LayerNode(props, decls, steps, (yield compile_task(items)), None)
+    return LayerNode(props, decls, steps, None, [])
+
+def compile_module(node: Dict[str, Any]) -> CompiledNode:
+    items = node.get('items', [])
+    default_item = node.get('default')
+    if isinstance(default_item, str) and default_item.startswith('$') and default_item[1:].isdigit():
+        index = int(default_item[1:])
+        chosen = items[index] if 0 <= index < len(items) else None
+        # The module level itself still counts towards the recursion depth
+        return SequenceNode([(yield compile_task(chosen))] if chosen is not None else [])
+    if default_item is not None:
+        return SequenceNode([(yield compile_task(default_item))])
+    return ModuleNode((yield from compile_items(items)))
+
+class ModuleNode(SequenceNode):
+    """Module nodes without a default entry (items joined with newlines)."""
+    __slots__ = ()
+
+    def render(self, ctx: Ctx, depth: int) -> str:
+        if depth >= MAX_RECURSION_DEPTH:
+            raise_depth_error()
+        depth += 1
+        return '\n'.join([item.render(ctx, depth) for item in self.items])
+
+    def stream(self, ctx: Ctx, depth: int) -> Iterator[str]:
+        if depth >= MAX_RECURSION_DEPTH:
+            raise_depth_error()
+        depth += 1
+        for index, item in enumerate(self.items):
+            if index:
+                yield '\n'
+            yield from item.stream(ctx, depth)
+
+    def walk(self, ctx: Ctx, depth: int) -> Any:
+        if depth >= MAX_RECURSION_DEPTH:
+            raise_depth_error()
+        depth += 1
+        parts = []
+        for item in self.items:
+            text = item.walk(ctx, depth)
+            if type(text) is not str:
+                text = yield text
+            parts.append(text)
+        return '\n'.join(parts)
+
+def compile_import(node: Dict[str, Any]) -> CompiledNode:
+    path = import_path(node)
+    return EmptyNode() if path is None else ImportNode(module_registry.get(path).root)
+
+class ImportNode(CompiledNode):
+    """Import nodes: the imported schema's root, shared through module_registry."""
+    __slots__ = ('root',)
+    tail_calls = True
+
+    def __init__(self, root: CompiledNode):
+        self.root = root
+
+    def context(self, ctx: Ctx) -> Ctx:
+        # The imported schema sees its own names only, but draws from the same generator
+        return Ctx(rng=ctx.rng)
+
+    def render(self, ctx: Ctx, depth: int) -> str:
+        if depth >= MAX_RECURSION_DEPTH:
+            raise_depth_error()
+        return self.root.render(self.context(ctx), depth + 1)
+
+    def stream(self, ctx: Ctx, depth: int) -> Iterator[str]:
+        if depth >= MAX_RECURSION_DEPTH:
+            raise_depth_error()
+        yield from self.root.stream(self.context(ctx), depth + 1)
+
+    def walk(self, ctx: Ctx, depth: int) -> Any:
+        if depth >= MAX_RECURSION_DEPTH:
+            raise_depth_error()
+        return walk_child(self.root, self.context(ctx), depth + 1)
+
+def compile_expr_node(expr: Any) -> CompiledNode:
+    return ExprNode(compile_expr(expr), expr_evaluates_nodes(expr))
+
+def compile_sequence(node: Dict[str, Any]) -> CompiledNode:
+    return SequenceNode((yield from compile_items(node.get('items', []))))
+
+def compile_vec(node: Dict[str, Any]) -> CompiledNode:
+    return VecNode((yield from compile_items(node.get('items', []))))
+
+def compile_ref(node: Dict[str, Any]) -> CompiledNode:
+    path = path_accessor(str(node.get('to') or node.get('path') or ''))
+    return RefNode(path, (yield compile_task(node['else'])) if 'else' in node else None)
+
+def compile_effect(node: Dict[str, Any]) -> CompiledNode:
+    return EffectNode((yield from compile_steps(node.get('items', []))))
+
+# Compilers return the CompiledNode, or a generator that yields the
+# compile_task() of each child, receives its CompiledNode and returns its own
+NODE_COMPILERS: Dict[str, Callable[[Dict[str, Any]], Any]] = {
+    NODE_TYPES['TEXT']: lambda node: LiteralNode(str(node.get('text', ''))),
+    NODE_TYPES['SEQUENCE']: compile_sequence,
+    NODE_TYPES['OPTION']: compile_option,
+    NODE_TYPES['ROULETTE']: compile_roulette,
+    NODE_TYPES['REPETITION']: compile_repetition,
+    NODE_TYPES['DELEGATE']: compile_delegate,
+    NODE_TYPES['LAYER']: compile_layer,
+    NODE_TYPES['MODULE']: compile_module,
+    NODE_TYPES['VEC']: compile_vec,
+    NODE_TYPES['REF']: compile_ref,
+    NODE_TYPES['EXPRESSION']: lambda node: compile_expr_node(node.get('value') or node.get('expr')),
+    NODE_TYPES['EXPR']: lambda node: compile_expr_node(node.get('value') or node.get('expr')),
+    NODE_TYPES['CALL']: lambda node: ExprNode(compile_call(node), expr_evaluates_nodes(node.get('args', []))),
+    NODE_TYPES['SET']: lambda node: EffectNode([
+        (path_accessor(node.get('path')), compile_expr(node.get('value')), None)
+    ]),
+    NODE_TYPES['EFFECT']: compile_effect,
+    NODE_TYPES['IMPORT']: compile_import,
+}
+
+def compile_task(node: Any) -> Iterator[Any]:
+    """compile_node() as a run_stack() task."""
+    if node is None:
+        return LiteralNode('')
+    if isinstance(node, (str, int, float, bool)):
+        return LiteralNode(str(node))
+    if isinstance(node, list):
+        return SequenceNode((yield from compile_items(node)))
+    if not is_object(node):
+        return LiteralNode(str(node))
+    compiler = NODE_COMPILERS.get(normalize_node_type(node.get('type', '')))
+    if compiler is None:
+        compiled = EmptyNode()
+    else:
+        try:
+            compiled = compiler(node)
+            if not isinstance(compiled, CompiledNode):
+                compiled = yield from compiled
+        except (AttributeError, KeyError, TypeError, ValueError):
+            # Malformed node: keep the interpreter's behaviour (and errors) at run time
+            compiled = InterpretedNode(node)
+    profiler = compiling_profiler.get()
+    return compiled if profiler is None else profiler.wrap(node, compiled)
+
+def compile_node(node: Any) -> CompiledNode:
+    """Compile a GenSON node into a CompiledNode, without recursing per level of the tree."""
+    return run_stack(compile_task(node))
+
+class CompiledSchema:
+    """A schema compiled once by compile() and reusable for any number of evaluations."""
+
+    def __init__(self, schema: Any, optimize_schema: bool = True, resolve_names: bool = True):
+        self.schema = schema
+        self.resolve_names = resolve_names
+        if optimize_schema:
+            self.optimized, self.stats = optimize(schema)
+        else:
+            self.optimized, self.stats = schema, None
+        # The file being loaded, which relative imports are taken from (see load())
+        loading = importing_paths.get()
+        self.path = loading[-1] if loading else None
+        imports = set()
+        self.resolved = resolve(self.optimized, imports) if resolve_names else self.optimized
+        # Files imported directly or indirectly (known when names are resolved)
+        self.imports = tuple(sorted(imports))
+        self.root = compile_node(self.resolved)
+        self.profiled = None
+        self.digest = None
+
+    @classmethod
+    def from_prepared(cls, prepared: Tuple[Any, ...]) -> 'CompiledSchema':
+        """
+        Rebuild a CompiledSchema from prepared(), skipping optimize() and resolve().
+        Only the resolved tree is kept: schema and optimized are None.
+        """
+        compiled = cls.__new__(cls)
+        (compiled.resolved, compiled.stats, compiled.resolve_names, compiled.imports,
+         compiled.digest) = prepared
+        compiled.schema = compiled.optimized = None
+        loading = importing_paths.get()
+        compiled.path = loading[-1] if loading else None
+        compiled.root = compile_node(compiled.resolved)
+        compiled.profiled = None
+        return compiled
+
+    def prepared(self) -> Tuple[Any, ...]:
+        """The picklable output of optimize() and resolve() (compiled nodes hold closures)."""
+        return (self.resolved, self.stats, self.resolve_names, self.imports, self.source_digest())
+
+    def source_digest(self) -> str:
+        """SHA-256 of the source schema's canonical JSON, kept by prepared()."""
+        if self.digest is None:
+            self.digest = hashlib.sha256(json.dumps(
+                self.schema, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')).hexdigest()
+        return self.digest
+
+    def select_root(self, options: Dict[str, Any]) -> CompiledNode:
+        """The root to evaluate: self.root unless a Profiler is recording."""
+        profiler = options.get('profile') or active_profiler.get()
+        if profiler is None or profiler is False:
+            return self.root
+        if profiler is True:
+            raise ValueError("'profile': True is handled by evaluate()")
+        if self.profiled is None or self.profiled[0] is not profiler:
+            with loading_file(self.path) if self.path is not None else nullcontext():
+                # The resolved tree is all a prepared schema keeps; its names are already bound
+                self.profiled = (profiler, profiler.compile(self.resolved, False))
+        return self.profiled[1]
+
+    def evaluate(self, options: Optional[Dict[str, Any]] = None) -> str:
+        """Evaluate the compiled schema, see evaluate() for the options."""
+        options = options or {}
+        if options.get('profile') is True:
+            profiler = Profiler()
+            text = self.evaluate({**options, 'profile': profiler})
+            sys.stderr.write(profiler.report())
+            return text
+        root = self.select_root(options)
+        root_ctx = create_root_context(options.get('seed'), options.get('rng'))
+        if options.get('engine') == 'iterative' or 'max_depth' in options:
+            return walk_node(root, root_ctx, options.get('max_depth', MAX_RECURSION_DEPTH))
+        return root.render(root_ctx, 0)
+
+    def evaluate_iter(self, options: Optional[Dict[str, Any]] = None) -> Iterator[str]:
+        """Yield the text of one evaluation in fragments, see evaluate_iter()."""
+        options = options or {}
+        if options.get('profile') is True:
+            profiler = Profiler()
+            yield from self.evaluate_iter({**options, 'profile': profiler})
+            sys.stderr.write(profiler.report())
+            return
+        root = self.select_root(options)
+        root_ctx = create_root_context(options.get('seed'), options.get('rng'))
+        if options.get('engine') == 'iterative' or 'max_depth' in options:
+            # walk() generators return whole texts: the output is one fragment
+            text = walk_node(root, root_ctx, options.get('max_depth', MAX_RECURSION_DEPTH))
+            if text:
+                yield text
+            return
+        for fragment in root.stream(root_ctx, 0):
+            if fragment:
+                yield fragment
+
+    def evaluate_to(self, fileobj: Any, options: Optional[Dict[str, Any]] = None,
+                    buffer_size: int = 65536) -> int:
+        """Write the text of one evaluation to fileobj, see evaluate_to()."""
+        written = 0
+        pending = []
+        pending_size = 0
+        for fragment in self.evaluate_iter(options):
+            pending.append(fragment)
+            pending_size += len(fragment)
+            if pending_size >= buffer_size:
+                fileobj.write(''.join(pending))
+                written += pending_size
+                pending = []
+                pending_size = 0
+        if pending:
+            fileobj.write(''.join(pending))
+            written += pending_size
+        return written
+
+    def evaluate_many(self, n: int, seed: Optional[int] = None, start: int = 0) -> Iterator[str]:
+        """Yield samples start..start+n-1, sample i being seeded with derive_seed(seed, i)."""
+        if seed is None:
+            seed = random.SystemRandom().getrandbits(64)
+        rng = random.Random()
+        # The root scope is never written to, so one context serves every sample
+        root_ctx = create_root_context(rng=rng)
+        render = self.select_root({}).render
+        for index in range(start, start + n):
+            rng.seed(derive_seed(seed, index))
+            yield render(root_ctx, 0)
+
+def compile(schema: Any, optimize_schema: bool = True, resolve_names: bool = True) -> CompiledSchema:
+    """
+    Compile a GenSON schema for repeated evaluation.
+
+    Args:
+        schema: GenSON schema (AST)
+        optimize_schema: Fold the static parts of the schema first, see optimize()
+        resolve_names: Bind names to declarations first, see resolve()
+
+    Returns:
+        CompiledSchema whose evaluate() produces the same text as evaluate()
+
+    Raises:
+        ResolutionError: If resolve_names is set and a name cannot resolve
+    """
+    return CompiledSchema(schema, optimize_schema, resolve_names)
+
+# Schemas evaluate() and friends compiled, by identity like declarations
+SCHEMA_CACHE_SIZE = 256
+compiled_schemas: Dict[int, Any] = {}
+
+def compiled_schema(schema: Any) -> CompiledSchema:
+    """
+    The CompiledSchema of a schema object, compiled on first use. The one-shot
+    functions (evaluate() and friends) share it, so optimize() and resolve()
+    run once per schema object rather than once per call; a schema changed in
+    place afterwards needs compile() or a new object.
+    """
+    if isinstance(schema, CompiledSchema):
+        return schema
+    return cached_for_decl(compiled_schemas, schema, CompiledSchema, SCHEMA_CACHE_SIZE)
+
+# ============================================================================
+# Schema Cache
+# ============================================================================
+#
+# load() pickles CompiledSchema.prepared() under a key made of the source
+# bytes, the load options and runtime_version(). A changed schema file or
+# runtime therefore misses the cache instead of reading stale entries.
+# Entries of schemas with imports also record the digest of every imported
+# file and the directory relative imports were taken from.
+
+# Bump when the layout of prepared() or of the cache entries changes
+CACHE_FORMAT = 3
+
+@lru_cache(maxsize=None)
+def runtime_version() -> str:
+    """Hash of this module's source and the Python version the cache was written by."""
+    with open(os.path.abspath(__file__), 'rb') as f:
+        source = f.read()
+    tag = f'{CACHE_FORMAT}:{sys.version_info[0]}.{sys.version_info[1]}:{pickle.HIGHEST_PROTOCOL}'
+    return hashlib.sha256(tag.encode() + b'\0' + source).hexdigest()[:16]
+
+def cache_key(source: bytes, optimize_schema: bool, resolve_names: bool) -> str:
+    """Name of the cache entry for a schema file's bytes and load options."""
+    digest = hashlib.sha256(source)
+    digest.update(f'\0{runtime_version()}:{int(optimize_schema)}{int(resolve_names)}'.encode())
+    return digest.hexdigest()
+
+def file_digest(path: str) -> Optional[str]:
+    """SHA-256 of a file's bytes, or None if it cannot be read."""
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return None
+
+def read_cache_entry(cache_path: str, base_dir: str) -> Optional[CompiledSchema]:
+    """The cached schema at cache_path, or None if it is missing, unreadable or stale."""
+    try:
+        with open(cache_path, 'rb') as f:
+            entry = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError, IndexError, TypeError):
+        # Truncated or foreign file: rebuild it
+        return None
+    if not isinstance(entry, tuple) or len(entry) != 3:
+        return None
+    prepared, entry_base_dir, digests = entry
+    if digests:
+        if entry_base_dir != base_dir:
+            return None
+        if any(file_digest(path) != digest for path, digest in digests.items()):
+            return None
+    return CompiledSchema.from_prepared(prepared)
+
+def write_cache_entry(cache_path: str, compiled: CompiledSchema, base_dir: str) -> None:
+    """Write a cache entry atomically; a cache that cannot be written is skipped."""
+    cache_dir = os.path.dirname(cache_path)
+    entry = (compiled.prepared(), base_dir, {path: file_digest(path) for path in compiled.imports})
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, cache_path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+    except (OSError, pickle.PicklingError, RecursionError):
+        pass
+
+def load(path: str, cache_dir: Optional[str] = None, optimize_schema: bool = True,
+         resolve_names: bool = True) -> CompiledSchema:
+    """
+    Load and compile a GenSON schema file, reusing a cached preparation if possible.
+    Relative import paths in the file are taken from its directory.
+
+    Args:
+        path: Path of the JSON schema
+        cache_dir: Directory of cache entries (created if needed); None disables the cache
+        optimize_schema: See compile()
+        resolve_names: See compile()
+
+    Returns:
+        CompiledSchema, as compile(json.load(path)) would return
+
+    Raises:
+        ResolutionError: If resolve_names is set and a name cannot resolve
+        ValueError: If the file imports itself, directly or indirectly
+    """
+    path = os.path.abspath(path)
+    with open(path, 'rb') as f:
+        source = f.read()
+    with loading_file(path):
+        if cache_dir is None:
+            return CompiledSchema(json.loads(source), optimize_schema, resolve_names)
+        cache_path = os.path.join(cache_dir, cache_key(source, optimize_schema, resolve_names) + '.pickle')
+        compiled = read_cache_entry(cache_path, os.path.dirname(path))
+        if compiled is None:
+            compiled = CompiledSchema(json.loads(source), optimize_schema, resolve_names)
+            write_cache_entry(cache_path, compiled, os.path.dirname(path))
+        return compiled
+
+# ============================================================================
+# Lazy Module Loading
+# ============================================================================
+#
+# load_module() memory-maps a schema file and finds the byte span of every
+# top-level items and refs entry with a token scan, without building Python
+# objects for them. An entry is parsed and compiled when it is first asked
+# for, so a job that evaluates one entry of a large Module pays for that
+# entry only.
+
+# Strings (with escapes) and structural characters; numbers and literals are
+# skipped as the text between two tokens
+JSON_TOKEN = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"|[\[\]{},:]', re.S)
+
+# Everything up to and including the next bracket outside a string, so the
+# inside of a nested value costs one match per bracket rather than per token
+try:
+    JSON_BRACKET = re.compile(rb'[^"\[\]{}]*+(?:"[^"\\]*+(?:\\.[^"\\]*+)*+"[^"\[\]{}]*+)*+([\[\]{}])', re.S)
+except re.error:
+    # No possessive quantifiers before Python 3.11: same matches, but the
+    # regex engine keeps backtracking state for every string it passes
+    JSON_BRACKET = re.compile(rb'[^"\[\]{}]*(?:"[^"\\]*(?:\\.[^"\\]*)*"[^"\[\]{}]*)*([\[\]{}])', re.S)
+
+JSON_SPACE = re.compile(rb'[ \t\n\r]*')
+
+def json_token(buffer: Any, position: int) -> Any:
+    """The next JSON_TOKEN match at or after position."""
+    token = JSON_TOKEN.search(buffer, position)
+    if token is None:
+        raise ValueError(f'unexpected end of JSON after offset {position}')
+    return token
+
+def skip_json_value(buffer: Any, start: int) -> Tuple[int, Any]:
+    """Skip the JSON value starting at offset start; return its end and the token after it."""
+    token = json_token(buffer, start)
+    lead = token.group()[:1]
+    if lead in b',]}':
+        return token.start(), token
+    if lead == b'"':
+        return token.end(), json_token(buffer, token.end())
+    if lead not in b'[{':
+        raise ValueError(f'unexpected {token.group()!r} at offset {token.start()}')
+    depth = 1
+    position = token.end()
+    while depth:
+        bracket = JSON_BRACKET.match(buffer, position)
+        if bracket is None:
+            raise ValueError(f'unterminated JSON value at offset {token.start()}')
+        depth += 1 if bracket.group(1) in b'[{' else -1
+        position = bracket.end()
+    return position, json_token(buffer, position)
+
+def scan_json_entries(buffer: Any, opening: Any) -> Tuple[Any, Any]:
+    """
+    Index the entries of the array or object whose opening token was just read.
+
+    Returns:
+        (entries, closing token): a list of (start, end) spans for an array,
+        or a dict of key -> (start, end) for an object
+    """
+    is_array = opening.group() == b'['
+    entries = [] if is_array else {}
+    position = opening.end()
+    while True:
+        if is_array:
+            end, token = skip_json_value(buffer, position)
+            if JSON_SPACE.match(buffer, position).end() < end:
+                entries.append((position, end))
+        else:
+            token = json_token(buffer, position)
+            if token.group() == b'}':
+                return entries, token
+            key = json.loads(token.group())
+            colon = json_token(buffer, token.end())
+            end, token = skip_json_value(buffer, colon.end())
+            entries[key] = (colon.end(), end)
+        if token.group() != b',':
+            return entries, token
+        position = token.end()
+
+class LazyModule:
+    """A Module schema file whose items and refs entries are parsed on first use."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, 'rb')
+        try:
+            self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files cannot be mapped
+            self.buffer = b''
+        self.header = None
+        self.item_spans = []
+        self.ref_spans = {}
+        self.items = {}
+        self.refs = {}
+        self.compiled = {}
+        self.index()
+
+    def index(self) -> None:
+        """Parse the top-level keys except items and refs, and record their entries' spans."""
+        token = JSON_TOKEN.search(self.buffer)
+        if token is None or token.group() != b'{':
+            return
+        header = {}
+        while token.group() != b'}':
+            token = json_token(self.buffer, token.end())
+            if token.group() == b'}':
+                break
+            key = json.loads(token.group())
+            colon = json_token(self.buffer, token.end())
+            opening = json_token(self.buffer, colon.end())
+            if key in ('items', 'refs') and opening.group() == (b'[' if key == 'items' else b'{'):
+                spans, closing = scan_json_entries(self.buffer, opening)
+                if key == 'items':
+                    self.item_spans = spans
+                else:
+                    self.ref_spans = spans
+                token = json_token(self.buffer, closing.end())
+            else:
+                end, token = skip_json_value(self.buffer, colon.end())
+                header[key] = json.loads(self.buffer[colon.end():end])
+        if normalize_node_type(header.get('type', '')) == NODE_TYPES['MODULE']:
+            self.header = header
+
+    def parse(self, span: Tuple[int, int]) -> Any:
+        """Parse the JSON text at a (start, end) span of the file."""
+        return json.loads(self.buffer[span[0]:span[1]])
+
+    def item(self, index: int) -> Any:
+        """Entry index of items, parsed once."""
+        if index not in self.items:
+            self.items[index] = self.parse(self.item_spans[index])
+        return self.items[index]
+
+    def ref(self, name: str) -> Any:
+        """Entry name of refs, parsed once."""
+        if name not in self.refs:
+            self.refs[name] = self.parse(self.ref_spans[name])
+        return self.refs[name]
+
+    def schema(self, entry: Optional[str] = None) -> Any:
+        """
+        The smallest schema that evaluates like the file (or like its entry).
+
+        Args:
+            entry: '$N' for items[N], a refs name, or None for the Module's default
+        """
+        if self.header is None:
+            return json.loads(self.buffer[:])
+        default_item = self.header.get('default') if entry is None else entry
+        if isinstance(default_item, str) and default_item.startswith('$') and default_item[1:].isdigit():
+            index = int(default_item[1:])
+            if index >= len(self.item_spans):
+                # Left to resolve() and the evaluators to report or render as ''
+                return {**self.header, 'items': [], 'default': default_item}
+            return {**self.header, 'items': [self.item(index)], 'default': '$0'}
+        if entry is not None:
+            if entry not in self.ref_spans:
+                raise ValueError(f'unknown Module entry {entry!r}')
+            return {**self.header, 'items': [self.ref(entry)], 'default': '$0'}
+        if default_item is not None:
+            return {**self.header, 'items': []}
+        # Without a default every item is evaluated
+        return {**self.header, 'items': [self.item(index) for index in range(len(self.item_spans))]}
+
+    def compile(self, entry: Optional[str] = None, optimize_schema: bool = True,
+                resolve_names: bool = True) -> CompiledSchema:
+        """Compile schema(entry) once per entry and options, see compile()."""
+        key = (entry, optimize_schema, resolve_names)
+        if key not in self.compiled:
+            with loading_file(os.path.abspath(self.path)):
+                self.compiled[key] = CompiledSchema(self.schema(entry), optimize_schema, resolve_names)
+        return self.compiled[key]
+
+    def close(self) -> None:
+        """Unmap the file; parsed entries and compiled schemas stay usable."""
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+        self.file.close()
+
+    def __enter__(self) -> 'LazyModule':
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+def load_module(path: str) -> LazyModule:
+    """
+    Open a GenSON schema file for lazy loading of its Module entries.
+
+    Args:
+        path: Path of the JSON schema
+
+    Returns:
+        LazyModule; compile() it, optionally for one entry ('$N' or a refs name)
+    """
+    return LazyModule(path)
+
+# ============================================================================
+# Module Registry
+# ============================================================================
+#
+# Import declarations and nodes name schema files. module_registry loads
+# each file once per process and shares the CompiledSchema and the
+# declarations it exports with every importer and thread; importers merge
+# the exports into their Layer's declaration table, so nothing is copied
+# per evaluation. Schemas compiled before an invalidate() keep the version
+# they were compiled with.
+
+# Absolute paths of the files being loaded, innermost last
+importing_paths: ContextVar = ContextVar('importing_paths', default=())
+
+@contextmanager
+def loading_file(path: str) -> Iterator[None]:
+    """Mark a file as being loaded, for relative imports and import cycle checks."""
+    loading = importing_paths.get()
+    if path in loading:
+        raise ValueError('import cycle: ' + ' -> '.join(loading[loading.index(path):] + (path,)))
+    token = importing_paths.set(loading + (path,))
+    try:
+        yield
+    finally:
+        importing_paths.reset(token)
+
+def module_exports(compiled: CompiledSchema) -> Dict[str, Any]:
+    """Declarations an imported schema provides: those of its root Layer or Module."""
+    root = compiled.resolved
+    if is_object(root) and normalize_node_type(root.get('type', '')) in (NODE_TYPES['LAYER'], NODE_TYPES['MODULE']):
+        return layer_decls(root)
+    return {}
+
+class ModuleRegistry:
+    """
+    Imported schema files by absolute path, each loaded once and shared
+    read-only. Holds at most max_size files, dropping the least recently used.
+    """
+
+    def __init__(self, max_size: int = 256, cache_dir: Optional[str] = None):
+        self.max_size = max_size
+        self.cache_dir = cache_dir
+        self.modules: 'OrderedDict[str, Tuple[CompiledSchema, Dict[str, Any]]]' = OrderedDict()
+        # Reentrant: loading a file loads the files it imports
+        self.lock = threading.RLock()
+
+    def entry(self, path: str) -> Tuple[CompiledSchema, Dict[str, Any]]:
+        """The compiled schema of a file and its exports, loading it on first use."""
+        path = os.path.abspath(path)
+        with self.lock:
+            entry = self.modules.get(path)
+            if entry is not None:
+                self.modules.move_to_end(path)
+                return entry
+            compiled = load(path, self.cache_dir)
+            entry = (compiled, module_exports(compiled))
+            self.modules[path] = entry
+            while len(self.modules) > self.max_size:
+                self.modules.popitem(last=False)
+            return entry
+
+    def get(self, path: str) -> CompiledSchema:
+        """The compiled schema of a file, see load()."""
+        return self.entry(path)[0]
+
+    def exports(self, path: str) -> Dict[str, Any]:
+        """The declarations a file exports by name, see module_exports()."""
+        return self.entry(path)[1]
+
+    def invalidate(self, path: Optional[str] = None) -> None:
+        """Forget one file (reloaded on its next import), or every file."""
+        with self.lock:
+            # Cached one-shot schemas may hold the old version
+            compiled_schemas.clear()
+            if path is None:
+                self.modules.clear()
+            else:
+                self.modules.pop(os.path.abspath(path), None)
+
+    def __contains__(self, path: str) -> bool:
+        return os.path.abspath(path) in self.modules
+
+    def __len__(self) -> int:
+        return len(self.modules)
+
+module_registry = ModuleRegistry()
+
+# ============================================================================
+# Profiling
+# ============================================================================
+#
+# A Profiler compiles its own copy of the schema in which every node is
+# wrapped in a ProfiledNode and every operator closure counts its calls.
+# Schemas evaluated without a profiler never see these wrappers.
+
+compiling_profiler: ContextVar = ContextVar('compiling_profiler', default=None)
+active_profiler: ContextVar = ContextVar('active_profiler', default=None)
+
+class NodeProfile:
+    """Counters for one schema node."""
+    __slots__ = ('pointer', 'node_type', 'calls', 'cumulative', 'self_time', 'bytes', 'active')
+
+    def __init__(self, pointer: str, node_type: str):
+        self.pointer = pointer
+        self.node_type = node_type
+        self.calls = 0
+        self.cumulative = 0.0
+        self.self_time = 0.0
+        self.bytes = 0
+        self.active = 0
+
+    def label(self) -> str:
+        """Frame name of the node in collapsed stacks."""
+        return f'{self.node_type} {self.pointer or "/"}'.replace(';', ',')
+
+class ProfiledNode(CompiledNode):
+    """A compiled node that records its time and output in a Profiler."""
+    __slots__ = ('node', 'profile', 'profiler')
+
+    def __init__(self, node: CompiledNode, profile: NodeProfile, profiler: 'Profiler'):
+        self.node = node
+        self.profile = profile
+        self.profiler = profiler
+
+    def begin(self) -> float:
+        """Enter the node's frame; returns the start time."""
+        self.profiler.child_times.append(0.0)
+        self.profiler.frames.append(self.profile.label())
+        self.profile.active += 1
+        return time.perf_counter()
+
+    def end(self, start: float) -> None:
+        """Leave the node's frame, charging the time since start."""
+        profile = self.profile
+        profiler = self.profiler
+        child_times = profiler.child_times
+        frames = profiler.frames
+        elapsed = time.perf_counter() - start
+        self_time = elapsed - child_times.pop()
+        if child_times:
+            child_times[-1] += elapsed
+        stack = tuple(frames)
+        frames.pop()
+        profile.active -= 1
+        profile.calls += 1
+        profile.self_time += self_time
+        # Recursive calls are already included in the outermost one
+        if not profile.active:
+            profile.cumulative += elapsed
+        profiler.stacks[stack] = profiler.stacks.get(stack, 0.0) + self_time
+
+    def render(self, ctx: Ctx, depth: int) -> str:
+        start = self.begin()
+        try:
+            text = self.node.render(ctx, depth)
+        finally:
+            self.end(start)
+        self.profile.bytes += len(text)
+        return text
+
+    def stream(self, ctx: Ctx, depth: int) -> Iterator[str]:
+        yield self.render(ctx, depth)
+
+    def walk(self, ctx: Ctx, depth: int) -> Any:
+        # walk_node() finishes the children before resuming this generator,
+        # so the frames nest as they do in render()
+        start = self.begin()
+        try:
+            text = self.node.walk(ctx, depth)
+            if type(text) is not str:
+                text = yield from text
+        finally:
+            self.end(start)
+        self.profile.bytes += len(text)
+        return text
+
+class Profiler:
+    """
+    Per-node profile of evaluations.
+    
+    Use it as a context manager around evaluate() calls, or pass it as the
+    'profile' option. Nodes are identified by their JSON pointer in the
+    schema after optimize(); folded literals are not profiled, and items
+    of flattened Sequences may have moved.
+    
+    Example:
+        with Profiler() as profiler:
+            evaluate(schema, {'seed': 1})
+        print(profiler.report())
+    """
+
+    def __init__(self):
+        self.nodes: Dict[str, NodeProfile] = {}
+        self.operators: Dict[str, int] = {}
+        self.stacks: Dict[Tuple[str, ...], float] = {}
+        self.frames: List[str] = []
+        self.child_times: List[float] = []
+        self.pointers: Dict[int, str] = {}
+        self.tokens: List[Any] = []
+
+    def __enter__(self) -> 'Profiler':
+        self.tokens.append(active_profiler.set(self))
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        active_profiler.reset(self.tokens.pop())
+
+    def compile(self, schema: Any, resolve_names: bool = True) -> CompiledNode:
+        """Compile a copy of the schema with every node instrumented."""
+        # A private copy keeps instrumented Match tables out of the shared caches
+        schema = copy.deepcopy(schema)
+        if resolve_names:
+            schema = resolve(schema)
+        self.pointers = {}
+        self.index_pointers(schema, '')
+        token = compiling_profiler.set(self)
+        try:
+            return compile_node(schema)
+        finally:
+            compiling_profiler.reset(token)
+
+    def index_pointers(self, value: Any, pointer: str) -> None:
+        """Record the JSON pointer of every object and array in the schema."""
+        if isinstance(value, dict):
+            items = value.items()
+        elif isinstance(value, list):
+            items = enumerate(value)
+        else:
+            return
+        if id(value) in self.pointers:
+            return
+        self.pointers[id(value)] = pointer
+        for key, item in items:
+            self.index_pointers(item, pointer + '/' + str(key).replace('~', '~0').replace('/', '~1'))
+
+    def wrap(self, node: Any, compiled: CompiledNode) -> CompiledNode:
+        """Instrument a node compiled from the schema being profiled."""
+        pointer = self.pointers.get(id(node))
+        if pointer is None:
+            return compiled
+        profile = self.nodes.get(pointer)
+        if profile is None:
+            node_type = normalize_node_type(node.get('type', '')) if is_object(node) else 'seq'
+            profile = self.nodes[pointer] = NodeProfile(pointer, node_type or 'node')
+        return ProfiledNode(compiled, profile, self)
+
+    def count_operator(self, op: Any, fn: ExprFn) -> ExprFn:
+        """Instrument an operator closure to count its evaluations."""
+        op = str(op)
+        operators = self.operators
+        operators.setdefault(op, 0)
+        def counted(ctx: Ctx) -> Any:
+            operators[op] += 1
+            return fn(ctx)
+        return counted
+
+    def report(self, limit: Optional[int] = 30) -> str:
+        """Table of the nodes sorted by self time, followed by the operator counts."""
+        profiles = sorted(self.nodes.values(), key=lambda p: p.self_time, reverse=True)
+        lines = [f'{"self ms":>10} {"cum ms":>10} {"calls":>9} {"bytes":>11}  node']
+        for profile in profiles[:limit]:
+            lines.append(f'{profile.self_time * 1e3:>10.3f} {profile.cumulative * 1e3:>10.3f} '
+                         f'{profile.calls:>9} {profile.bytes:>11}  {profile.node_type} {profile.pointer or "/"}')
+        if self.operators:
+            lines.append('')
+            lines.append(f'{"calls":>9}  operator')
+            for op, calls in sorted(self.operators.items(), key=lambda item: item[1], reverse=True):
+                lines.append(f'{calls:>9}  {op}')
+        return '\n'.join(lines) + '\n'
+
+    def collapsed(self) -> str:
+        """Self times in microseconds as collapsed stacks, the input format of flamegraph.pl."""
+        return ''.join(f'{";".join(stack)} {round(self_time * 1e6)}\n'
+                       for stack, self_time in sorted(self.stacks.items()))
+
+# ============================================================================
+# Distribution Analysis
+# ============================================================================
+#
+# analyze() derives the output distribution of a schema without sampling it.
+# Nodes are combined bottom-up: Seq concatenates the outputs of its items,
+# Option, Roulette and Layer mix their branches, Repetition and Delegates
+# with a constant weight join independent draws. Probabilities are exact
+# Fractions. Nodes whose text depends on the context (expressions, Refs,
+# calls) are reported instead, and above them only bounds on the number of
+# distinct outputs are kept, as for distributions larger than the limit.
+
+ANALYSIS_LIMIT = 100000
+
+class Distribution:
+    """
+    Distinct outputs of a node with their probabilities, or bounds on their number.
+    outputs is None when the node cannot be analyzed exactly or has more
+    than the limit of outputs; min_count and max_count (None if unbounded or
+    too large to compute) still bound the number of distinct outputs.
+    """
+    __slots__ = ('outputs', 'min_count', 'max_count', 'exact', 'issues', 'choices')
+
+    def __init__(self, outputs: Optional[Dict[str, Fraction]] = None, min_count: int = 1,
+                 max_count: Optional[int] = None, exact: bool = True,
+                 issues: Optional[List[Tuple[str, str]]] = None):
+        self.outputs = outputs
+        if outputs is not None:
+            min_count = max_count = len(outputs)
+        self.min_count = min_count
+        self.max_count = max_count
+        # False if some part could not be analyzed (see issues)
+        self.exact = exact
+        self.issues = issues or []
+        # (pointer, probability or None, Distribution) per top-level branch, set by analyze()
+        self.choices = None
+
+    @property
+    def count(self) -> Optional[int]:
+        """The number of distinct outputs, if known."""
+        return self.min_count if self.min_count == self.max_count else None
+
+    def most_likely(self, n: Optional[int] = None) -> List[Tuple[str, Fraction]]:
+        """The n most likely outputs with their probabilities (all if n is None)."""
+        if self.outputs is None:
+            return []
+        return sorted(self.outputs.items(), key=lambda item: (-item[1], item[0]))[:n]
+
+    def describe_count(self) -> str:
+        if self.count is not None:
+            return str(self.count)
+        return f'{self.min_count}..{"unbounded" if self.max_count is None else self.max_count}'
+
+    def report(self, limit: Optional[int] = 20) -> str:
+        """The count, the most likely outputs, the top-level branches and what was not analyzed."""
+        lines = [f'exact: {"yes" if self.exact else "no"}',
+                 f'distinct outputs: {self.describe_count()}']
+        if self.outputs is not None:
+            lines.append('')
+            lines.append(f'{"probability":>12}  output')
+            for text, probability in self.most_likely(limit):
+                lines.append(f'{float(probability):>12.6g}  {text!r}')
+        if self.choices:
+            lines.append('')
+            lines.append(f'{"probability":>12} {"outputs":>12}  branch')
+            for pointer, probability, branch in self.choices:
+                shown = '?' if probability is None else f'{float(probability):.6g}'
+                lines.append(f'{shown:>12} {branch.describe_count():>12}  {pointer or "/"}')
+        if self.issues:
+            lines.append('')
+            lines.append('not analyzed:')
+            for pointer, reason in self.issues[:limit]:
+                lines.append(f'  {pointer or "/"}: {reason}')
+            if limit is not None and len(self.issues) > limit:
+                lines.append(f'  ... {len(self.issues) - limit} more')
+        return '\n'.join(lines) + '\n'
+
+def literal_distribution(text: str) -> Distribution:
+    return Distribution({text: Fraction(1)})
+
+def opaque_distribution(pointer: Any, reason: str) -> Distribution:
+    return Distribution(None, 1, None, False, [(format_pointer(pointer), reason)])
+
+def count_product(counts: List[Optional[int]]) -> Optional[int]:
+    """Product of upper bounds, None if any is unbounded."""
+    product = 1
+    for count in counts:
+        if count is None:
+            return None
+        product *= count
+    return product
+
+def count_power(count: Optional[int], exponent: int) -> Optional[int]:
+    """count ** exponent, None if unbounded or too large to be useful."""
+    if count is None or exponent * count.bit_length() > 65536:
+        return None
+    return count ** exponent
+
+def product_outputs(left: Dict[str, Fraction], right: Dict[str, Fraction],
+                    limit: int) -> Optional[Dict[str, Fraction]]:
+    """Outputs of left followed by right, or None if there may be more than limit."""
+    if len(left) * len(right) > limit:
+        return None
+    outputs = {}
+    for head, p in left.items():
+        for tail, q in right.items():
+            text = head + tail
+            outputs[text] = outputs.get(text, 0) + p * q
+    return outputs
+
+def concat_distributions(parts: List[Distribution], limit: int) -> Distribution:
+    """Distribution of independent parts concatenated in order."""
+    outputs = {'': Fraction(1)}
+    for part in parts:
+        if outputs is not None:
+            outputs = None if part.outputs is None else product_outputs(outputs, part.outputs, limit)
+    return Distribution(outputs, max((part.min_count for part in parts), default=1),
+                        count_product([part.max_count for part in parts]),
+                        all(part.exact for part in parts), [issue for part in parts for issue in part.issues])
+
+def mix_distributions(branches: List[Tuple[Optional[Fraction], Distribution]], limit: int) -> Distribution:
+    """Distribution of a choice between branches with the given probabilities (None if unknown)."""
+    branches = [(p, branch) for p, branch in branches if p != 0]
+    known = all(p is not None for p, _ in branches)
+    outputs = {} if known else None
+    for p, branch in branches:
+        if outputs is None or branch.outputs is None:
+            outputs = None
+            break
+        for text, q in branch.outputs.items():
+            outputs[text] = outputs.get(text, 0) + p * q
+        if len(outputs) > limit:
+            outputs = None
+    max_counts = [branch.max_count for _, branch in branches]
+    return Distribution(outputs,
+                        max((branch.min_count for _, branch in branches), default=1) if known else 1,
+                        None if None in max_counts else max(sum(max_counts), 1),
+                        known and all(branch.exact for _, branch in branches),
+                        [issue for _, branch in branches for issue in branch.issues])
+
+def join_distributions(value: Distribution, times: int, separator: Distribution, limit: int) -> Distribution:
+    """Distribution of separator.join() over `times` independent values, the separator drawn once."""
+    if times <= 0:
+        return literal_distribution('')
+    if times == 1:
+        return value
+    exact = value.exact and separator.exact
+    issues = value.issues + separator.issues
+    count = None if value.outputs is None else len(value.outputs)
+    if separator.outputs is None or count is None or (count > 1 and times * math.log(count) > math.log(limit)):
+        max_count = count_product([count_power(value.max_count, times), separator.max_count])
+        return Distribution(None, value.min_count, max_count, exact, issues)
+    outputs = {}
+    for sep, p in separator.outputs.items():
+        if count == 1:
+            joined = {sep.join([next(iter(value.outputs))] * times): Fraction(1)}
+        else:
+            joined = value.outputs
+            follow = product_outputs({sep: Fraction(1)}, value.outputs, limit)
+            for _ in range(times - 1):
+                joined = product_outputs(joined, follow, limit)
+        for text, q in joined.items():
+            outputs[text] = outputs.get(text, 0) + p * q
+    if len(outputs) > limit:
+        return Distribution(None, value.min_count, len(outputs), exact, issues)
+    return Distribution(outputs, exact=exact, issues=issues)
+
+def analyze_branches(node: Dict[str, Any], branches: List[Tuple[Optional[Fraction], Any, Any]],
+                     state: Dict[str, Any]) -> Distribution:
+    """Mix (probability, node, pointer) branches, keeping them for the top-level report."""
+    analyzed = [(p, pointer, analyze_node(item, pointer, state)) for p, item, pointer in branches]
+    state['choices'][id(node)] = analyzed
+    return mix_distributions([(p, branch) for p, _, branch in analyzed], state['limit'])
+
+def analyze_option(node: Dict[str, Any], pointer: Any, state: Dict[str, Any]) -> Distribution:
+    items = node.get('items', [])
+    if not isinstance(items, list):
+        raise TypeError('Option items must be an array')
+    if not items:
+        return literal_distribution('')
+    return analyze_branches(node, [(Fraction(1, len(items)), item, pointer_join(pointer_join(pointer, 'items'), i))
+                                   for i, item in enumerate(items)], state)
+
+def analyze_roulette(node: Dict[str, Any], pointer: Any, state: Dict[str, Any]) -> Distribution:
+    items = node.get('items', [])
+    if not items:
+        return literal_distribution('')
+    weights = [constant_weight(item.get('weight', item.get('wt', 1))) for item in items]
+    if None in weights:
+        probabilities = [None] * len(items)
+    else:
+        total = sum(weights)
+        if total <= 0:
+            probabilities = [Fraction(1)] + [Fraction(0)] * (len(items) - 1)
+        else:
+            probabilities = [Fraction(weight) / Fraction(total) for weight in weights]
+    branches = []
+    for i, (item, p) in enumerate(zip(items, probabilities)):
+        item_pointer = pointer_join(pointer_join(pointer, 'items'), i)
+        if 'value' in item:
+            branches.append((p, item['value'], pointer_join(item_pointer, 'value')))
+        else:
+            branches.append((p, item, item_pointer))
+    distribution = analyze_branches(node, branches, state)
+    if None in weights:
+        distribution.issues.append((format_pointer(pointer), 'Roulette weights depend on the context'))
+    return distribution
+
+def analyze_repetition(node: Dict[str, Any], pointer: Any, state: Dict[str, Any]) -> Distribution:
+    times = int(node.get('times', 0))
+    separator = node.get('separator')
+    return join_distributions(analyze_node(node.get('value'), pointer_join(pointer, 'value'), state), times,
+                              analyze_node(separator, pointer_join(pointer, 'separator'), state),
+                              state['limit'])
+
+def analyze_delegate(node: Dict[str, Any], pointer: Any, state: Dict[str, Any]) -> Distribution:
+    times = constant_loop_count(node.get('weight'))
+    if times is None:
+        return opaque_distribution(pointer, 'Delegate weight is evaluated on each iteration')
+    return join_distributions(analyze_node(node.get('value'), pointer_join(pointer, 'value'), state), times,
+                              analyze_node(node.get('separator'), pointer_join(pointer, 'separator'), state),
+                              state['limit'])
+
+def analyze_layer(node: Dict[str, Any], pointer: Any, state: Dict[str, Any]) -> Distribution:
+    items = node.get('items', [])
+    if isinstance(items, list):
+        if not items:
+            return literal_distribution('')
+        return analyze_branches(node, [(Fraction(1, len(items)), item, pointer_join(pointer_join(pointer, 'items'), i))
+                                       for i, item in enumerate(items)], state)
+    if is_object(items):
+        return analyze_node(items, pointer_join(pointer, 'items'), state)
+    return literal_distribution('')
+
+def analyze_module(node: Dict[str, Any], pointer: Any, state: Dict[str, Any]) -> Distribution:
+    items = node.get('items', [])
+    default_item = node.get('default')
+    if isinstance(default_item, str) and default_item.startswith('$') and default_item[1:].isdigit():
+        index = int(default_item[1:])
+        if not 0 <= index < len(items):
+            return literal_distribution('')
+        return analyze_node(items[index], pointer_join(pointer_join(pointer, 'items'), index), state)
+    if default_item is not None:
+        return analyze_node(default_item, pointer_join(pointer, 'default'), state)
+    parts = []
+    for i, item in enumerate(items):
+        if i:
+            parts.append(literal_distribution('\n'))
+        parts.append(analyze_node(item, pointer_join(pointer_join(pointer, 'items'), i), state))
+    return concat_distributions(parts, state['limit'])
+
+def analyze_import(node: Dict[str, Any], pointer: Any, state: Dict[str, Any]) -> Distribution:
+    path = import_path(node)
+    if path is None:
+        return literal_distribution('')
+    try:
+        imported = module_registry.get(path)
+    except (OSError, ValueError) as e:
+        return opaque_distribution(pointer, f'cannot import {node["path"]!r}: {e}')
+    return analyze_node(imported.resolved, pointer, state)
+
+NODE_ANALYZERS: Dict[str, Callable[[Dict[str, Any], Any, Dict[str, Any]], Distribution]] = {
+    NODE_TYPES['TEXT']: lambda node, pointer, state: literal_distribution(str(node.get('text', ''))),
+    NODE_TYPES['SEQUENCE']: lambda node, pointer, state: concat_distributions(
+        [analyze_node(item, pointer_join(pointer_join(pointer, 'items'), i), state)
+         for i, item in enumerate(node.get('items', []))], state['limit']),
+    NODE_TYPES['OPTION']: analyze_option,
+    NODE_TYPES['ROULETTE']: analyze_roulette,
+    NODE_TYPES['REPETITION']: analyze_repetition,
+    NODE_TYPES['DELEGATE']: analyze_delegate,
+    NODE_TYPES['LAYER']: analyze_layer,
+    NODE_TYPES['MODULE']: analyze_module,
+    NODE_TYPES['IMPORT']: analyze_import,
+    NODE_TYPES['REF']: lambda node, pointer, state: opaque_distribution(pointer, 'Ref reads the context'),
+    NODE_TYPES['EXPRESSION']: lambda node, pointer, state: opaque_distribution(pointer, 'expression depends on the context'),
+    NODE_TYPES['EXPR']: lambda node, pointer, state: opaque_distribution(pointer, 'expression depends on the context'),
+    NODE_TYPES['CALL']: lambda node, pointer, state: opaque_distribution(pointer, 'function call'),
+    NODE_TYPES['VEC']: lambda node, pointer, state: opaque_distribution(pointer, 'Vec output is not analyzed'),
+}
+
+def analyze_node(node: Any, pointer: Any, state: Dict[str, Any]) -> Distribution:
+    """Distribution of the text evaluate_node() returns for a node."""
+    if node is None:
+        return literal_distribution('')
+    if isinstance(node, (str, int, float, bool)):
+        return literal_distribution(str(node))
+    if isinstance(node, list):
+        return concat_distributions([analyze_node(item, pointer_join(pointer, i), state)
+                                     for i, item in enumerate(node)], state['limit'])
+    if not is_object(node):
+        return literal_distribution(str(node))
+    analyzer = NODE_ANALYZERS.get(normalize_node_type(node.get('type', '')))
+    if analyzer is None:
+        # Set, Effect, declarations and unknown types produce no text
+        return literal_distribution('')
+    try:
+        return analyzer(node, pointer, state)
+    except (AttributeError, KeyError, TypeError, ValueError, OverflowError):
+        return opaque_distribution(pointer, 'malformed node')
+
+def top_choice(node: Any) -> Any:
+    """The first Option, Roulette or Layer choice from the root, through Modules and single items."""
+    while True:
+        if isinstance(node, list) and len(node) == 1:
+            node = node[0]
+            continue
+        if not is_object(node):
+            return None
+        node_type = normalize_node_type(node.get('type', ''))
+        items = node.get('items', [])
+        if node_type in (NODE_TYPES['OPTION'], NODE_TYPES['ROULETTE']):
+            return node
+        if node_type == NODE_TYPES['LAYER']:
+            if isinstance(items, list):
+                return node
+            node = items
+        elif node_type == NODE_TYPES['SEQUENCE'] and isinstance(items, list) and len(items) == 1:
+            node = items[0]
+        elif node_type == NODE_TYPES['MODULE']:
+            default_item = node.get('default')
+            if isinstance(default_item, str) and default_item.startswith('$') and default_item[1:].isdigit():
+                index = int(default_item[1:])
+                node = items[index] if isinstance(items, list) and 0 <= index < len(items) else None
+            elif default_item is not None:
+                node = default_item
+            elif isinstance(items, list) and len(items) == 1:
+                node = items[0]
+            else:
+                return None
+        else:
+            return None
+
+def analyze(schema: Any, limit: int = ANALYSIS_LIMIT) -> Distribution:
+    """
+    Compute the output distribution of a schema without sampling it.
+    
+    Args:
+        schema: GenSON schema (AST) or CompiledSchema; it is optimized first
+        limit: Most distinct outputs to enumerate; beyond it only bounds are kept
+    
+    Returns:
+        Distribution with the exact probability of every output when possible,
+        bounds on the number of outputs otherwise, the probability of each
+        top-level branch, and the parts that could not be analyzed
+    """
+    if isinstance(schema, CompiledSchema):
+        tree = schema.resolved
+    else:
+        tree = optimize(schema)[0]
+    state = {'limit': limit, 'choices': {}}
+    distribution = analyze_node(tree, (), state)
+    top = top_choice(tree)
+    if top is not None and id(top) in state['choices']:
+        distribution.choices = [(format_pointer(pointer), p, branch)
+                                for p, pointer, branch in state['choices'][id(top)]]
+    return distribution
+
+# ============================================================================
+# Output Enumeration
+# ============================================================================
+#
+# enumerate_outputs() walks every combination of choices of a finite schema.
+# The schema is first turned into enumerators (zero-argument callables
+# returning a fresh iterator over a node's outputs), which rejects the nodes
+# whose outputs depend on the context before anything is yielded. Products
+# advance like an odometer, the last factor fastest, so the order is stable
+# and only one iterator per factor is alive.
+
+class EnumerationError(ValueError):
+    """Raised by enumerate_outputs() for nodes whose outputs cannot be listed."""
+
+    def __init__(self, pointer: Any, reason: str):
+        self.pointer = format_pointer(pointer)
+        self.reason = reason
+        super().__init__(f'{self.pointer or "/"}: cannot enumerate: {reason}')
+
+Enumerator = Callable[[], Iterator[str]]
+
+def constant_enumerator(text: str) -> Enumerator:
+    return lambda: iter((text,))
+
+def chain_enumerator(enumerators: List[Enumerator]) -> Enumerator:
+    """The outputs of every enumerator in turn (the branches of a choice)."""
+    if len(enumerators) == 1:
+        return enumerators[0]
+    def outputs() -> Iterator[str]:
+        for enumerator in enumerators:
+            yield from enumerator()
+    return outputs
+
+def product_enumerator(enumerators: List[Enumerator]) -> Enumerator:
+    """Every concatenation of one output per enumerator, the last one varying fastest."""
+    if len(enumerators) == 1:
+        return enumerators[0]
+    def outputs() -> Iterator[str]:
+        iterators = [enumerator() for enumerator in enumerators]
+        parts = [next(iterator, None) for iterator in iterators]
+        if None in parts:
+            return
+        while True:
+            yield ''.join(parts)
+            position = len(iterators) - 1
+            while position >= 0:
+                part = next(iterators[position], None)
+                if part is not None:
+                    parts[position] = part
+                    break
+                iterators[position] = enumerators[position]()
+                parts[position] = next(iterators[position])
+                position -= 1
+            if position < 0:
+                return
+    return outputs
+
+def join_enumerator(value: Enumerator, times: int, separator: Enumerator) -> Enumerator:
+    """Outputs of separator.join() over `times` values, for every separator."""
+    if times <= 0:
+        return constant_enumerator('')
+    if times == 1:
+        return value
+    def outputs() -> Iterator[str]:
+        for sep in separator():
+            yield from product_enumerator([value] + [constant_enumerator(sep), value] * (times - 1))()
+    return outputs
+
+def item_pointers(items: List[Any], pointer: Any) -> List[Tuple[Any, Any]]:
+    return [(item, pointer_join(pointer_join(pointer, 'items'), i)) for i, item in enumerate(items)]
+
+def option_branches(node: Dict[str, Any], pointer: Any) -> List[Tuple[Any, Any]]:
+    """(node, pointer) of every item an Option or Layer can choose; empty for a single ''."""
+    items = node.get('items', [])
+    if isinstance(items, list):
+        return item_pointers(items, pointer)
+    if normalize_node_type(node.get('type', '')) != NODE_TYPES['LAYER']:
+        raise EnumerationError(pointer, 'Option items must be an array')
+    # A Layer evaluates an object as its only item and ignores anything else
+    return [(items, pointer_join(pointer, 'items'))] if is_object(items) else []
+
+def roulette_branches(node: Dict[str, Any], pointer: Any) -> List[Tuple[Any, Any]]:
+    """(node, pointer) of every Roulette item with a positive weight."""
+    items = node.get('items', [])
+    if not isinstance(items, list) or not all(is_object(item) for item in items):
+        raise EnumerationError(pointer, 'Roulette items must be objects')
+    weights = [constant_weight(item.get('weight', item.get('wt', 1))) for item in items]
+    if None in weights:
+        raise EnumerationError(pointer, 'Roulette weights depend on the context')
+    if items and sum(weights) <= 0:
+        # weighted_choice() falls back to the first item
+        weights = [1] + [0] * (len(items) - 1)
+    branches = []
+    for (item, item_pointer), weight in zip(item_pointers(items, pointer), weights):
+        if weight > 0:
+            if 'value' in item:
+                branches.append((item['value'], pointer_join(item_pointer, 'value')))
+            else:
+                branches.append((item, item_pointer))
+    return branches
+
+def loop_times(node: Dict[str, Any], pointer: Any) -> int:
+    """The number of values a Repetition or constant-weight Delegate joins."""
+    if normalize_node_type(node.get('type', '')) == NODE_TYPES['REPETITION']:
+        try:
+            return int(node.get('times', 0))
+        except (TypeError, ValueError):
+            raise EnumerationError(pointer, 'Repetition times is not a number')
+    times = constant_loop_count(node.get('weight'))
+    if times is None:
+        raise EnumerationError(pointer, 'Delegate weight is evaluated on each iteration')
+    return times
+
+def module_parts(node: Dict[str, Any], pointer: Any) -> List[Tuple[Any, Any]]:
+    """(node, pointer) of the Module items whose texts are joined with newlines."""
+    items = node.get('items', [])
+    default_item = node.get('default')
+    if isinstance(default_item, str) and default_item.startswith('$') and default_item[1:].isdigit():
+        index = int(default_item[1:])
+        if not 0 <= index < len(items):
+            return []
+        return [(items[index], pointer_join(pointer_join(pointer, 'items'), index))]
+    if default_item is not None:
+        return [(default_item, pointer_join(pointer, 'default'))]
+    return item_pointers(items, pointer)
+
+def imported_root(node: Dict[str, Any], pointer: Any) -> Any:
+    """The resolved root of the file an Import node evaluates, None without a path."""
+    path = import_path(node)
+    if path is None:
+        return None
+    try:
+        return module_registry.get(path).resolved
+    except (OSError, ValueError) as e:
+        raise EnumerationError(pointer, f'cannot import {node["path"]!r}: {e}')
+
+def enumerate_branches(branches: List[Tuple[Any, Any]]) -> Enumerator:
+    if not branches:
+        return constant_enumerator('')
+    return chain_enumerator([compile_enumerator(item, pointer) for item, pointer in branches])
+
+def enumerate_loop(node: Dict[str, Any], pointer: Any) -> Enumerator:
+    return join_enumerator(compile_enumerator(node.get('value'), pointer_join(pointer, 'value')),
+                           loop_times(node, pointer),
+                           compile_enumerator(node.get('separator'), pointer_join(pointer, 'separator')))
+
+def enumerate_module(node: Dict[str, Any], pointer: Any) -> Enumerator:
+    enumerators = []
+    for i, (item, item_pointer) in enumerate(module_parts(node, pointer)):
+        if i:
+            enumerators.append(constant_enumerator('\n'))
+        enumerators.append(compile_enumerator(item, item_pointer))
+    return product_enumerator(enumerators) if enumerators else constant_enumerator('')
+
+def context_dependent(reason: str) -> Callable[[Dict[str, Any], Any], Any]:
+    def reject(node: Dict[str, Any], pointer: Any) -> Any:
+        raise EnumerationError(pointer, reason)
+    return reject
+
+NODE_ENUMERATORS: Dict[str, Callable[[Dict[str, Any], Any], Enumerator]] = {
+    NODE_TYPES['TEXT']: lambda node, pointer: constant_enumerator(str(node.get('text', ''))),
+    NODE_TYPES['SEQUENCE']: lambda node, pointer: product_enumerator(
+        [compile_enumerator(item, item_pointer) for item, item_pointer in item_pointers(node.get('items', []), pointer)]
+        or [constant_enumerator('')]),
+    NODE_TYPES['OPTION']: lambda node, pointer: enumerate_branches(option_branches(node, pointer)),
+    NODE_TYPES['ROULETTE']: lambda node, pointer: enumerate_branches(roulette_branches(node, pointer)),
+    NODE_TYPES['REPETITION']: enumerate_loop,
+    NODE_TYPES['DELEGATE']: enumerate_loop,
+    NODE_TYPES['LAYER']: lambda node, pointer: enumerate_branches(option_branches(node, pointer)),
+    NODE_TYPES['MODULE']: enumerate_module,
+    NODE_TYPES['IMPORT']: lambda node, pointer: compile_enumerator(imported_root(node, pointer), pointer),
+    NODE_TYPES['REF']: context_dependent('Ref reads the context'),
+    NODE_TYPES['EXPRESSION']: context_dependent('expression depends on the context'),
+    NODE_TYPES['EXPR']: context_dependent('expression depends on the context'),
+    NODE_TYPES['CALL']: context_dependent('function call'),
+    NODE_TYPES['VEC']: context_dependent('Vec output is not enumerated'),
+}
+
+def compile_enumerator(node: Any, pointer: Any) -> Enumerator:
+    """Enumerator of the texts evaluate_node() can return for a node."""
+    if node is None:
+        return constant_enumerator('')
+    if isinstance(node, (str, int, float, bool)):
+        return constant_enumerator(str(node))
+    if isinstance(node, list):
+        return product_enumerator([compile_enumerator(item, pointer_join(pointer, i))
+                                   for i, item in enumerate(node)]) if node else constant_enumerator('')
+    if not is_object(node):
+        return constant_enumerator(str(node))
+    enumerator = NODE_ENUMERATORS.get(normalize_node_type(node.get('type', '')))
+    if enumerator is None:
+        # Set, Effect, declarations and unknown types produce no text
+        return constant_enumerator('')
+    try:
+        return enumerator(node, pointer)
+    except EnumerationError:
+        raise
+    except (AttributeError, KeyError, TypeError, ValueError, OverflowError) as e:
+        raise EnumerationError(pointer, f'malformed node ({e})')
+
+def enumerate_outputs(schema: Any, limit: Optional[int] = None, distinct: bool = False) -> Iterator[str]:
+    """
+    Enumerate the texts a finite schema can produce, in a stable order.
+    
+    Args:
+        schema: GenSON schema (AST) or CompiledSchema; it is optimized first
+        limit: Optional maximum number of texts to yield
+        distinct: Skip texts already yielded. Every yielded text is kept in
+                  a set, so memory grows with the number of outputs; by
+                  default every combination of choices is yielded (texts may
+                  repeat) and memory is bounded by the depth of the schema
+    
+    Returns:
+        Iterator over the texts
+    
+    Raises:
+        EnumerationError: Immediately, for schemas with nodes whose outputs
+            depend on the context (Refs, expressions, calls, Delegates
+            without a constant weight, Roulettes with computed weights)
+    """
+    tree = schema.resolved if isinstance(schema, CompiledSchema) else optimize(schema)[0]
+    outputs = compile_enumerator(tree, ())()
+    if distinct:
+        outputs = unique_texts(outputs)
+    return outputs if limit is None else islice(outputs, max(limit, 0))
+
+def unique_texts(texts: Iterator[str]) -> Iterator[str]:
+    seen = set()
+    for text in texts:
+        if text not in seen:
+            seen.add(text)
+            yield text
+
+# ============================================================================
+# Distinct Sampling
+# ============================================================================
+#
+# sample_unique() counts the combinations of choices under every node and
+# maps a rank in 0..count-1 straight to its text (unranking), in the order
+# enumerate_outputs(distinct=False) yields them. Drawing distinct ranks draws
+# distinct combinations without retrying; only schemas where two combinations
+# produce the same text need extra draws. Schemas that cannot be counted fall
+# back to rejecting repeated samples of evaluate_many().
+
+Ranker = Tuple[int, Callable[[int], str]]
+
+# Combination counts with more bits are not computed (see count_power())
+RANK_BITS_LIMIT = 65536
+
+def constant_ranker(text: str) -> Ranker:
+    return 1, lambda rank: text
+
+def choice_ranker(rankers: List[Ranker]) -> Ranker:
+    """Ranks of every branch in turn."""
+    if not rankers:
+        return constant_ranker('')
+    if len(rankers) == 1:
+        return rankers[0]
+    bounds = list(accumulate(count for count, _ in rankers))
+    def unrank(rank: int) -> str:
+        i = bisect_right(bounds, rank)
+        return rankers[i][1](rank - bounds[i - 1] if i else rank)
+    return bounds[-1], unrank
+
+def product_ranker(rankers: List[Ranker], pointer: Any) -> Ranker:
+    """Ranks of the concatenations, the last factor varying fastest."""
+    if not rankers:
+        return constant_ranker('')
+    if len(rankers) == 1:
+        return rankers[0]
+    count = 1
+    for factor, _ in rankers:
+        count *= factor
+        if count.bit_length() > RANK_BITS_LIMIT:
+            raise EnumerationError(pointer, 'too many combinations to count')
+    def unrank(rank: int) -> str:
+        parts = []
+        for factor, unrank_factor in reversed(rankers):
+            rank, digit = divmod(rank, factor)
+            parts.append(unrank_factor(digit))
+        parts.reverse()
+        return ''.join(parts)
+    return count, unrank
+
+def join_ranker(value: Ranker, times: int, separator: Ranker, pointer: Any) -> Ranker:
+    """Ranks of separator.join() over `times` values, the separator varying slowest."""
+    if times <= 0:
+        return constant_ranker('')
+    if times == 1:
+        return value
+    value_count, unrank_value = value
+    separator_count, unrank_separator = separator
+    if times * value_count.bit_length() + separator_count.bit_length() > RANK_BITS_LIMIT:
+        raise EnumerationError(pointer, 'too many combinations to count')
+    values_count = value_count ** times
+    def unrank(rank: int) -> str:
+        separator_rank, rank = divmod(rank, values_count)
+        parts = []
+        for _ in range(times):
+            rank, digit = divmod(rank, value_count)
+            parts.append(unrank_value(digit))
+        parts.reverse()
+        return unrank_separator(separator_rank).join(parts)
+    return separator_count * values_count, unrank
+
+def rank_loop(node: Dict[str, Any], pointer: Any) -> Ranker:
+    return join_ranker(compile_ranker(node.get('value'), pointer_join(pointer, 'value')),
+                       loop_times(node, pointer),
+                       compile_ranker(node.get('separator'), pointer_join(pointer, 'separator')), pointer)
+
+def rank_module(node: Dict[str, Any], pointer: Any) -> Ranker:
+    rankers = []
+    for i, (item, item_pointer) in enumerate(module_parts(node, pointer)):
+        if i:
+            rankers.append(constant_ranker('\n'))
+        rankers.append(compile_ranker(item, item_pointer))
+    return product_ranker(rankers, pointer)
+
+NODE_RANKERS: Dict[str, Callable[[Dict[str, Any], Any], Ranker]] = {
+    NODE_TYPES['TEXT']: lambda node, pointer: constant_ranker(str(node.get('text', ''))),
+    NODE_TYPES['SEQUENCE']: lambda node, pointer: product_ranker(
+        [compile_ranker(item, item_pointer) for item, item_pointer in item_pointers(node.get('items', []), pointer)],
+        pointer),
+    NODE_TYPES['OPTION']: lambda node, pointer: choice_ranker(
+        [compile_ranker(item, item_pointer) for item, item_pointer in option_branches(node, pointer)]),
+    NODE_TYPES['ROULETTE']: lambda node, pointer: choice_ranker(
+        [compile_ranker(item, item_pointer) for item, item_pointer in roulette_branches(node, pointer)]),
+    NODE_TYPES['REPETITION']: rank_loop,
+    NODE_TYPES['DELEGATE']: rank_loop,
+    NODE_TYPES['LAYER']: lambda node, pointer: choice_ranker(
+        [compile_ranker(item, item_pointer) for item, item_pointer in option_branches(node, pointer)]),
+    NODE_TYPES['MODULE']: rank_module,
+    NODE_TYPES['IMPORT']: lambda node, pointer: compile_ranker(imported_root(node, pointer), pointer),
+    NODE_TYPES['REF']: context_dependent('Ref reads the context'),
+    NODE_TYPES['EXPRESSION']: context_dependent('expression depends on the context'),
+    NODE_TYPES['EXPR']: context_dependent('expression depends on the context'),
+    NODE_TYPES['CALL']: context_dependent('function call'),
+    NODE_TYPES['VEC']: context_dependent('Vec output is not enumerated'),
+}
+
+def compile_ranker(node: Any, pointer: Any) -> Ranker:
+    """(count, unrank) of the combinations of choices under a node."""
+    if node is None:
+        return constant_ranker('')
+    if isinstance(node, (str, int, float, bool)):
+        return constant_ranker(str(node))
+    if isinstance(node, list):
+        return product_ranker([compile_ranker(item, pointer_join(pointer, i)) for i, item in enumerate(node)],
+                              pointer)
+    if not is_object(node):
+        return constant_ranker(str(node))
+    ranker = NODE_RANKERS.get(normalize_node_type(node.get('type', '')))
+    if ranker is None:
+        # Set, Effect, declarations and unknown types produce no text
+        return constant_ranker('')
+    try:
+        return ranker(node, pointer)
+    except EnumerationError:
+        raise
+    except (AttributeError, KeyError, TypeError, ValueError, OverflowError) as e:
+        raise EnumerationError(pointer, f'malformed node ({e})')
+
+def distinct_ranks(rng: random.Random, total: int) -> Iterator[int]:
+    """Every rank below total once, in random order (a Fisher-Yates shuffle storing only the swaps)."""
+    swapped = {}
+    for i in range(total):
+        j = rng.randrange(i, total)
+        yield swapped.pop(j, j) if j == i else swapped.get(j, j)
+        if j != i:
+            swapped[j] = swapped.pop(i, i)
+
+def sample_unique(schema: Any, n: int, seed: Optional[int] = None,
+                  max_attempts: Optional[int] = None) -> List[str]:
+    """
+    Draw n distinct texts from a GenSON schema.
+    
+    Schemas that enumerate_outputs() accepts are sampled by unranking: every
+    combination of choices is equally likely (Roulette weights only decide
+    which items can be chosen). Each combination is drawn at most once, so
+    the cost grows linearly with n when combinations produce different
+    texts; combinations repeating a text (e.g. equal Option items) cost
+    extra draws. Other schemas are sampled with evaluate_many(), skipping
+    repeated texts.
+    
+    Args:
+        schema: GenSON schema (AST) or CompiledSchema
+        n: Number of texts
+        seed: Optional random seed
+        max_attempts: Repeated texts drawn before giving up
+                      (default: 100 * n + 1000)
+    
+    Returns:
+        List of n distinct texts, in random order
+    
+    Raises:
+        ValueError: If the schema cannot produce n distinct texts, or they
+            were not found before max_attempts repeated texts
+    """
+    if n <= 0:
+        return []
+    tree = schema.resolved if isinstance(schema, CompiledSchema) else optimize(schema)[0]
+    try:
+        total, unrank = compile_ranker(tree, ())
+    except EnumerationError:
+        return sample_unique_rejection(schema, n, seed, max_attempts)
+    if total < n:
+        raise ValueError(f'the schema produces at most {total} distinct texts, {n} requested')
+    if max_attempts is None:
+        max_attempts = 100 * n + 1000
+    samples = []
+    seen = set()
+    repeats = 0
+    for rank in distinct_ranks(random.Random(seed), total):
+        text = unrank(rank)
+        if text not in seen:
+            seen.add(text)
+            samples.append(text)
+            if len(samples) == n:
+                return samples
+        else:
+            repeats += 1
+            if repeats >= max_attempts:
+                raise ValueError(f'found only {len(samples)} distinct texts before {repeats} repeated ones, '
+                                 f'{n} requested')
+    raise ValueError(f'the schema produces only {len(samples)} distinct texts, {n} requested')
+
+def sample_unique_rejection(schema: Any, n: int, seed: Optional[int],
+                            max_attempts: Optional[int]) -> List[str]:
+    schema = compiled_schema(schema)
+    if max_attempts is None:
+        max_attempts = 100 * n + 1000
+    samples = []
+    seen = set()
+    for text in schema.evaluate_many(max_attempts, seed):
+        if text not in seen:
+            seen.add(text)
+            samples.append(text)
+            if len(samples) == n:
+                break
+    if len(samples) < n:
+        raise ValueError(f'found only {len(samples)} distinct texts in {max_attempts} samples, {n} requested')
+    return samples
+
+# ============================================================================
+# Batch Evaluation
+# ============================================================================
+#
+# evaluate_batch() evaluates a schema for many samples at once with NumPy.
+# Every Option, Roulette and Layer draws the choices of all the samples that
+# reach it in one call, groups the samples by the branch they took and
+# evaluates each branch once for its whole group. A text shared by every
+# sample of a group stays a single string; texts that differ are kept in
+# object arrays, which concatenate element-wise in C. Nodes that read the
+# context (Refs, expressions, calls, computed weights, Layers with hooks,
+# Delegates over such nodes) are rendered sample by sample by their compiled
+# nodes, in the context the enclosing Layers set up. Set and Effect nodes
+# write to the context, so the Layer or Delegate owning the scope they write
+# to is rendered sample by sample as a whole (at the root, the schema is
+# evaluated by evaluate_many()). So is a Layer whose props hold such nodes:
+# Refs reach them from anywhere below it.
+
+# Batch: a text shared by every sample, or a function of the sample count
+# returning one text or an object array of texts
+Batch = Union[str, Callable[[int], Any]]
+
+# Values a Repetition or Delegate evaluates at once
+BATCH_LOOP_VALUES = 1 << 20
+
+class BatchEnv:
+    """NumPy, the generators of one evaluate_batch() call and the context at a node."""
+    __slots__ = ('numpy', 'rng', 'ctx')
+
+    def __init__(self, numpy: Any, rng: Any, ctx: Ctx):
+        self.numpy = numpy
+        self.rng = rng
+        self.ctx = ctx
+
+    def inside(self, ctx: Ctx) -> 'BatchEnv':
+        return BatchEnv(self.numpy, self.rng, ctx)
+
+class ContextWrite(Exception):
+    """Raised by compile_batch() for Set and Effect nodes, caught by the owner of their scope."""
+
+def run_batch(batch: Batch, count: int) -> Any:
+    return batch if isinstance(batch, str) else batch(count)
+
+def object_array(numpy: Any, texts: List[str]) -> Any:
+    array = numpy.empty(len(texts), dtype=object)
+    array[:] = texts
+    return array
+
+def batch_unit(node: Any, env: BatchEnv) -> Tuple[Batch, bool]:
+    """Render a node sample by sample in the context at its position."""
+    compiled = compile_node(node)
+    numpy, ctx = env.numpy, env.ctx
+    def evaluate(count: int) -> Any:
+        return object_array(numpy, [compiled.render(ctx, 0) for _ in range(count)])
+    return evaluate, False
+
+def batch_concat(batches: List[Batch]) -> Batch:
+    """Element-wise concatenation, with adjacent shared texts merged."""
+    parts = []
+    for batch in batches:
+        if isinstance(batch, str) and parts and isinstance(parts[-1], str):
+            parts[-1] += batch
+        elif batch != '':
+            parts.append(batch)
+    if not parts:
+        return ''
+    if len(parts) == 1:
+        return parts[0]
+    def evaluate(count: int) -> Any:
+        result = run_batch(parts[0], count)
+        for part in parts[1:]:
+            result = result + run_batch(part, count)
+        return result
+    return evaluate
+
+def batch_choice(branches: List[Batch], pick: Callable[[int], Any], env: BatchEnv) -> Batch:
+    """Evaluate the branch pick() draws for each sample, every branch once per batch."""
+    if not branches:
+        return ''
+    if len(branches) == 1:
+        return branches[0]
+    numpy = env.numpy
+    if all(isinstance(branch, str) for branch in branches):
+        texts = object_array(numpy, branches)
+        return lambda count: texts[pick(count)]
+    def evaluate(count: int) -> Any:
+        choices = pick(count)
+        order = numpy.argsort(choices, kind='stable')
+        ends = numpy.cumsum(numpy.bincount(choices, minlength=len(branches))).tolist()
+        result = numpy.empty(count, dtype=object)
+        start = 0
+        for branch, end in zip(branches, ends):
+            if end > start:
+                result[order[start:end]] = run_batch(branch, end - start)
+            start = end
+        return result
+    return evaluate
+
+def uniform_pick(env: BatchEnv, count: int) -> Callable[[int], Any]:
+    rng = env.rng
+    return lambda samples: rng.integers(0, count, size=samples)
+
+def batch_loop(value: Batch, times: int, separator: Batch, env: BatchEnv) -> Batch:
+    """separator.join() over `times` independent values, one separator per sample."""
+    if times <= 0:
+        return ''
+    if times == 1:
+        return value
+    if isinstance(value, str) and isinstance(separator, str):
+        return separator.join([value] * times)
+    numpy = env.numpy
+    step = max(BATCH_LOOP_VALUES // times, 1)
+    def join(count: int) -> List[str]:
+        values = run_batch(value, count * times)
+        separators = run_batch(separator, count)
+        if isinstance(values, str):
+            rows = [[values] * times] * count
+        else:
+            rows = values.reshape(count, times).tolist()
+        if isinstance(separators, str):
+            return [separators.join(row) for row in rows]
+        return [sep.join(row) for sep, row in zip(separators.tolist(), rows)]
+    def evaluate(count: int) -> Any:
+        texts = []
+        for start in range(0, count, step):
+            texts.extend(join(min(step, count - start)))
+        return object_array(numpy, texts)
+    return evaluate
+
+def batch_option(node: Dict[str, Any], env: BatchEnv) -> Tuple[Batch, bool]:
+    items = node.get('items', [])
+    if not isinstance(items, list):
+        return batch_unit(node, env)
+    compiled = [compile_batch(item, env) for item in items]
+    return (batch_choice([batch for batch, _ in compiled], uniform_pick(env, len(items)), env),
+            all(pure for _, pure in compiled))
+
+def batch_roulette(node: Dict[str, Any], env: BatchEnv) -> Tuple[Batch, bool]:
+    items = node.get('items', [])
+    if not isinstance(items, list) or not all(is_object(item) for item in items):
+        return batch_unit(node, env)
+    weights = [constant_weight(item.get('weight', item.get('wt', 1))) for item in items]
+    if None in weights:
+        return batch_unit(node, env)
+    if not items:
+        return '', True
+    compiled = [compile_batch(item.get('value', item), env) for item in items]
+    branches = [batch for batch, _ in compiled]
+    pure = all(pure for _, pure in compiled)
+    if sum(weights) <= 0:
+        return branches[0], pure
+    numpy, rng = env.numpy, env.rng
+    cumulative = numpy.cumsum(numpy.array(weights, dtype=float))
+    total, last = cumulative[-1], len(items) - 1
+    def pick(count: int) -> Any:
+        # The index pick_weighted() returns for each draw
+        return numpy.minimum(numpy.searchsorted(cumulative, rng.random(count) * total, side='left'), last)
+    return batch_choice(branches, pick, env), pure
+
+def batch_repetition(node: Dict[str, Any], env: BatchEnv) -> Tuple[Batch, bool]:
+    try:
+        times = int(node.get('times', 0))
+    except (TypeError, ValueError):
+        return batch_unit(node, env)
+    value, value_pure = compile_batch(node.get('value'), env)
+    separator, separator_pure = compile_batch(node.get('separator'), env)
+    return batch_loop(value, times, separator, env), value_pure and separator_pure
+
+def batch_delegate(node: Dict[str, Any], env: BatchEnv) -> Tuple[Batch, bool]:
+    times = constant_loop_count(node.get('weight'))
+    if times is None:
+        return batch_unit(node, env)
+    # The value sees the loop index: only context-free values are evaluated in bulk
+    try:
+        value, value_pure = compile_batch(node.get('value'), env)
+        separator, separator_pure = compile_batch(node.get('separator'), env)
+    except ContextWrite:
+        return batch_unit(node, env)
+    if not (value_pure and separator_pure):
+        return batch_unit(node, env)
+    return batch_loop(value, times, separator, env), True
+
+def batch_layer(node: Dict[str, Any], env: BatchEnv) -> Tuple[Batch, bool]:
+    layer = compile_layer(node)
+    if (not isinstance(layer, LayerNode) or layer.hooks or writes_context(node.get('decl') or node.get('decls'))
+            or writes_context(node.get('prop') or node.get('props'))):
+        return batch_unit(node, env)
+    inner = env.inside(layer.scope_context(env.ctx, 0))
+    items = node.get('items', [])
+    try:
+        if isinstance(items, list):
+            compiled = [compile_batch(item, inner) for item in items]
+            return (batch_choice([batch for batch, _ in compiled], uniform_pick(env, len(items)), env),
+                    all(pure for _, pure in compiled))
+        if is_object(items):
+            return compile_batch(items, inner)
+    except ContextWrite:
+        return batch_unit(node, env)
+    return '', True
+
+def batch_module(node: Dict[str, Any], env: BatchEnv) -> Tuple[Batch, bool]:
+    batches = []
+    pure = True
+    for i, (item, _) in enumerate(module_parts(node, ())):
+        if i:
+            batches.append('\n')
+        batch, item_pure = compile_batch(item, env)
+        batches.append(batch)
+        pure = pure and item_pure
+    return batch_concat(batches), pure
+
+def batch_import(node: Dict[str, Any], env: BatchEnv) -> Tuple[Batch, bool]:
+    try:
+        root = imported_root(node, ())
+    except EnumerationError:
+        return batch_unit(node, env)
+    if root is None:
+        return '', True
+    # The imported schema sees its own names only, like ImportNode
+    try:
+        return compile_batch(root, env.inside(Ctx(rng=env.ctx.rng)))
+    except ContextWrite:
+        return batch_unit(node, env)
+
+def context_write(node: Dict[str, Any], env: BatchEnv) -> Tuple[Batch, bool]:
+    raise ContextWrite()
+
+NODE_BATCHES: Dict[str, Callable[[Dict[str, Any], BatchEnv], Tuple[Batch, bool]]] = {
+    NODE_TYPES['TEXT']: lambda node, env: (str(node.get('text', '')), True),
+    NODE_TYPES['SEQUENCE']: lambda node, env: compile_batch(node.get('items', []), env),
+    NODE_TYPES['OPTION']: batch_option,
+    NODE_TYPES['ROULETTE']: batch_roulette,
+    NODE_TYPES['REPETITION']: batch_repetition,
+    NODE_TYPES['DELEGATE']: batch_delegate,
+    NODE_TYPES['LAYER']: batch_layer,
+    NODE_TYPES['MODULE']: batch_module,
+    NODE_TYPES['IMPORT']: batch_import,
+    NODE_TYPES['REF']: batch_unit,
+    NODE_TYPES['EXPRESSION']: batch_unit,
+    NODE_TYPES['EXPR']: batch_unit,
+    NODE_TYPES['CALL']: batch_unit,
+    NODE_TYPES['VEC']: batch_unit,
+    NODE_TYPES['SET']: context_write,
+    NODE_TYPES['EFFECT']: context_write,
+}
+
+def compile_batch(node: Any, env: BatchEnv) -> Tuple[Batch, bool]:
+    """The batch of a node, and whether it is evaluated without reading the context."""
+    if node is None:
+        return '', True
+    if isinstance(node, (str, int, float, bool)):
+        return str(node), True
+    if isinstance(node, list):
+        compiled = [compile_batch(item, env) for item in node]
+        return batch_concat([batch for batch, _ in compiled]), all(pure for _, pure in compiled)
+    if not is_object(node):
+        return str(node), True
+    batch = NODE_BATCHES.get(normalize_node_type(node.get('type', '')))
+    if batch is None:
+        # Declarations and unknown types produce no text
+        return '', True
+    try:
+        return batch(node, env)
+    except (AttributeError, KeyError, TypeError, ValueError):
+        # Malformed node: keep the compiled node's behaviour (and errors)
+        return batch_unit(node, env)
+
+def evaluate_batch(schema: Any, n: int, seed: Optional[int] = None,
+                   batch_size: int = 65536) -> Iterator[str]:
+    """
+    Evaluate a GenSON schema n times, evaluating each node for many samples at once.
+    Needs NumPy. The samples follow the same distribution as evaluate_many()
+    but are drawn from NumPy's generator, so the texts for a seed differ.
+    
+    Args:
+        schema: GenSON schema (AST) or CompiledSchema
+        n: Number of samples
+        seed: Optional random seed
+        batch_size: Samples evaluated together
+    
+    Returns:
+        Iterator over the generated texts
+    
+    Raises:
+        ImportError: If NumPy is not installed
+    """
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError('evaluate_batch() needs NumPy') from None
+    schema = compiled_schema(schema)
+    rng = numpy.random.default_rng(seed)
+    # Nodes rendered sample by sample draw from a generator seeded by NumPy's
+    ctx = create_root_context(rng=random.Random(int(rng.integers(1 << 63))))
+    try:
+        batch, _ = compile_batch(schema.resolved, BatchEnv(numpy, rng, ctx))
+    except ContextWrite:
+        yield from schema.evaluate_many(n, seed)
+        return
+    for start in range(0, n, max(batch_size, 1)):
+        count = min(batch_size, n - start)
+        texts = run_batch(batch, count)
+        if isinstance(texts, str):
+            yield from repeat(texts, count)
+        else:
+            yield from texts.tolist()
+
+# ============================================================================
+# Parallel Generation
+# ============================================================================
+
+_worker_schema: Optional[CompiledSchema] = None
+
+def init_worker(schema: Any, prepared: bool = False) -> None:
+    """Process pool initializer: compile the schema (or CompiledSchema.prepared()) once per worker."""
+    global _worker_schema
+    _worker_schema = CompiledSchema.from_prepared(schema) if prepared else CompiledSchema(schema)
+
+def evaluate_chunk(start: int, stop: int, seed: int) -> List[str]:
+    """Evaluate samples start..stop-1 in a worker."""
+    return list(_worker_schema.evaluate_many(stop - start, seed, start))
+
+def generate_parallel(schema: Any, n: int, seed: Optional[int] = None,
+                      jobs: Optional[int] = None, chunk_size: int = 1000) -> Iterator[str]:
+    """
+    Evaluate a GenSON schema n times on a pool of worker processes.
+    Samples are seeded per index exactly like evaluate_many() and yielded in
+    index order, so the output does not depend on the number of workers.
+    
+    Args:
+        schema: GenSON schema (AST)
+        n: Number of samples
+        seed: Optional base seed
+        jobs: Number of worker processes (default: CPU count)
+        chunk_size: Samples per task sent to a worker
+    
+    Returns:
+        Iterator over the generated texts
+    """
+    if seed is None:
+        seed = random.SystemRandom().getrandbits(64)
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1 or n <= chunk_size:
+        yield from compiled_schema(schema).evaluate_many(n, seed)
+        return
+    # Workers skip optimize() and resolve(), whose import paths depend on the loaded file
+    initargs = (schema.prepared(), True) if isinstance(schema, CompiledSchema) else (schema,)
+
+    chunks = iter(range(0, n, chunk_size))
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker, initargs=initargs) as pool:
+        # Keep a bounded window of chunks in flight and yield them in order
+        pending = deque()
+        for start in chunks:
+            pending.append(pool.submit(evaluate_chunk, start, min(start + chunk_size, n), seed))
+            if len(pending) >= jobs * 4:
+                break
+        while pending:
+            samples = pending.popleft().result()
+            start = next(chunks, None)
+            if start is not None:
+                pending.append(pool.submit(evaluate_chunk, start, min(start + chunk_size, n), seed))
+            yield from samples
+
+# ============================================================================
+# Public API
+# ============================================================================
+
+def evaluate(schema: Any, options: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Evaluate a GenSON schema and return the generated text.
+    
+    Args:
+        schema: GenSON schema (AST) or CompiledSchema; a schema object is
+            compiled on its first evaluation and reused, see compiled_schema()
+        options: Evaluation options
+            - seed: Optional random seed
+            - rng: Optional random.Random instance or callable, see create_root_context()
+            - profile: Optional Profiler to record into, or True to write a
+              profile report to stderr
+            - engine: 'iterative' to evaluate with an explicit stack instead of
+              Python recursion, see walk_node()
+            - max_depth: Nesting limit of the iterative engine (implies it;
+              default MAX_RECURSION_DEPTH)
+    
+    Returns:
+        Generated text
+    """
+    schema = compiled_schema(schema)
+    return schema.evaluate(options)
+
+def evaluate_iter(schema: Any, options: Optional[Dict[str, Any]] = None) -> Iterator[str]:
+    """
+    Evaluate a GenSON schema, yielding the text in fragments as it is produced.
+    Memory is bounded by the depth of the tree rather than the output size;
+    the concatenated fragments equal evaluate(schema, options).
+    
+    Args:
+        schema: GenSON schema (AST) or CompiledSchema
+        options: Evaluation options, see evaluate(). The iterative engine
+            ('engine' or 'max_depth') builds the whole text first and yields
+            it as a single fragment; 'profile': True writes the report once
+            the iterator is exhausted
+    
+    Returns:
+        Iterator over non-empty text fragments
+    """
+    schema = compiled_schema(schema)
+    return schema.evaluate_iter(options)
+
+def evaluate_to(schema: Any, fileobj: Any, options: Optional[Dict[str, Any]] = None) -> int:
+    """
+    Evaluate a GenSON schema and write the text to a file-like object.
+    
+    Args:
+        schema: GenSON schema (AST) or CompiledSchema
+        fileobj: Text file-like object with a write() method
+        options: Evaluation options, see evaluate()
+    
+    Returns:
+        Number of characters written
+    """
+    schema = compiled_schema(schema)
+    return schema.evaluate_to(fileobj, options)
+
+def evaluate_many(schema: Any, n: int, seed: Optional[int] = None) -> Iterator[str]:
+    """
+    Evaluate a GenSON schema n times, compiling it only once.
+    
+    Args:
+        schema: GenSON schema (AST) or CompiledSchema
+        n: Number of samples
+        seed: Optional base seed; sample i uses derive_seed(seed, i)
+    
+    Returns:
+        Iterator over the generated texts
     """
-    seed = options.get('seed') if options else None
-    root_ctx = create_root_context(seed)
-    return evaluate_node(schema, root_ctx)
+    schema = compiled_schema(schema)
+    return schema.evaluate_many(n, seed)
 
 __all__ = [
     'Ctx',
+    'Scope',
+    'CompiledSchema',
+    'compile',
+    'load',
+    'load_module',
+    'LazyModule',
+    'ModuleRegistry',
+    'module_registry',
+    'optimize',
+    'resolve',
+    'ResolutionError',
+    'Profiler',
+    'analyze',
+    'Distribution',
+    'enumerate_outputs',
+    'EnumerationError',
+    'sample_unique',
+    'evaluate_batch',
     'evaluate',
+    'evaluate_iter',
+    'evaluate_to',
+    'evaluate_many',
+    'generate_parallel',
     'evaluate_node',
     'evaluate_expr',
     'create_root_context',
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+Long-running GenSON generation server keeping compiled schemas in memory.
+Usage:
+  python3 cli.py serve --socket /tmp/genson.sock --load names=names.json
+  python3 server.py --port 7878 --jobs 4
+
+Clients send one JSON request per line and receive one JSON response per
+line, echoing the request's "id". Requests on a connection are answered as
+they complete, so responses may arrive out of order.
+
+  {"id": 1, "op": "load", "name": "names", "path": "names.json"}
+  {"id": 1, "name": "names", "hash": "3f2a..."}
+  {"id": 2, "op": "load", "name": "greeting", "schema": {"type": "option", "items": ["Hi", "Hello"]}}
+  {"id": 3, "op": "generate", "schema": "names", "n": 3, "seed": 7}
+  {"id": 3, "hash": "3f2a...", "seed": 7, "samples": ["...", "...", "..."]}
+  {"id": 4, "op": "schemas"}
+  {"id": 4, "schemas": {"names": "3f2a...", "greeting": "91c0..."}}
+
+Failed requests are answered with {"id": ..., "error": "..."}. A schema is
+referred to by its name or its hash; generate(schema, n, seed) returns the
+same samples as evaluate_many(schema, n, seed).
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import pickle
+import random
+import signal
+import stat
+import sys
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import genson as rt
+
+# Longest request line (inline schemas included)
+MAX_LINE = 64 << 20
+
+# Samples per task sent to a worker
+CHUNK_SIZE = 1000
+
+# Compiled schemas each worker keeps
+WORKER_CACHE_SIZE = 64
+
+_worker_schemas = OrderedDict()
+
+
+class SchemaNotLoaded(Exception):
+    """Raised by a worker asked for a schema it was never sent (or has evicted)."""
+
+
+def evaluate_chunk(key, start, stop, seed, prepared=None):
+    """
+    Evaluate samples start..stop-1 of a schema in a worker. Tasks name the
+    schema by hash; the pickled prepared schema is only sent again after the
+    worker raised SchemaNotLoaded, and is compiled once per worker.
+    """
+    schema = _worker_schemas.get(key)
+    if schema is not None:
+        _worker_schemas.move_to_end(key)
+    elif prepared is None:
+        raise SchemaNotLoaded(key)
+    else:
+        schema = rt.CompiledSchema.from_prepared(pickle.loads(prepared))
+        _worker_schemas[key] = schema
+        if len(_worker_schemas) > WORKER_CACHE_SIZE:
+            _worker_schemas.popitem(last=False)
+    return list(schema.evaluate_many(stop - start, seed, start))
+
+
+def schema_hash(compiled):
+    """SHA-256 of a schema's canonical JSON and of the files it imports."""
+    digest = hashlib.sha256(compiled.source_digest().encode('ascii'))
+    for path in compiled.imports:
+        digest.update(f'\0{path}\0{rt.file_digest(path)}'.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class SchemaStore:
+    """Compiled schemas by hash, and the hash each name refers to."""
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+        self.schemas = {}  # hash -> (CompiledSchema, pickled prepared tuple)
+        self.names = {}
+
+    def load(self, name, schema=None, path=None):
+        """Compile a schema (or load a file) under a name; return its hash."""
+        if path is not None:
+            compiled = rt.load(os.path.abspath(path), cache_dir=self.cache_dir)
+        else:
+            compiled = rt.compile(schema)
+        key = schema_hash(compiled)
+        if key not in self.schemas:
+            self.schemas[key] = (compiled, pickle.dumps(compiled.prepared(), pickle.HIGHEST_PROTOCOL))
+        if name is not None:
+            self.names[name] = key
+        return key
+
+    def get(self, ref):
+        """(hash, CompiledSchema, pickled prepared tuple) of a name or hash."""
+        key = self.names.get(ref, ref)
+        if key not in self.schemas:
+            raise KeyError(f'unknown schema {ref!r}')
+        return (key,) + self.schemas[key]
+
+
+class Server:
+    """Answers JSON-lines requests, evaluating large batches on a process pool."""
+
+    def __init__(self, store, pool=None, inline_samples=8, max_count=1000000):
+        self.store = store
+        self.pool = pool
+        self.inline_samples = inline_samples
+        self.max_count = max_count
+        self.ops = {
+            'load': self.op_load,
+            'generate': self.op_generate,
+            'schemas': self.op_schemas,
+        }
+
+    async def op_load(self, request):
+        name = request.get('name')
+        if name is not None and not isinstance(name, str):
+            raise ValueError('name must be a string')
+        if 'path' in request:
+            args = (name, None, str(request['path']))
+        elif 'schema' in request:
+            args = (name, request['schema'], None)
+        else:
+            raise ValueError('load needs "path" or "schema"')
+        # Reading and compiling may take a while: keep the event loop free
+        key = await asyncio.get_running_loop().run_in_executor(None, self.store.load, *args)
+        return {'name': name, 'hash': key}
+
+    async def op_generate(self, request):
+        key, compiled, prepared = self.store.get(request.get('schema'))
+        n = request.get('n', 1)
+        if not isinstance(n, int) or not 0 <= n <= self.max_count:
+            raise ValueError(f'n must be an integer from 0 to {self.max_count}')
+        seed = request.get('seed')
+        if seed is None:
+            seed = random.SystemRandom().getrandbits(64)
+        elif not isinstance(seed, int):
+            raise ValueError('seed must be an integer')
+        loop = asyncio.get_running_loop()
+        if self.pool is None or n <= self.inline_samples:
+            # Evaluated in this process, but off the event loop like op_load
+            samples = await loop.run_in_executor(None, lambda: list(compiled.evaluate_many(n, seed)))
+        else:
+            chunks = await asyncio.gather(*[
+                self.run_chunk(key, prepared, start, min(start + CHUNK_SIZE, n), seed)
+                for start in range(0, n, CHUNK_SIZE)])
+            samples = [sample for chunk in chunks for sample in chunk]
+        return {'hash': key, 'seed': seed, 'samples': samples}
+
+    async def run_chunk(self, key, prepared, start, stop, seed):
+        """Evaluate a chunk on the pool, sending the schema only to workers that lack it."""
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self.pool, evaluate_chunk, key, start, stop, seed)
+        except SchemaNotLoaded:
+            return await loop.run_in_executor(self.pool, evaluate_chunk, key, start, stop, seed, prepared)
+
+    async def op_schemas(self, request):
+        return {'schemas': dict(self.store.names)}
+
+    async def respond(self, line, writer, write_lock):
+        request_id = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError('a request must be a JSON object')
+            request_id = request.get('id')
+            op = self.ops.get(request.get('op'))
+            if op is None:
+                raise ValueError(f'unknown op {request.get("op")!r}')
+            response = await op(request)
+        except Exception as e:
+            # Any failure (bad request, depth limit, broken pool) gets an answer
+            message = e.args[0] if isinstance(e, KeyError) and e.args else str(e) or type(e).__name__
+            response = {'error': message}
+        response = {'id': request_id, **response}
+        data = (json.dumps(response, ensure_ascii=False) + '\n').encode('utf-8')
+        async with write_lock:
+            writer.write(data)
+            await writer.drain()
+
+    async def handle_connection(self, reader, writer):
+        write_lock = asyncio.Lock()
+        tasks = set()
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # Longer than MAX_LINE: the rest of the stream cannot be framed
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                task = asyncio.ensure_future(self.respond(line, writer, write_lock))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            writer.close()
+
+
+def remove_stale_socket(path):
+    """Remove a Unix socket left by a previous server, refusing to remove other files."""
+    try:
+        mode = os.stat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise ValueError(f'{path} exists and is not a socket')
+    os.unlink(path)
+
+
+async def serve(server, socket_path=None, host='127.0.0.1', port=7878):
+    if socket_path:
+        remove_stale_socket(socket_path)
+        listener = await asyncio.start_unix_server(server.handle_connection, path=socket_path, limit=MAX_LINE)
+        address = socket_path
+    else:
+        listener = await asyncio.start_server(server.handle_connection, host, port, limit=MAX_LINE)
+        address = ', '.join(str(sock.getsockname()[:2]) for sock in listener.sockets)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+    sys.stderr.write(f'genson serving on {address}\n')
+    try:
+        async with listener:
+            await stop.wait()
+    finally:
+        if socket_path:
+            try:
+                os.unlink(socket_path)
+            except OSError:
+                pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='genson serve')
+    parser.add_argument('--socket', metavar='PATH', default=None,
+                        help='listen on this Unix socket instead of TCP')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7878)
+    parser.add_argument('-j', '--jobs', type=int, default=0,
+                        help='worker processes for batches (0: one per CPU, -1: evaluate in the server)')
+    parser.add_argument('--inline-samples', type=int, default=8,
+                        help='batches up to this size are evaluated in the server process')
+    parser.add_argument('--max-count', type=int, default=1000000,
+                        help='largest n a generate request may ask for')
+    parser.add_argument('--load', metavar='NAME=PATH', action='append', default=[],
+                        help='load a schema file at startup (repeatable)')
+    parser.add_argument('--cache-dir', metavar='DIR', default=None,
+                        help='reuse prepared schema files from this directory, see genson.load()')
+    args = parser.parse_args(argv)
+
+    store = SchemaStore(args.cache_dir)
+    for spec in args.load:
+        name, sep, path = spec.partition('=')
+        if not sep:
+            parser.error(f'--load expects NAME=PATH, got {spec!r}')
+        store.load(name, path=path)
+
+    pool = None
+    if args.jobs >= 0:
+        pool = ProcessPoolExecutor(max_workers=args.jobs or os.cpu_count() or 1)
+    try:
+        asyncio.run(serve(Server(store, pool, args.inline_samples, args.max_count),
+                          args.socket, args.host, args.port))
+    except ValueError as e:
+        parser.error(str(e))
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+from fractions import Fraction as F
+
+import pytest
+
+import genson as rt
+
+
+def option(*items):
+    return {'type': 'option', 'items': list(items)}
+
+
+EXACT = {
+    'option': (option('a', 'b', option('a', 'c')), {'a': F(1, 2), 'b': F(1, 3), 'c': F(1, 6)}),
+    'roulette': ({'type': 'roulette', 'items': [{'weight': 1, 'value': 'a'}, {'weight': '3', 'value': 'b'},
+                                                {'wt': 4, 'value': 'c'}]},
+                 {'a': F(1, 8), 'b': F(3, 8), 'c': F(1, 2)}),
+    'repetition': ({'type': 'repetition', 'times': 2, 'value': option('x', 'y'), 'separator': option(',', ';')},
+                   {a + s + b: F(1, 8) for a in 'xy' for s in ',;' for b in 'xy'}),
+    'repetition_merged': ({'type': 'repetition', 'times': 2, 'value': option('a', 'aa')},
+                          {'aa': F(1, 4), 'aaa': F(1, 2), 'aaaa': F(1, 4)}),
+    'layer': ({'type': 'layer', 'items': ['p', option('q', 'r')]}, {'p': F(1, 2), 'q': F(1, 4), 'r': F(1, 4)}),
+    'delegate': ({'type': 'delegate', 'weight': 2, 'value': option('a', 'b'), 'separator': '-'},
+                 {a + '-' + b: F(1, 4) for a in 'ab' for b in 'ab'}),
+}
+
+
+@pytest.mark.parametrize('name', sorted(EXACT))
+def test_exact_probabilities(name):
+    schema, expected = EXACT[name]
+    distribution = rt.analyze(schema)
+    assert distribution.exact and not distribution.issues
+    assert distribution.outputs == expected
+    assert distribution.count == len(expected)
+    assert {rt.evaluate(schema, {'seed': seed}) for seed in range(300)} == set(expected)
+
+
+def test_top_level_branches():
+    distribution = rt.analyze(EXACT['layer'][0])
+    assert [(pointer, p, branch.outputs) for pointer, p, branch in distribution.choices] == [
+        ('/items/0', F(1, 2), {'p': F(1)}),
+        ('/items/1', F(1, 2), {'q': F(1, 2), 'r': F(1, 2)}),
+    ]
+    assert rt.analyze(rt.compile(EXACT['layer'][0])).outputs == EXACT['layer'][1]
+
+
+def test_bounds_beyond_the_limit():
+    schema = {'type': 'repetition', 'times': 3, 'value': option(*'abcdefghij')}
+    assert rt.analyze(schema).count == 1000
+    distribution = rt.analyze(schema, limit=100)
+    assert distribution.outputs is None and distribution.exact
+    assert (distribution.min_count, distribution.max_count) == (10, 1000)
+
+
+def test_delegate_with_computed_weight():
+    schema = {'type': 'layer', 'props': {'n': 2},
+              'items': {'type': 'delegate', 'weight': {'op': 'get', 'path': 'n'}, 'value': option('a', 'b')}}
+    distribution = rt.analyze(schema)
+    assert distribution.outputs is None and not distribution.exact
+    assert (distribution.min_count, distribution.max_count) == (1, None)
+    assert distribution.issues == [('/items', 'Delegate weight is evaluated on each iteration')]
+
+
+def test_roulette_with_context_dependent_weights():
+    schema = {'type': 'layer', 'props': {'w': 2}, 'items': {'type': 'roulette', 'items': [
+        {'weight': {'op': 'get', 'path': 'w'}, 'value': option('a', 'b')}, {'weight': 1, 'value': 'c'}]}}
+    distribution = rt.analyze(schema)
+    assert distribution.outputs is None and not distribution.exact
+    assert (distribution.min_count, distribution.max_count) == (1, 3)
+    assert distribution.issues == [('/items', 'Roulette weights depend on the context')]
+    assert [p for _, p, _ in distribution.choices] == [None, None]
+    report = distribution.report()
+    assert 'exact: no' in report and 'distinct outputs: 1..3' in report
+    assert '  /items: Roulette weights depend on the context' in report
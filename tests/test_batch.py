@@ -0,0 +1,32 @@
+import pytest
+
+import genson as rt
+from test_compile import SCHEMAS
+
+pytest.importorskip('numpy')
+
+STEP = {'type': 'effect', 'items': [{
+    'type': 'set', 'path': 'o.m', 'value': {'op': '+', 'left': {'op': 'get', 'path': 'o.m'}, 'right': 1}}]}
+
+# A Ref below the Layer runs an Effect prop writing the Layer's own state
+WRITE_THROUGH_REF = {
+    'type': 'layer',
+    'props': {'o': {'value': {'m': 0}}, 'step': {'value': STEP}},
+    'items': [{'type': 'layer', 'props': {'z': 1}, 'items': [[
+        {'type': 'option', 'items': ['a', 'b']},
+        {'type': 'ref', 'to': 'step'},
+        {'type': 'expr', 'value': {'op': 'get', 'path': 'o.m'}},
+    ]]}],
+}
+
+
+def test_writes_through_refs_stay_per_sample():
+    assert set(rt.evaluate_batch(WRITE_THROUGH_REF, 50, seed=1)) == {'a1.0', 'b1.0'}
+
+
+@pytest.mark.parametrize('name', sorted(SCHEMAS))
+def test_batch_outputs_are_possible_outputs(name):
+    schema = SCHEMAS[name]
+    batch = list(rt.evaluate_batch(schema, 100, seed=2))
+    assert len(batch) == 100
+    assert set(batch) <= set(rt.evaluate_many(schema, 2000, 2))
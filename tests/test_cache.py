@@ -0,0 +1,69 @@
+import json
+import os
+
+import genson as rt
+
+SCHEMA = {'type': 'layer', 'props': {'who': 'world'},
+          'items': [['Hello ', {'type': 'ref', 'to': 'who'}, {'type': 'option', 'items': ['!', '?']}]]}
+
+
+def entries(cache_dir):
+    return sorted(os.listdir(cache_dir)) if os.path.isdir(cache_dir) else []
+
+
+def test_miss_then_hit(tmp_path):
+    path = tmp_path / 'hello.json'
+    path.write_text(json.dumps(SCHEMA))
+    cache_dir = str(tmp_path / 'cache')
+    first = rt.load(str(path), cache_dir)
+    assert first.schema == SCHEMA
+    assert len(entries(cache_dir)) == 1
+    second = rt.load(str(path), cache_dir)
+    # Rebuilt from the entry: only the resolved tree was stored
+    assert second.schema is None
+    assert len(entries(cache_dir)) == 1
+    assert second.source_digest() == first.source_digest()
+    assert list(second.evaluate_many(10, 5)) == list(first.evaluate_many(10, 5))
+
+
+def test_prepared_keeps_one_tree():
+    compiled = rt.compile(SCHEMA)
+    prepared = compiled.prepared()
+    assert sum(value is compiled.resolved for value in prepared) == 1
+    assert not any(value is compiled.schema or value == SCHEMA for value in prepared)
+
+
+def test_changed_file_is_a_miss(tmp_path):
+    path = tmp_path / 'hello.json'
+    cache_dir = str(tmp_path / 'cache')
+    path.write_text(json.dumps(SCHEMA))
+    rt.load(str(path), cache_dir)
+    path.write_text(json.dumps({**SCHEMA, 'props': {'who': 'there'}}))
+    assert rt.load(str(path), cache_dir).evaluate({'seed': 1}).startswith('Hello there')
+    assert len(entries(cache_dir)) == 2
+
+
+def test_changed_import_invalidates(tmp_path):
+    part = tmp_path / 'part.json'
+    main = tmp_path / 'main.json'
+    cache_dir = str(tmp_path / 'cache')
+    part.write_text(json.dumps('one'))
+    main.write_text(json.dumps(['<', {'type': 'import', 'path': 'part.json'}, '>']))
+    assert rt.load(str(main), cache_dir).evaluate() == '<one>'
+    part.write_text(json.dumps('two'))
+    rt.module_registry.invalidate()
+    compiled = rt.load(str(main), cache_dir)
+    assert compiled.schema is not None
+    assert compiled.evaluate() == '<two>'
+
+
+def test_unreadable_entry_is_rebuilt(tmp_path):
+    path = tmp_path / 'hello.json'
+    path.write_text(json.dumps(SCHEMA))
+    cache_dir = str(tmp_path / 'cache')
+    rt.load(str(path), cache_dir)
+    entry = os.path.join(cache_dir, entries(cache_dir)[0])
+    with open(entry, 'wb') as f:
+        f.write(b'\x80\x05truncated')
+    assert rt.load(str(path), cache_dir).schema == SCHEMA
+    assert rt.load(str(path), cache_dir).schema is None
@@ -0,0 +1,72 @@
+import json
+import os
+
+import pytest
+
+import genson as rt
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def layer(**fields):
+    return {'type': 'layer', **fields}
+
+
+def get(path):
+    return {'type': 'expr', 'value': {'op': 'get', 'path': path}}
+
+
+def plus_one(path):
+    return {'op': '+', 'left': {'op': 'get', 'path': path}, 'right': 1}
+
+
+# The engines are compared with the interpreter (evaluate_node), which they
+# must reproduce draw for draw
+SCHEMAS = {
+    'roulette': {'type': 'roulette', 'items': [{'weight': 1, 'value': 'a'}, {'weight': '3', 'value': 'b'},
+                                               {'wt': 5, 'value': {'type': 'option', 'items': ['c', 'd']}}]},
+    'repetition': {'type': 'repetition', 'times': 4, 'value': {'type': 'option', 'items': ['x', 'y']},
+                   'separator': {'type': 'option', 'items': [';', ',']}},
+    'delegate': layer(props={'n': 3}, items={'type': 'delegate', 'weight': {'op': 'get', 'path': 'n'},
+                                             'value': [get('i'), {'type': 'option', 'items': ['a', 'b']}],
+                                             'separator': ' '}),
+    'delegate_index_weight': {'type': 'delegate', 'index': 'k', 'value': get('k'),
+                              'weight': {'op': '?:', 'cond': {'op': '<', 'left': {'op': 'get', 'path': 'k'}, 'right': 4},
+                                         'then': 10, 'else': 0}},
+    'countdown': layer(props={'n': 4, 'step': {'value': {'type': 'effect', 'items': [
+                           {'type': 'set', 'path': 'parent.n', 'value': {'op': '-', 'left': {'op': 'get', 'path': 'n'}, 'right': 1}}]}}},
+                       items={'type': 'delegate', 'weight': {'op': 'get', 'path': 'n'}, 'separator': ',',
+                              'value': ['x', get('n'), {'type': 'ref', 'to': 'step'}]}),
+    'nested_prop_write': layer(props={'obj': {'value': {'m': 0}}},
+                               before=[{'type': 'set', 'path': 'obj.m', 'value': {'type': 'expr', 'value': plus_one('obj.m')}}],
+                               items=[[get('obj.m'), {'type': 'option', 'items': ['a', 'b']}]]),
+    'effects': layer(props={'c': 0}, items=[[
+        {'type': 'effect', 'items': [{'type': 'set', 'path': 'c', 'value': plus_one('c')},
+                                     {'type': 'effect', 'items': [{'type': 'set', 'path': 'parent.z', 'value': 5}]}]},
+        {'type': 'set', 'path': 'parent.w', 'value': 3}, 'c=', {'type': 'ref', 'to': 'c'}, {'type': 'ref', 'to': 'parent.w'}]]),
+    'match': layer(props={'v': 15}, decls=[
+        {'type': 'domain', 'name': 'd', 'branch': [{'range': [[1, 10], 20], 'string': 'low'},
+                                                    {'range': [[11, 30]], 'string': 'mid'}]},
+        {'type': 'match', 'name': 'm', 'branch': [
+            {'req': [{'domain': 'd', 'expr': {'op': '>', 'left': {'op': 'get', 'path': '_arg'}, 'right': 12}}],
+             'to': {'type': 'option', 'items': ['big', 'BIG']}},
+            {'req': [{'domain': 'd'}], 'to': 'in-d'},
+            {'req': [], 'to': 'other'}]}],
+        items=[[{'type': 'expr', 'value': {'op': '|', 'left': {'op': 'get', 'path': 'v'}, 'right': ['m']}}, '/',
+                {'type': 'expr', 'value': {'op': 'match', 'left': 5, 'right': 'm'}}, '/',
+                {'type': 'expr', 'value': {'op': 'match_mut', 'left': 99, 'right': 'm'}}]]),
+    'module': {'type': 'module', 'default': '$1', 'items': ['first', {'type': 'option', 'items': ['p', 'q']}]},
+    'calls': [{'type': 'call', 'path': 'rand_int', 'args': [1, 10]}, ' ',
+              {'type': 'vec', 'items': ['a', {'type': 'option', 'items': ['b', 'c']}]}],
+}
+
+with open(os.path.join(ROOT, 'example.json'), encoding='utf-8') as f:
+    SCHEMAS['example'] = json.load(f)
+
+
+@pytest.mark.parametrize('name', sorted(SCHEMAS))
+def test_compiled_matches_interpreter(name):
+    schema = SCHEMAS[name]
+    compiled = rt.compile(schema)
+    for seed in range(8):
+        assert compiled.evaluate({'seed': seed}) == rt.evaluate_node(schema, rt.create_root_context(seed))
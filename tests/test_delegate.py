@@ -0,0 +1,53 @@
+import pytest
+
+import genson as rt
+from test_compile import SCHEMAS
+
+
+def countdown(body):
+    """A Layer looping while n > iteration, the body lowering n through a Ref to an Effect prop."""
+    step = {'type': 'effect', 'items': [{
+        'type': 'set',
+        'path': 'parent.n',
+        'value': {'type': 'expr', 'value': {'op': '-', 'left': {'op': 'get', 'path': 'n'}, 'right': 1}},
+    }]}
+    return {
+        'type': 'layer',
+        'props': {'n': 4, 'step': {'value': step}},
+        'items': {'type': 'delegate', 'weight': {'op': 'get', 'path': 'n'}, 'separator': ',', 'value': body},
+    }
+
+
+N = {'type': 'expr', 'value': {'op': 'get', 'path': 'n'}}
+
+
+def test_weight_reevaluated_after_write_through_ref():
+    schema = countdown(['x', N, {'type': 'ref', 'to': 'step'}])
+    assert not rt.delegate_weight_invariant(schema['items'])
+    assert rt.evaluate(schema, {'seed': 1}) == 'x4,x3.0'
+    assert rt.evaluate(schema, {'seed': 1, 'engine': 'iterative'}) == 'x4,x3.0'
+
+
+def test_weight_reevaluated_after_direct_write():
+    schema = countdown(['x', N, {'type': 'set', 'path': 'parent.n', 'value': 1}])
+    assert not rt.delegate_weight_invariant(schema['items'])
+
+
+def test_constant_and_read_only_weights_are_invariant():
+    assert rt.delegate_weight_invariant({'type': 'delegate', 'weight': 3, 'value': {'type': 'ref', 'to': 'step'}})
+    schema = countdown(['x', N])
+    assert rt.delegate_weight_invariant(schema['items'])
+    assert rt.evaluate(schema, {'seed': 1}) == 'x4,x4,x4,x4'
+
+
+@pytest.mark.parametrize('name', sorted(SCHEMAS))
+def test_hoisted_delegate_weights_match_reevaluated(name, monkeypatch):
+    schema = SCHEMAS[name]
+    expected = [rt.compile(schema).evaluate({'seed': seed}) for seed in range(8)]
+    # Re-evaluate every weight on every iteration, as before hoisting; compile()
+    # builds a new CompiledSchema, where evaluate() would reuse the one above
+    monkeypatch.setattr(rt, 'delegate_weight_invariant', lambda node: False)
+    monkeypatch.setattr(rt, 'delegate_invariants', {})
+    compiled = rt.compile(schema)
+    assert [compiled.evaluate({'seed': seed}) for seed in range(8)] == expected
+    assert [rt.evaluate_node(schema, rt.create_root_context(seed)) for seed in range(8)] == expected
@@ -0,0 +1,28 @@
+import pytest
+
+import genson as rt
+
+# 'ab' is produced by two combinations of choices
+OVERLAP = [{'type': 'option', 'items': ['a', 'ab']}, {'type': 'option', 'items': ['b', '']}]
+
+
+def test_every_combination_by_default():
+    assert list(rt.enumerate_outputs(OVERLAP)) == ['ab', 'a', 'abb', 'ab']
+
+
+def test_distinct():
+    assert list(rt.enumerate_outputs(OVERLAP, distinct=True)) == ['ab', 'a', 'abb']
+    assert list(rt.enumerate_outputs(OVERLAP, limit=2, distinct=True)) == ['ab', 'a']
+
+
+def test_outputs_match_evaluation():
+    schema = [{'type': 'roulette', 'items': [{'weight': 1, 'value': 'x'}, {'weight': 2, 'value': 'y'}]},
+              {'type': 'repetition', 'times': 2, 'value': {'type': 'option', 'items': ['0', '1']}, 'separator': '-'}]
+    outputs = list(rt.enumerate_outputs(schema))
+    assert len(outputs) == 8
+    assert {rt.evaluate(schema, {'seed': seed}) for seed in range(200)} == set(outputs)
+
+
+def test_context_dependent_schema_rejected():
+    with pytest.raises(rt.EnumerationError):
+        rt.enumerate_outputs({'type': 'ref', 'to': 'x'})
@@ -0,0 +1,42 @@
+import pytest
+
+import genson as rt
+from test_compile import SCHEMAS
+
+
+def nested(depth):
+    """Options nested depth levels deep, each level adding a random letter."""
+    node = {'type': 'option', 'items': ['a', 'b']}
+    for _ in range(depth):
+        node = {'type': 'option', 'items': [[node, {'type': 'option', 'items': ['x', 'y']}]]}
+    return node
+
+
+def test_fragments_equal_evaluate():
+    schema = rt.compile(nested(30))
+    for seed in range(10):
+        options = {'seed': seed}
+        assert ''.join(schema.evaluate_iter(options)) == schema.evaluate(options)
+
+
+@pytest.mark.parametrize('name', sorted(SCHEMAS))
+def test_stream_matches_interpreter(name):
+    schema = SCHEMAS[name]
+    compiled = rt.compile(schema)
+    for seed in range(8):
+        expected = rt.evaluate_node(schema, rt.create_root_context(seed))
+        assert ''.join(compiled.evaluate_iter({'seed': seed})) == expected
+
+
+def test_iterative_engine_options():
+    # Deeper than MAX_RECURSION_DEPTH, which the streaming engine keeps to
+    schema = rt.compile(nested(rt.MAX_RECURSION_DEPTH + 50))
+    for options in ({'seed': 1, 'max_depth': 500}, {'seed': 2, 'engine': 'iterative', 'max_depth': 500}):
+        assert ''.join(rt.evaluate_iter(schema, options)) == rt.evaluate(schema, options)
+
+
+def test_profile_report(capsys):
+    schema = nested(5)
+    text = ''.join(rt.evaluate_iter(schema, {'seed': 3, 'profile': True}))
+    assert text == rt.evaluate(schema, {'seed': 3})
+    assert capsys.readouterr().err
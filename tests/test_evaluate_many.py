@@ -0,0 +1,11 @@
+import pytest
+
+import genson as rt
+from test_compile import SCHEMAS
+
+
+@pytest.mark.parametrize('name', sorted(SCHEMAS))
+def test_evaluate_many_matches_interpreter(name):
+    schema = SCHEMAS[name]
+    expected = [rt.evaluate_node(schema, rt.create_root_context(rt.derive_seed(9, i))) for i in range(6)]
+    assert list(rt.evaluate_many(schema, 6, 9)) == expected
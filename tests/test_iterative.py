@@ -0,0 +1,44 @@
+import pytest
+
+import genson as rt
+from test_compile import SCHEMAS
+
+DEPTH = 5000
+
+
+def nest(kind, depth=DEPTH):
+    node = {'type': 'ref', 'to': 'v', 'else': 'x'}
+    for i in range(depth):
+        if kind == 'seq':
+            node = {'type': 'seq', 'items': [node, '.']}
+        elif kind == 'option':
+            node = {'type': 'option', 'items': [node]}
+        elif kind == 'roulette':
+            node = {'type': 'roulette', 'items': [{'weight': 1, 'value': node}]}
+        elif kind == 'layer':
+            node = {'type': 'layer', 'props': {'v': i}, 'items': node}
+        elif kind == 'delegate':
+            node = {'type': 'delegate', 'weight': 1, 'value': node}
+        elif kind == 'ref':
+            node = {'type': 'ref', 'to': 'missing.x', 'else': node}
+    return node
+
+
+@pytest.mark.parametrize('name', sorted(SCHEMAS))
+def test_iterative_matches_interpreter(name):
+    schema = SCHEMAS[name]
+    compiled = rt.compile(schema)
+    for seed in range(8):
+        expected = rt.evaluate_node(schema, rt.create_root_context(seed))
+        assert compiled.evaluate({'seed': seed, 'engine': 'iterative'}) == expected
+
+
+@pytest.mark.parametrize('kind', ['seq', 'option', 'roulette', 'layer', 'delegate', 'ref'])
+def test_deep_schema(kind):
+    schema = nest(kind)
+    expected = 'x' + '.' * DEPTH if kind == 'seq' else '0' if kind == 'layer' else 'x'
+    assert rt.evaluate(schema, {'max_depth': 3 * DEPTH}) == expected
+    unoptimized = rt.compile(schema, optimize_schema=False, resolve_names=False)
+    assert unoptimized.evaluate({'max_depth': 3 * DEPTH}) == expected
+    with pytest.raises(RuntimeError, match='Maximum recursion depth'):
+        unoptimized.evaluate({'max_depth': DEPTH // 2})
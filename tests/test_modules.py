@@ -0,0 +1,41 @@
+import json
+
+import genson as rt
+
+MODULE = {
+    'type': 'module',
+    'default': '$1',
+    'items': ['first', [{'type': 'option', 'items': ['b', 'c']}, '-', {'type': 'ref', 'to': 'who', 'else': 'x'}], 'third'],
+    'refs': {'greet': {'type': 'option', 'items': ['hi', 'hey']}},
+}
+
+
+def write(tmp_path, name, schema):
+    path = tmp_path / name
+    path.write_text(json.dumps(schema, indent=1))
+    return str(path)
+
+
+def test_lazy_default_matches_load(tmp_path):
+    path = write(tmp_path, 'module.json', MODULE)
+    with rt.load_module(path) as module:
+        lazy = module.compile()
+        # Only the default entry was parsed
+        assert list(module.items) == [1]
+        assert module.refs == {}
+        assert list(lazy.evaluate_many(20, 2)) == list(rt.load(path).evaluate_many(20, 2))
+
+
+def test_lazy_entries(tmp_path):
+    path = write(tmp_path, 'module.json', MODULE)
+    with rt.load_module(path) as module:
+        assert module.compile('$2').evaluate() == 'third'
+        assert {module.compile('greet').evaluate({'seed': seed}) for seed in range(20)} == {'hi', 'hey'}
+        assert sorted(module.items) == [2]
+
+
+def test_not_a_module(tmp_path):
+    path = write(tmp_path, 'plain.json', ['a', {'type': 'option', 'items': ['b', 'c']}])
+    with rt.load_module(path) as module:
+        assert list(module.compile().evaluate_many(5, 1)) == list(rt.load(path).evaluate_many(5, 1))
+
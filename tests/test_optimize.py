@@ -0,0 +1,28 @@
+import genson as rt
+
+
+def test_literal_repetition_folded():
+    optimized, _ = rt.optimize({'type': 'repetition', 'times': 3, 'value': 'ab', 'separator': '-'})
+    assert optimized == 'ab-ab-ab'
+
+
+def test_long_repetition_left_to_evaluation():
+    times = rt.FOLD_REPETITION_LIMIT
+    schema = {'type': 'option', 'items': [{'type': 'repetition', 'times': times, 'value': 'abcd'}, 'x']}
+    optimized, _ = rt.optimize(schema)
+    assert optimized['items'][0] == schema['items'][0]
+    outputs = {rt.evaluate(schema, {'seed': seed}) for seed in range(20)}
+    assert outputs == {'x', 'abcd' * times}
+
+
+def test_one_shot_evaluate_compiles_once(monkeypatch):
+    schema = [{'type': 'option', 'items': ['a', 'b']}, {'type': 'repetition', 'times': 2, 'value': 'c'}]
+    calls = []
+    optimize = rt.optimize
+    monkeypatch.setattr(rt, 'optimize', lambda s: calls.append(s) or optimize(s))
+    texts = [rt.evaluate(schema, {'seed': seed}) for seed in range(5)]
+    many = list(rt.evaluate_many(schema, 3, 1))
+    assert len(calls) == 1  # the one-shot calls share one compilation
+    compiled = rt.compile(schema)
+    assert texts == [compiled.evaluate({'seed': seed}) for seed in range(5)]
+    assert many == list(compiled.evaluate_many(3, 1))
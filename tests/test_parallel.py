@@ -0,0 +1,40 @@
+import copy
+
+import genson as rt
+
+# A Layer whose hook writes into a nested prop: every evaluation must start
+# from the schema's own value, whatever ran before it in the same process
+STATEFUL = {
+    'type': 'layer',
+    'props': {'obj': {'value': {'m': 0}}},
+    'before': [{
+        'type': 'set',
+        'path': 'obj.m',
+        'value': {'type': 'expr', 'value': {'op': '+', 'left': {'op': 'get', 'path': 'obj.m'}, 'right': 1}},
+    }],
+    'items': [[{'type': 'expr', 'value': {'op': 'get', 'path': 'obj.m'}}, {'type': 'option', 'items': ['a', 'b', 'c']}]],
+}
+
+
+def test_evaluate_leaves_schema_unchanged():
+    schema = copy.deepcopy(STATEFUL)
+    compiled = rt.compile(schema)
+    first = compiled.evaluate({'seed': 1})
+    assert compiled.evaluate({'seed': 1}) == first
+    assert rt.evaluate(schema, {'seed': 1}) == first
+    assert schema == STATEFUL
+
+
+def test_evaluate_many_sample_depends_on_seed_and_index_only():
+    samples = list(rt.evaluate_many(STATEFUL, 6, seed=3))
+    compiled = rt.compile(STATEFUL)
+    assert [compiled.evaluate({'seed': rt.derive_seed(3, i)}) for i in range(6)] == samples
+    assert list(compiled.evaluate_many(2, 3, 4)) == samples[4:]
+
+
+def test_generate_parallel_matches_single_process():
+    serial = list(rt.generate_parallel(STATEFUL, 8, seed=3, jobs=1, chunk_size=2))
+    assert serial == list(rt.evaluate_many(STATEFUL, 8, seed=3))
+    assert list(rt.generate_parallel(STATEFUL, 8, seed=3, jobs=2, chunk_size=2)) == serial
+    # A CompiledSchema reaches the workers through prepared()
+    assert list(rt.generate_parallel(rt.compile(STATEFUL), 8, seed=3, jobs=3, chunk_size=3)) == serial
@@ -0,0 +1,68 @@
+import re
+
+import genson as rt
+
+# A Layer repeating an Option and an expression over its prop three times
+SCHEMA = {'type': 'layer', 'props': {'n': 2}, 'items': {'type': 'repetition', 'times': 3, 'value': [
+    {'type': 'option', 'items': ['a', 'b']},
+    {'type': 'expr', 'value': {'op': '+', 'left': {'op': 'get', 'path': 'n'}, 'right': 1}}]}}
+
+
+def profiled(schema, **options):
+    profiler = rt.Profiler()
+    text = rt.evaluate(schema, {'seed': 1, 'profile': profiler, **options})
+    return text, profiler
+
+
+def test_counts_per_node_and_operator():
+    text, profiler = profiled(SCHEMA)
+    assert text == rt.evaluate(SCHEMA, {'seed': 1})
+    counts = {pointer: (profile.node_type, profile.calls, profile.bytes) for pointer, profile in profiler.nodes.items()}
+    assert counts == {
+        '': ('layer', 1, 12),
+        '/items': ('repetition', 1, 12),
+        '/items/value/0': ('option', 3, 3),
+        '/items/value/1': ('expr', 3, 9),
+    }
+    assert profiler.operators == {'get': 3, '+': 3}
+
+
+def test_report_sorted_by_self_time():
+    _, profiler = profiled(SCHEMA)
+    lines = profiler.report().splitlines()
+    assert lines[0].split() == ['self', 'ms', 'cum', 'ms', 'calls', 'bytes', 'node']
+    rows = lines[1:lines.index('')]
+    self_times = [float(row.split()[0]) for row in rows]
+    assert len(rows) == 4 and self_times == sorted(self_times, reverse=True)
+    assert lines[lines.index('') + 1:] == ['    calls  operator', '        3  get', '        3  +']
+    assert len(profiler.report(limit=2).splitlines()) == 1 + 2 + 4
+
+
+def test_collapsed_stacks():
+    _, profiler = profiled(SCHEMA)
+    lines = profiler.collapsed().splitlines()
+    assert all(re.fullmatch(r'[^;]+(;[^;]+)* \d+', line) for line in lines)
+    assert [line.rsplit(' ', 1)[0] for line in lines] == [
+        'layer /',
+        'layer /;repetition /items',
+        'layer /;repetition /items;expr /items/value/1',
+        'layer /;repetition /items;option /items/value/0',
+    ]
+    total = sum(int(line.rsplit(' ', 1)[1]) for line in lines)
+    assert abs(total - profiler.nodes[''].cumulative * 1e6) <= len(lines)
+
+
+def test_iterative_engine_profiled():
+    _, rendered = profiled(SCHEMA)
+    text, walked = profiled(SCHEMA, engine='iterative')
+    assert text == rt.evaluate(SCHEMA, {'seed': 1})
+    assert sorted(walked.stacks) == sorted(rendered.stacks)
+    assert {p: (n.calls, n.bytes) for p, n in walked.nodes.items()} == \
+           {p: (n.calls, n.bytes) for p, n in rendered.nodes.items()}
+    # Deeper than the render engine allows: profiled nodes walk, too
+    deep = 'x'
+    for _ in range(rt.MAX_RECURSION_DEPTH + 50):
+        deep = {'type': 'option', 'items': [deep]}
+    text, profiler = profiled(deep, max_depth=500)
+    assert text == 'x' and profiler.nodes[''].calls == 1
+    assert max(len(stack) for stack in profiler.stacks) == rt.MAX_RECURSION_DEPTH + 50
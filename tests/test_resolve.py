@@ -0,0 +1,21 @@
+import pytest
+
+import genson as rt
+
+
+def test_one_shot_evaluate_resolves_once(monkeypatch):
+    schema = {'type': 'layer', 'props': {'x': 'a'}, 'items': {'type': 'seq', 'items': [{'type': 'ref', 'to': 'x'}, 'b']}}
+    calls = []
+    resolve = rt.resolve
+    monkeypatch.setattr(rt, 'resolve', lambda s, imports=None: calls.append(s) or resolve(s, imports))
+    assert {rt.evaluate(schema, {'seed': seed}) for seed in range(10)} == {'ab'}
+    assert len(calls) == 1
+
+
+def test_unresolved_names_reported_on_every_call():
+    schema = {'type': 'ref', 'to': 'missing'}
+    for _ in range(2):
+        with pytest.raises(rt.ResolutionError) as error:
+            rt.evaluate(schema)
+        assert error.value.errors and error.value.errors[0][0] == ''
+    assert id(schema) not in rt.compiled_schemas
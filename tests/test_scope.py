@@ -0,0 +1,55 @@
+import pytest
+
+import genson as rt
+
+
+def value(v):
+    return {'type': 'expr', 'value': v}
+
+
+def set_(path, v):
+    return {'type': 'set', 'path': path, 'value': value(v)}
+
+
+def ref(path):
+    return {'type': 'ref', 'to': path}
+
+
+def outputs(schema, seed=1):
+    """The text of every engine; they must agree."""
+    compiled = rt.compile(schema)
+    return {
+        rt.evaluate_node(schema, rt.create_root_context(seed)),
+        compiled.evaluate({'seed': seed}),
+        compiled.evaluate({'seed': seed, 'engine': 'iterative'}),
+        ''.join(compiled.evaluate_iter({'seed': seed})),
+    }
+
+
+# Expected texts are the ones of the interpreter before scopes were chained,
+# where every Layer and Delegate iteration took a copy of the visible variables
+CASES = {
+    # A Layer's 'parent.' write does not change what the Layer itself reads
+    'hook_shadows': ({'type': 'layer', 'props': {'count': 1}, 'items': {
+        'type': 'layer', 'before': [set_('parent.count', 5)],
+        'items': [[ref('count'), '/', ref('parent.count')]]}}, '1/5'),
+    # ...nor what its items read after a Set wrote it
+    'set_in_items': ({'type': 'layer', 'props': {'a': 1}, 'items': [[
+        set_('parent.c', 2), ref('c'), '/', [ref('c')], '/', ref('parent.c')]]}, '//2'),
+    # Delegate iterations see the writes of the iterations before them only
+    'delegate_iterations': ({'type': 'layer', 'items': {
+        'type': 'delegate', 'weight': 3, 'separator': ',',
+        'value': [{'type': 'effect', 'items': [set_('parent.c', {'op': 'get', 'path': 'i'})]}, ref('c')]}},
+        ',1,2'),
+    # The separator is evaluated after the loop and sees every write
+    'delegate_separator': ({'type': 'layer', 'items': {
+        'type': 'delegate', 'weight': 2, 'value': [set_('parent.c', 1), 'v'], 'separator': ref('c')}}, 'v1v'),
+    # Plain writes stay in the Set node's own scope
+    'plain_set': ({'type': 'layer', 'props': {'a': 1}, 'items': [[set_('a', 7), ref('a')]]}, '1'),
+}
+
+
+@pytest.mark.parametrize('name', sorted(CASES))
+def test_parent_writes_and_shadowing(name):
+    schema, expected = CASES[name]
+    assert outputs(schema) == {expected}
@@ -0,0 +1,97 @@
+import asyncio
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+import genson as rt
+import server
+
+GREETING = [{'type': 'option', 'items': ['Hi', 'Hello', 'Hey']}, ' ',
+            {'type': 'option', 'items': ['Ann', 'Bob', 'Cy', 'Dee']}]
+
+
+async def exchange(srv, path, requests):
+    """Send request lines over a Unix socket and return the responses by id."""
+    listener = await asyncio.start_unix_server(srv.handle_connection, path=path, limit=server.MAX_LINE)
+    async with listener:
+        reader, writer = await asyncio.open_unix_connection(path)
+        try:
+            responses = {}
+            for request in requests:
+                line = request if isinstance(request, str) else json.dumps(request)
+                writer.write((line + '\n').encode('utf-8'))
+                await writer.drain()
+                response = json.loads(await reader.readline())
+                responses[response['id']] = response
+            return responses
+        finally:
+            writer.close()
+
+
+def run(tmp_path, requests, pool=None, inline_samples=8):
+    srv = server.Server(server.SchemaStore(), pool, inline_samples)
+    return asyncio.run(exchange(srv, str(tmp_path / 'genson.sock'), requests))
+
+
+def test_load_generate_schemas(tmp_path):
+    path = tmp_path / 'greeting.json'
+    path.write_text(json.dumps(GREETING))
+    responses = run(tmp_path, [
+        {'id': 1, 'op': 'load', 'name': 'file', 'path': str(path)},
+        {'id': 2, 'op': 'load', 'name': 'inline', 'schema': GREETING},
+        {'id': 3, 'op': 'generate', 'schema': 'inline', 'n': 5, 'seed': 7},
+        {'id': 4, 'op': 'schemas'},
+    ])
+    key = responses[2]['hash']
+    assert responses[1] == {'id': 1, 'name': 'file', 'hash': key}
+    assert responses[3] == {'id': 3, 'hash': key, 'seed': 7,
+                            'samples': list(rt.evaluate_many(GREETING, 5, 7))}
+    assert responses[4] == {'id': 4, 'schemas': {'file': key, 'inline': key}}
+
+
+def test_errors_keep_the_connection_open(tmp_path):
+    deep = 'x'
+    for _ in range(rt.MAX_RECURSION_DEPTH + 10):
+        deep = {'type': 'option', 'items': [deep]}
+    responses = run(tmp_path, [
+        'not json',
+        {'id': 1, 'op': 'generate', 'schema': 'missing'},
+        {'id': 2, 'op': 'nope'},
+        {'id': 3, 'op': 'load', 'name': 'g', 'schema': GREETING},
+        {'id': 4, 'op': 'generate', 'schema': 'g', 'n': -1},
+        {'id': 5, 'op': 'generate', 'schema': 'g', 'seed': 'x'},
+        {'id': 6, 'op': 'generate', 'schema': 'g', 'n': 2, 'seed': 1},
+        {'id': 7, 'op': 'load', 'name': 'deep', 'schema': deep},
+        {'id': 8, 'op': 'generate', 'schema': 'deep'},
+        {'id': 9, 'op': 'generate', 'schema': 'g', 'n': 1, 'seed': 1},
+    ])
+    assert 'error' in responses[None]
+    assert responses[1] == {'id': 1, 'error': "unknown schema 'missing'"}
+    for request_id in (2, 4, 5):
+        assert set(responses[request_id]) == {'id', 'error'}
+    assert len(responses[6]['samples']) == 2
+    assert responses[8] == {'id': 8, 'error': f'Maximum recursion depth ({rt.MAX_RECURSION_DEPTH}) exceeded'}
+    assert responses[9]['samples'] == responses[6]['samples'][:1]
+
+
+def test_pool_matches_inline(tmp_path):
+    requests = [{'id': 1, 'op': 'load', 'name': 'g', 'schema': GREETING},
+                {'id': 2, 'op': 'generate', 'schema': 'g', 'n': 2500, 'seed': 11}]
+    inline = run(tmp_path, requests)
+    with ProcessPoolExecutor(max_workers=2) as pool:
+        pooled = run(tmp_path, requests, pool, inline_samples=0)
+    assert pooled[2] == inline[2]
+    assert inline[2]['samples'] == list(rt.evaluate_many(GREETING, 2500, 11))
+
+
+def test_workers_receive_each_schema_once(monkeypatch):
+    monkeypatch.setattr(server, '_worker_schemas', server.OrderedDict())
+    store = server.SchemaStore()
+    key, compiled, prepared = store.get(store.load('g', GREETING))
+    expected = list(compiled.evaluate_many(4, 3))[2:]
+    with pytest.raises(server.SchemaNotLoaded):
+        server.evaluate_chunk(key, 2, 4, 3)
+    assert server.evaluate_chunk(key, 2, 4, 3, prepared) == expected
+    # Later tasks name the schema by hash only
+    assert server.evaluate_chunk(key, 2, 4, 3) == expected
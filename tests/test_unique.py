@@ -0,0 +1,41 @@
+import pytest
+
+import genson as rt
+
+LETTERS = {'type': 'option', 'items': list('abcdefghij')}
+PAIRS = [LETTERS, LETTERS]  # 100 combinations, each a different text
+
+
+def test_distinct_samples():
+    samples = rt.sample_unique(PAIRS, 30, seed=4)
+    assert len(set(samples)) == 30
+    assert set(samples) <= set(rt.enumerate_outputs(PAIRS))
+    assert rt.sample_unique(PAIRS, 30, seed=4) == samples
+    assert sorted(rt.sample_unique(PAIRS, 100, seed=5)) == sorted(rt.enumerate_outputs(PAIRS))
+
+
+def test_exhausted_schemas():
+    schema = {'type': 'option', 'items': ['a', 'a', 'b']}
+    assert sorted(rt.sample_unique(schema, 2, seed=1)) == ['a', 'b']
+    with pytest.raises(ValueError, match='produces only 2 distinct texts, 3 requested'):
+        rt.sample_unique(schema, 3, seed=1)
+    with pytest.raises(ValueError, match='at most 3 distinct texts, 4 requested'):
+        rt.sample_unique(schema, 4, seed=1)
+
+
+def test_repeated_texts_bounded_by_max_attempts():
+    # 2 ** 40 combinations, all producing the same text
+    schema = {'type': 'repetition', 'times': 40, 'value': {'type': 'option', 'items': ['a', 'a']}}
+    with pytest.raises(ValueError, match='found only 1 distinct texts before 50 repeated ones'):
+        rt.sample_unique(schema, 2, seed=1, max_attempts=50)
+
+
+def test_rejection_fallback():
+    # The Ref cannot be unranked: samples come from evaluate_many()
+    schema = {'type': 'layer', 'props': {'x': '-'},
+              'items': [[{'type': 'option', 'items': list('abcde')}, {'type': 'ref', 'to': 'x'}]]}
+    samples = rt.sample_unique(schema, 5, seed=2)
+    assert sorted(samples) == ['a-', 'b-', 'c-', 'd-', 'e-']
+    assert samples == [text for text in dict.fromkeys(rt.evaluate_many(schema, 100, 2))]
+    with pytest.raises(ValueError, match='found only 5 distinct texts in 200 samples, 6 requested'):
+        rt.sample_unique(schema, 6, seed=2, max_attempts=200)